@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the decode throughput of the native JSON and MessagePack decoders and of a python decoder (json.loads
+through the Decoder.decode hook).
+
+Usage: python benchmarks/decoding.py [--entries N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import timeit
+
+from garlicconfig.encoding import Decoder, JsonDecoder, MsgPackDecoder
+from garlicconfig.layer import GarlicValue
+
+
+class PythonJsonDecoder(Decoder):
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+def create_config(entries):
+    return dict(
+        ('service{index}'.format(index=index), {
+            'name': 'service {index}'.format(index=index),
+            'replicas': index % 7,
+            'ratio': index / 3.0,
+            'enabled': index % 2 == 0,
+            'endpoints': [{'host': 'host{i}.local'.format(i=i), 'port': 8000 + i} for i in range(5)],
+            'tags': ['tag{i}'.format(i=i) for i in range(5)],
+        })
+        for index in range(entries)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    value = GarlicValue(create_config(args.entries))
+    json_data = value.dumps().encode('utf-8')
+    msgpack_data = value.to_msgpack()
+    formats = (
+        ('json', json_data, JsonDecoder()),
+        ('msgpack', msgpack_data, MsgPackDecoder()),
+        ('python json', json_data, PythonJsonDecoder()),
+    )
+    for name, data, decoder in formats:
+        assert GarlicValue.from_json(data, decoder).py_value() == value.py_value()
+        duration = min(timeit.repeat(lambda: GarlicValue.from_json(data, decoder), number=args.number, repeat=3))
+        duration /= args.number
+        print('{name:<12} {size:8.2f}MiB  {duration:8.2f}ms  {throughput:8.2f}MiB/s'.format(
+            name=name,
+            size=len(data) / 2.0 ** 20,
+            duration=duration * 1000,
+            throughput=len(data) / 2.0 ** 20 / duration,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Compares loading and dumping nested config models (from/to python dicts and GarlicValue instances) using the compiled
+per-class plans against the generic path that converts every field through its to_model_value/to_garlic_value methods.
+
+Usage: python benchmarks/model_loading.py [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import timeit
+
+from garlicconfig.fields import ArrayField, BooleanField, IntegerField, StringField
+from garlicconfig.layer import GarlicValue
+from garlicconfig.models import ConfigModel, ModelField
+
+import six
+
+
+class EndpointConfig(ConfigModel):
+    host = StringField()
+    port = IntegerField()
+    secure = BooleanField(default=False)
+    aliases = ArrayField(StringField())
+
+
+class ServiceConfig(ConfigModel):
+    name = StringField()
+    replicas = IntegerField()
+    enabled = BooleanField(default=True)
+    primary = ModelField(EndpointConfig)
+    fallback = ModelField(EndpointConfig)
+
+
+class AppConfig(ConfigModel):
+    name = StringField()
+    debug = BooleanField(default=False)
+    workers = IntegerField()
+    tags = ArrayField(StringField())
+    api = ModelField(ServiceConfig)
+    db = ModelField(ServiceConfig)
+    cache = ModelField(ServiceConfig)
+
+
+ENDPOINT = {'host': 'localhost', 'port': 8080, 'secure': True, 'aliases': ['a', 'b', 'c']}
+SERVICE = {'name': 'service', 'replicas': 3, 'enabled': True, 'primary': ENDPOINT, 'fallback': ENDPOINT}
+DATA = {
+    'name': 'app', 'debug': True, 'workers': 8, 'tags': ['x', 'y', 'z'],
+    'api': SERVICE, 'db': SERVICE, 'cache': SERVICE,
+}
+
+
+def generic_from_dict(cls, value):
+    new_instance = cls()
+    for key, field in six.iteritems(cls.__meta__.fields):
+        try:
+            if isinstance(field, ModelField):
+                item = generic_from_dict(field.model_class, value[key])
+            else:
+                item = field.to_model_value(value[key])
+            setattr(new_instance, key, item)
+        except KeyError:
+            pass
+    return new_instance
+
+
+def generic_py_value(model):
+    obj = {}
+    for key, field in six.iteritems(model.__meta__.fields):
+        if isinstance(field, ModelField):
+            dict_value = generic_py_value(getattr(model, key)) or None
+        else:
+            dict_value = field.to_garlic_value(getattr(model, key))
+        if dict_value is not None:
+            obj[key] = dict_value
+    return obj
+
+
+def report(name, generic, compiled, number):
+    generic_time = min(timeit.repeat(generic, number=number, repeat=5))
+    compiled_time = min(timeit.repeat(compiled, number=number, repeat=5))
+    print('{name:<12} generic: {generic:8.2f}us  compiled: {compiled:8.2f}us  speedup: {speedup:.2f}x'.format(
+        name=name,
+        generic=generic_time / number * 1e6,
+        compiled=compiled_time / number * 1e6,
+        speedup=generic_time / compiled_time,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    model = AppConfig.from_dict(DATA)
+    assert generic_py_value(generic_from_dict(AppConfig, DATA)) == model.py_value()
+    report('from_dict', lambda: generic_from_dict(AppConfig, DATA), lambda: AppConfig.from_dict(DATA), args.number)
+    report('py_value', lambda: generic_py_value(model), model.py_value, args.number)
+
+    garlic_value = GarlicValue(DATA)
+    report(
+        'from_garlic',
+        lambda: generic_from_dict(AppConfig, garlic_value.py_value()),
+        lambda: AppConfig.from_garlic(garlic_value),
+        args.number,
+    )
+    report('garlic', lambda: GarlicValue(generic_py_value(model)), model.garlic_value, args.number)
+
+
+if __name__ == '__main__':
+    main()
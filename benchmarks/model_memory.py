@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the memory used by hydrated config models stored in per-instance dicts against compact models storing their
+fields in __slots__. Requires python 3.4 or later (tracemalloc).
+
+Usage: python benchmarks/model_memory.py [--count N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gc
+import tracemalloc
+
+from garlicconfig.fields import ArrayField, BooleanField, IntegerField, StringField
+from garlicconfig.models import ConfigModel, ModelField
+
+
+def define_models(compact_layout):
+
+    class EndpointConfig(ConfigModel):
+        compact = compact_layout
+        host = StringField()
+        port = IntegerField()
+        secure = BooleanField(default=False)
+        aliases = ArrayField(StringField())
+
+    class TenantConfig(ConfigModel):
+        compact = compact_layout
+        name = StringField()
+        plan = StringField(default='free')
+        seats = IntegerField(default=1)
+        enabled = BooleanField(default=True)
+        api = ModelField(EndpointConfig)
+        db = ModelField(EndpointConfig)
+
+    return TenantConfig
+
+
+def measure(model_class, count):
+    data = {
+        'name': 'tenant', 'plan': 'pro', 'seats': 10,
+        'api': {'host': 'api.local', 'port': 443, 'secure': True},
+        'db': {'host': 'db.local', 'port': 5432},
+    }
+    gc.collect()
+    tracemalloc.start()
+    models = [model_class.from_dict(data) for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del models
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    regular = measure(define_models(False), args.count)
+    compact = measure(define_models(True), args.count)
+    print('{count} models  dict: {regular:.1f}MiB  slots: {compact:.1f}MiB  saved: {saved:.0%}'.format(
+        count=args.count,
+        regular=regular / 2.0 ** 20,
+        compact=compact / 2.0 ** 20,
+        saved=1 - float(compact) / regular,
+    ))
+
+
+if __name__ == '__main__':
+    main()
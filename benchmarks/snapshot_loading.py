@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the startup cost of decoding every JSON config of a repository against loading a compiled snapshot of it
+(GarlicValue.from_snapshot) and memory mapping the snapshot (SnapshotValue.open).
+
+Usage: python benchmarks/snapshot_loading.py [--configs N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+from garlicconfig.layer import GarlicValue, LayerRetriever
+from garlicconfig.repositories import FileConfigRepository
+from garlicconfig.snapshot import SnapshotValue, compile_repository, write_snapshot
+
+
+def create_config(index):
+    return {
+        'name': 'service{index}'.format(index=index),
+        'replicas': index % 7,
+        'ratio': index / 3.0,
+        'endpoints': [{'host': 'host{i}.local'.format(i=i), 'port': 8000 + i, 'tls': i % 2 == 0} for i in range(20)],
+        'features': dict(('feature{i}'.format(i=i), i % 3 == 0) for i in range(50)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--configs', type=int, default=200)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        repository = FileConfigRepository(directory)
+        for index in range(args.configs):
+            repository.save('config{index}'.format(index=index), json.dumps(create_config(index)))
+        names = sorted(repository.list_configs())
+        path = os.path.join(directory, 'configs.snapshot')
+        write_snapshot(path, compile_repository(repository))
+        with open(path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+
+        def decode():
+            retriever = LayerRetriever(repository)
+            return [retriever.retrieve(name).resolve('endpoints') for name in names]
+
+        def load():
+            value = GarlicValue.from_snapshot(data)
+            return [value.resolve(name + '.endpoints') for name in names]
+
+        def mapped():
+            value = SnapshotValue.open(path)
+            return [value.resolve(name + '.endpoints') for name in names]
+
+        assert decode() == load() == mapped()
+        for name, func in (('json', decode), ('snapshot', load), ('mmap', mapped)):
+            duration = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+            print('{name:<10} {duration:8.2f}ms'.format(name=name, duration=duration * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
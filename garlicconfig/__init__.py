@@ -1,6 +1,6 @@
-from garlicconfig import exceptions, fields, layer, managers, models, repositories, utils
+from garlicconfig import cache, exceptions, fields, layer, managers, models, repositories, utils
 
 
 __all__ = [
-    'exceptions', 'fields', 'layer', 'managers', 'models', 'repositories', 'utils',
+    'cache', 'exceptions', 'fields', 'layer', 'managers', 'models', 'repositories', 'utils',
 ]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio counterparts of repositories and config managers. Reading and decoding configs releases the GIL, so the
+blocking calls get offloaded to an executor and don't block the event loop.
+Note that this module requires python 3.6 or later, it's not imported by the garlicconfig package.
+"""
+import asyncio
+import functools
+import weakref
+
+
+# get_event_loop is deprecated within coroutines, get_running_loop was only added in python 3.7.
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class _Offloader(object):
+
+    def __init__(self, executor=None, max_concurrency=None):
+        """
+        :param executor: The executor blocking calls run in, defaults to the loop's default executor.
+        :type executor: concurrent.futures.Executor
+        :param max_concurrency: Maximum number of blocking calls running at the same time. None means no limit.
+        :type max_concurrency: int
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("'max_concurrency' has to be a positive integer.")
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.__semaphores = weakref.WeakKeyDictionary()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = _running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        if self.max_concurrency is None:
+            return await loop.run_in_executor(self.executor, call)
+        # semaphores are bound to the loop they're first used in, keep one per loop while calls are running in it.
+        # Semaphores reference their loop, so they get dropped once idle: weak keys alone wouldn't release loops.
+        entry = self.__semaphores.get(loop)
+        if entry is None:
+            entry = self.__semaphores[loop] = [asyncio.Semaphore(self.max_concurrency), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await loop.run_in_executor(self.executor, call)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.__semaphores[loop]
+
+
+class AsyncConfigRepository(_Offloader):
+    """
+    Wraps a ConfigRepository to provide coroutine versions of its methods.
+    """
+
+    def __init__(self, repository, executor=None, max_concurrency=None):
+        """
+        :param repository: The wrapped repository.
+        :type repository: garlicconfig.repositories.ConfigRepository
+        """
+        super(AsyncConfigRepository, self).__init__(executor, max_concurrency)
+        self.repository = repository
+
+    async def aretrieve(self, name):
+        """
+        Coroutine version of ConfigRepository.retrieve.
+        :return: str
+        """
+        return await self._run(self.repository.retrieve, name)
+
+    async def alist_configs(self):
+        """
+        Coroutine version of ConfigRepository.list_configs.
+        :return: set of str
+        """
+        return await self._run(lambda: set(self.repository.list_configs()))
+
+
+class AsyncConfigManager(_Offloader):
+    """
+    Wraps a ConfigManager to provide coroutine versions of its methods.
+    """
+
+    def __init__(self, manager, executor=None, max_concurrency=None):
+        """
+        :param manager: The wrapped config manager.
+        :type manager: garlicconfig.managers.ConfigManager
+        """
+        super(AsyncConfigManager, self).__init__(executor, max_concurrency)
+        self.manager = manager
+
+    async def aresolve(self, path, **filters):
+        """
+        Coroutine version of ConfigManager.resolve.
+        """
+        return await self._run(self.manager.resolve, path, **filters)
+
+    async def aiterconfigs(self, **kwargs):
+        """
+        Asynchronous version of ConfigManager.iterconfigs, configs get loaded one at a time in the executor.
+        Keyword arguments are passed to iterconfigs.
+        """
+        configs = iter(self.manager.iterconfigs(**kwargs))
+        done = object()
+        while True:
+            config = await self._run(next, configs, done)
+            if config is done:
+                return
+            yield config
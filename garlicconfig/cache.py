@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class LayerCache(object):
+    """
+    An in-memory cache of decoded GarlicValue layers keyed by config name.
+    Pass an instance to LayerRetriever (or any config manager accepting a cache) so configs don't get decoded again
+    on every retrieval.
+    Note that cached layers are shared between callers, mutating them (e.g. using apply) mutates the cached copy.
+    """
+
+    def __init__(self, max_size=None, ttl=None, track_changes=False):
+        """
+        :param max_size: Maximum number of layers to keep. Least recently used layers get evicted first.
+        :type max_size: int
+        :param ttl: Number of seconds a layer stays in the cache. None means layers never expire.
+        :type ttl: float
+        :param track_changes: If set, cached layers are dropped as soon as the repository reports their config changed.
+        :type track_changes: bool
+        """
+        if max_size is not None and max_size < 1:
+            raise ValueError("'max_size' has to be a positive integer.")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("'ttl' has to be a positive number.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.track_changes = track_changes
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, name, repository=None):
+        """
+        Look up a cached layer.
+        :param name: Name of the config.
+        :param repository: If provided, the layer is considered stale when the repository reports its config changed
+        since the layer was cached.
+        :type repository: garlicconfig.repositories.ConfigRepository
+        :return: GarlicValue or None if the layer is not cached or is stale.
+        """
+        with self.__lock:
+            entry = self.__entries.get(name)
+            if entry is not None and entry[1] is not None and entry[1] <= _clock():
+                del self.__entries[name]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+        # checking for changes hits the repository (e.g. a stat call), other lookups shouldn't wait for it.
+        stale = repository is not None and entry[2] is not None and repository.changed_since(entry[2])
+        with self.__lock:
+            current = self.__entries.get(name)
+            if stale:
+                if current is entry:  # unless it got replaced meanwhile.
+                    del self.__entries[name]
+                self.misses += 1
+                return None
+            if current is entry:
+                self.__entries[name] = self.__entries.pop(name)  # re-insert so it becomes the most recently used one.
+            self.hits += 1
+            return entry[0]
+
+    def set(self, name, value, version=None):
+        """
+        Store a decoded layer in the cache.
+        :param name: Name of the config.
+        :param value: The decoded layer.
+        :type value: GarlicValue
+        :param version: The repository version token of the config the layer was decoded from.
+        """
+        expires_at = _clock() + self.ttl if self.ttl is not None else None
+        with self.__lock:
+            self.__entries.pop(name, None)
+            self.__entries[name] = (value, expires_at, version)
+            if self.max_size is not None:
+                while len(self.__entries) > self.max_size:
+                    self.__entries.popitem(last=False)
+
+    def invalidate(self, name):
+        """
+        Drop the cached layer for the given config name, if any.
+        """
+        with self.__lock:
+            self.__entries.pop(name, None)
+
+    def clear(self):
+        """
+        Drop all cached layers. Hit/miss counters are kept.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def __contains__(self, name):
+        return name in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface, run `python -m garlicconfig --help` for usage.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import sys
+import time
+
+from garlicconfig.layer import LayerRetriever
+from garlicconfig.models import ConfigModel
+from garlicconfig.repositories import FileConfigRepository
+from garlicconfig.snapshot import compile_repository, write_snapshot
+
+from six.moves import map
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+_worker = None
+
+
+def load_model_class(spec):
+    """
+    Import a config model class given as 'package.module:Class'.
+    """
+    module_name, _, class_name = spec.partition(':')
+    if not module_name or not class_name:
+        raise ValueError("Model has to be given as 'package.module:Class'.")
+    model_class = importlib.import_module(module_name)
+    for name in class_name.split('.'):
+        model_class = getattr(model_class, name)
+    if not isinstance(model_class, type) or not issubclass(model_class, ConfigModel):
+        raise ValueError("'{spec}' is not a ConfigModel.".format(spec=spec))
+    return model_class
+
+
+class Validator(object):
+    """
+    Decodes and validates configs of a file repository against a config model.
+    """
+
+    def __init__(self, root_path, model_spec):
+        self.retriever = LayerRetriever(FileConfigRepository(root_path))
+        self.model_class = load_model_class(model_spec)
+
+    def __call__(self, name):
+        """
+        :return: dict describing the result, see validate.
+        """
+        started = _clock()
+        result = {'config': name, 'valid': False, 'errors': []}
+        try:
+            model = self.model_class.from_garlic(self.retriever.retrieve(name))
+            result['errors'] = [{'path': error.path, 'message': str(error)} for error in model.validation_errors()]
+            result['valid'] = not result['errors']
+        except Exception as error:  # decoding errors, broken models, ... are reported, not raised.
+            message = '{type}: {error}'.format(type=type(error).__name__, error=error)
+            result['errors'] = [{'path': None, 'message': message}]
+        result['duration_ms'] = round((_clock() - started) * 1000, 3)
+        return result
+
+
+def _init_worker(root_path, model_spec):
+    global _worker
+    _worker = Validator(root_path, model_spec)
+
+
+def _validate(name):
+    return _worker(name)
+
+
+def validate(args, output):
+    """
+    Validate configs, writing one JSON object per config as soon as it's done followed by a summary object.
+    :return: exit code, 1 if any of the configs is invalid.
+    """
+    started = _clock()
+    names = args.configs or sorted(FileConfigRepository(args.root).list_configs())
+    jobs = max(1, min(args.jobs or multiprocessing.cpu_count(), len(names)))
+    if jobs == 1:
+        pool = None
+        results = map(Validator(args.root, args.model), names)
+    else:
+        pool = multiprocessing.Pool(jobs, _init_worker, (args.root, args.model))
+        # small chunks keep results streaming while still amortizing inter-process overhead on large repositories.
+        chunk_size = max(1, min(32, len(names) // (jobs * 8)))
+        results = pool.imap_unordered(_validate, names, chunk_size)
+    invalid = 0
+    try:
+        for result in results:
+            invalid += not result['valid']
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    output.write(json.dumps({'summary': {
+        'configs': len(names),
+        'invalid': invalid,
+        'jobs': jobs,
+        'duration_ms': round((_clock() - started) * 1000, 3),
+    }}, sort_keys=True) + '\n')
+    output.flush()
+    return 1 if invalid else 0
+
+
+def compile_snapshot(args, output):
+    """
+    Pack the configs of a file repository into a single snapshot file, see garlicconfig.snapshot.
+    :return: exit code
+    """
+    started = _clock()
+    repository = FileConfigRepository(args.root)
+    names = args.configs or sorted(repository.list_configs())
+    data = compile_repository(repository, names=names)
+    write_snapshot(args.output, data)
+    output.write(json.dumps({'summary': {
+        'configs': len(names),
+        'bytes': len(data),
+        'duration_ms': round((_clock() - started) * 1000, 3),
+    }}, sort_keys=True) + '\n')
+    output.flush()
+    return 0
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='python -m garlicconfig', description='GarlicConfig command line tools.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    validate_parser = commands.add_parser(
+        'validate',
+        help='Validate configs of a file repository against a config model.',
+        description='Validate JSON configs of a file repository against a config model. Results are written as JSON '
+                    'lines as soon as each config is done: {"config", "valid", "errors": [{"path", "message"}], '
+                    '"duration_ms"}, followed by a {"summary": {...}} line. Exits with 1 if any config is invalid.',
+    )
+    validate_parser.add_argument('root', help='Root directory of the repository.')
+    validate_parser.add_argument('--model', required=True, help="The config model, e.g. 'package.module:Class'.")
+    validate_parser.add_argument('--config', dest='configs', action='append', help='Only validate this config, '
+                                 'can be given more than once.')
+    validate_parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of worker processes, defaults '
+                                 'to the number of CPUs.')
+    validate_parser.set_defaults(handler=validate)
+
+    compile_parser = commands.add_parser(
+        'compile',
+        help='Pack the configs of a file repository into a single binary snapshot.',
+        description='Decode the configs of a file repository and pack them into one binary snapshot whose root maps '
+                    'config names to their values. Snapshots can be memory mapped at startup using '
+                    'garlicconfig.snapshot.SnapshotValue.open, without parsing anything.',
+    )
+    compile_parser.add_argument('root', help='Root directory of the repository.')
+    compile_parser.add_argument('output', help='Path of the snapshot file, replaced atomically.')
+    compile_parser.add_argument('--config', dest='configs', action='append', help='Only include this config, can '
+                                'be given more than once.')
+    compile_parser.set_defaults(handler=compile_snapshot)
+    return parser
+
+
+def main(argv=None, output=None):
+    """
+    Entry point of `python -m garlicconfig`.
+    :return: exit code
+    """
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'model', None):
+        try:
+            load_model_class(args.model)
+        except (ImportError, AttributeError, ValueError) as error:
+            parser.error(str(error))
+    return args.handler(args, output or sys.stdout)
@@ -15,3 +15,14 @@ cdef class Decoder(object):
 cdef class JsonDecoder(Decoder):
 
     cdef NativeJsonDecoder* json_decoder
+
+
+cdef extern from "msgpack_utility.cpp":
+
+    cdef cppclass NativeMsgPackDecoder "MsgPackDecoder" (NativeDecoder):
+        pass
+
+
+cdef class MsgPackDecoder(Decoder):
+
+    cdef NativeMsgPackDecoder* msgpack_decoder
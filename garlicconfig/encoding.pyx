@@ -7,6 +7,22 @@ import six
 
 
 cdef class Decoder(object):
+    """
+    Base class for decoders. Native decoders decode configs without holding the GIL. To support other formats from
+    python, subclass Decoder and override decode, LayerRetriever and config managers will call it instead.
+    """
+
+    def decode(self, data):
+        """
+        Decode the content of a config.
+        :param data: bytes or a memoryview holding the content of a config.
+        :return: GarlicValue or a basic python value (dict, list, str, ...).
+        """
+        from garlicconfig.layer import GarlicValue
+
+        if not self.native_decoder:
+            raise NotImplementedError('Decoders without a native decoder have to implement decode.')
+        return GarlicValue.from_json(data, self)
 
     def __dealloc__(self):
         if self.native_decoder:
@@ -19,6 +35,15 @@ cdef class JsonDecoder(Decoder):
         self.native_decoder = self.json_decoder = new NativeJsonDecoder()
 
 
+cdef class MsgPackDecoder(Decoder):
+    """
+    Decodes MessagePack configs, a binary format that's a lot cheaper to decode than JSON.
+    """
+
+    def __init__(self):
+        self.native_decoder = self.msgpack_decoder = new NativeMsgPackDecoder()
+
+
 @six.add_metaclass(ABCMeta)
 class ConfigEncoder(object):
 
@@ -29,13 +54,13 @@ class ConfigEncoder(object):
 
 class PrettyJSONEncoder(json.JSONEncoder):
     """
-    This encoder is not the most efficient at all, but it produces a pretty json format. It solves the problem with
-    long arrays. Default encoder puts every single element on a separate line but this encoder does a smart job.
+    Produces a pretty json format for python objects. It solves the problem with long arrays. Default encoder puts
+    every single element on a separate line but this encoder does a smart job.
+    GarlicValue.dumps produces the same format natively and is a lot faster, this encoder is kept for python objects.
     """
     def __init__(self, *args, **kwargs):
         super(PrettyJSONEncoder, self).__init__(*args, **kwargs)
         self.current_indent = 0
-        self.current_indent_str = ''
 
     @staticmethod
     def __has_non_primitive(obj):
@@ -46,35 +71,25 @@ class PrettyJSONEncoder(json.JSONEncoder):
         return False
 
     def encode(self, obj):
+        encode_primitive = super(PrettyJSONEncoder, self).encode
         if isinstance(obj, (list, tuple)):
-            primitives_only = not self.__has_non_primitive(obj)
-            output = []
-            if primitives_only:
-                for item in obj:
-                    output.append(super(PrettyJSONEncoder, self).encode(item))
-                return '[' + ', '.join(output) + ']'
-            else:
-                self.current_indent += self.indent
-                self.current_indent_str = ''.join([' ' for x in range(self.current_indent)])
-                for item in obj:
-                    output.append(self.current_indent_str + self.encode(item))
-                self.current_indent -= self.indent
-                self.current_indent_str = ''.join([' ' for x in range(self.current_indent)])
-                return '[\n' + ',\n'.join(output) + '\n' + self.current_indent_str + ']'
+            if not self.__has_non_primitive(obj):
+                return '[' + ', '.join([encode_primitive(item) for item in obj]) + ']'
+            outer_indent_str = ' ' * self.current_indent
+            self.current_indent += self.indent
+            indent_str = ' ' * self.current_indent
+            output = [indent_str + self.encode(item) for item in obj]
+            self.current_indent -= self.indent
+            return '[\n' + ',\n'.join(output) + '\n' + outer_indent_str + ']'
         elif isinstance(obj, dict):
-            output = []
+            outer_indent_str = ' ' * self.current_indent
             self.current_indent += self.indent
-            self.current_indent_str = ''.join([' ' for x in range(self.current_indent)])
-            for key in sorted(obj):
-                value = obj[key]
-                output.append(
-                    self.current_indent_str + super(PrettyJSONEncoder, self).encode(key) + ': ' + self.encode(value)
-                )
+            indent_str = ' ' * self.current_indent
+            output = [indent_str + encode_primitive(key) + ': ' + self.encode(obj[key]) for key in sorted(obj)]
             self.current_indent -= self.indent
-            self.current_indent_str = "".join([" " for x in range(self.current_indent)])
-            return '{\n' + ',\n'.join(output) + '\n' + self.current_indent_str + '}'
+            return '{\n' + ',\n'.join(output) + '\n' + outer_indent_str + '}'
         else:
-            return super(PrettyJSONEncoder, self).encode(obj)
+            return encode_primitive(obj)
 
 
 class JsonEncoder(ConfigEncoder):
@@ -82,12 +97,30 @@ class JsonEncoder(ConfigEncoder):
     def encode(self, config, pretty=True):
         if not isinstance(config, ConfigModel):
             raise TypeError("'config' must be a ConfigModel.")
+        if config.__meta__.dumps_natively:
+            # encoding the native value skips building python dicts and the pure python pretty printer.
+            try:
+                return config.garlic_value().dumps(pretty)
+            except (TypeError, OverflowError):
+                pass  # values native ones can't hold (e.g. huge integers or non-str keys), encode py_value instead.
         if pretty:
             return json.dumps(config.py_value(), sort_keys=True, indent=2, cls=PrettyJSONEncoder)
         else:
             return json.dumps(config.py_value(), sort_keys=True, separators=(',', ':'))
 
 
+class MsgPackEncoder(ConfigEncoder):
+
+    def encode(self, config, pretty=True):
+        """
+        Encode a config as MessagePack, pretty is ignored since the format is binary.
+        :return: bytes
+        """
+        if not isinstance(config, ConfigModel):
+            raise TypeError("'config' must be a ConfigModel.")
+        return config.garlic_value().to_msgpack()
+
+
 def encode(config, cls=None, pretty=True):
     """
     Encodes a config instance.
@@ -1,3 +1,10 @@
+from cython.operator cimport dereference as deref, preincrement as inc
+from libcpp.memory cimport shared_ptr
+from libcpp.string cimport string
+from libcpp.vector cimport vector
+
+from garlicconfig.layer cimport LayerValue, NotFoundPtr, ObjectValue
+
 from garlicconfig.exceptions import ValidationError
 from garlicconfig.utils import assert_value_type
 
@@ -5,11 +12,138 @@ import six
 from six.moves import map
 
 
-cpdef validate_model_fields(model):
-    cdef ConfigField field
-    cdef str key
-    for key, field in six.iteritems(model.__meta__.fields):
-        field.native_validate(getattr(model, key), True)
+cdef enum GarlicLoader:
+    LOAD_VALUE
+    LOAD_CONVERTED
+    LOAD_MODEL
+    LOAD_MODELS
+
+
+cdef enum GarlicDumper:
+    DUMP_VALUE
+    DUMP_CONVERTED
+    DUMP_MODEL
+
+
+cpdef tuple compile_garlic_load_plan(meta):
+    """
+    Build the plan used by load_model_from_garlic for the given ModelMetaInfo.
+    """
+    from garlicconfig.models import ModelField
+    cdef list plan = []
+    for key, converter in meta.load_plan:
+        field = meta.fields[key]
+        # nested models overriding from_dict are loaded through it, like the rest of the converted fields.
+        if type(field) is ModelField and field.model_class.__meta__.loads_natively:
+            plan.append((key, key.encode('utf-8'), LOAD_MODEL, field))
+        elif type(field) is ArrayField and type(field.field) is ModelField and \
+                field.field.model_class.__meta__.loads_natively:
+            plan.append((key, key.encode('utf-8'), LOAD_MODELS, field))
+        elif converter is None:
+            plan.append((key, key.encode('utf-8'), LOAD_VALUE, None))
+        else:
+            plan.append((key, key.encode('utf-8'), LOAD_CONVERTED, converter))
+    return tuple(plan)
+
+
+cpdef tuple compile_garlic_dump_plan(meta):
+    """
+    Build the plan used by dump_model_to_garlic for the given ModelMetaInfo.
+    """
+    from garlicconfig.models import ModelField
+    cdef list plan = []
+    for key, converter in meta.dump_plan:
+        if type(meta.fields[key]) is ModelField:
+            plan.append((key.encode('utf-8'), key, DUMP_MODEL, converter))
+        elif converter is None:
+            plan.append((key.encode('utf-8'), key, DUMP_VALUE, None))
+        else:
+            plan.append((key.encode('utf-8'), key, DUMP_CONVERTED, converter))
+    return tuple(plan)
+
+
+cpdef GarlicValue dump_model_to_garlic(model):
+    """
+    Build a GarlicValue representing the given model without going through python dicts.
+    """
+    return GarlicValue.native_load(native_dump_model(model))
+
+
+cdef shared_ptr[LayerValue] native_dump_model(model) except *:
+    cdef ObjectValue* object_value = new ObjectValue()
+    cdef shared_ptr[LayerValue] result = shared_ptr[LayerValue](object_value)
+    cdef shared_ptr[LayerValue] member
+    cdef string native_key
+    cdef int kind
+    for native_key, key, kind, converter in model.__meta__.garlic_dump_plan:
+        value = getattr(model, key)
+        if kind == DUMP_MODEL:
+            if not value:
+                continue
+            if not type(value).__meta__.dumps_natively:
+                value = converter(value)  # ModelField.to_garlic_value, going through the overridden py_value.
+                if value is None:
+                    continue
+                member = GarlicValue.init_layer_value(value)
+            else:
+                member = native_dump_model(value)
+                if deref(member).begin_member() == deref(member).end_member():
+                    continue  # if data is empty, skip it.
+        else:
+            if kind == DUMP_CONVERTED:
+                value = converter(value)
+            if value is None:
+                continue
+            member = GarlicValue.init_layer_value(value)
+        deref(object_value).set(native_key, member)
+    return result
+
+
+cpdef load_model_from_garlic(GarlicValue value, model_class):
+    """
+    Instantiate a model and load it by walking the native value once. Members not matching any field are never
+    converted and nested models are loaded straight from the native values.
+    """
+    return native_load_model(value.native_value, model_class)
+
+
+cdef native_load_model(const shared_ptr[LayerValue]& value, model_class):
+    cdef const shared_ptr[LayerValue]* member
+    cdef string native_key
+    cdef int kind
+    instance = model_class()
+    for key, native_key, kind, arg in model_class.__meta__.garlic_load_plan:
+        # field names can't contain dots, resolving them as paths is safe.
+        member = &deref(value).resolve(native_key)
+        if deref(member) == NotFoundPtr:
+            continue
+        if kind == LOAD_VALUE:
+            setattr(instance, key, GarlicValue.map_value(deref(member)))
+        elif kind == LOAD_CONVERTED:
+            setattr(instance, key, arg(GarlicValue.map_value(deref(member))))
+        elif kind == LOAD_MODEL:
+            setattr(instance, key, native_load_field_model(deref(member), arg))
+        elif deref(member).get().is_array():
+            setattr(instance, key, native_load_models(deref(member), arg.field) or None)
+        else:
+            setattr(instance, key, arg.to_model_value(GarlicValue.map_value(deref(member))))
+    return instance
+
+
+cdef native_load_field_model(const shared_ptr[LayerValue]& value, field):
+    if deref(value).is_object():
+        return native_load_model(value, field.model_class)
+    return field.to_model_value(GarlicValue.map_value(value))
+
+
+cdef list native_load_models(const shared_ptr[LayerValue]& value, field):
+    cdef list models = []
+    cdef vector[shared_ptr[LayerValue]].const_iterator it = deref(value).begin_element()
+    cdef vector[shared_ptr[LayerValue]].const_iterator end = deref(value).end_element()
+    while it != end:
+        models.append(native_load_field_model(deref(it), field))
+        inc(it)
+    return models
 
 
 cdef class ConfigField(object):
@@ -202,3 +336,246 @@ class ArrayField(ConfigField):
         return {
             'element_info': self.field.get_field_desc_dict()
         }
+
+
+cdef format_path(path):
+    # paths are kept as (parent, segment) pairs while validating, they only get formatted when reporting errors.
+    cdef list segments = []
+    while path is not None:
+        path, segment = path
+        segments.append(six.text_type(segment))
+    return '.'.join(reversed(segments)) or None
+
+
+cdef fail(list errors, message, path):
+    cdef object error = ValidationError(message)
+    error.path = format_path(path)
+    if errors is None:
+        raise error
+    errors.append(error)
+
+
+cdef class FieldCheck(object):
+    """
+    Validates values the same way the validate method of its field does.
+    """
+    cdef readonly object field
+
+    def __init__(self, field):
+        self.field = field
+
+    cdef int run(self, value, path, list errors) except -1:
+        try:
+            self.field.validate(value)
+        except ValidationError as error:
+            error.path = format_path(path)
+            if errors is None:
+                raise
+            errors.append(error)
+        return 0
+
+
+cdef class TypeCheck(FieldCheck):
+    cdef object expected_type
+
+    def __init__(self, field, expected_type):
+        super(TypeCheck, self).__init__(field)
+        self.expected_type = expected_type
+
+    cdef int run(self, value, path, list errors) except -1:
+        if not isinstance(value, self.expected_type):
+            fail(errors, "Expected '{expected}' for '{key}', but got '{got}'.".format(
+                expected=self.expected_type.__name__,
+                key=self.field.name,
+                got=type(value).__name__
+            ), path)
+            return 1
+        return 0
+
+
+cdef class StringCheck(TypeCheck):
+    cdef object choices
+
+    def __init__(self, field):
+        try:
+            super(StringCheck, self).__init__(field, basestring)
+        except NameError:
+            super(StringCheck, self).__init__(field, six.text_type)
+        self.choices = None
+        if field.choices:
+            try:
+                self.choices = frozenset(field.choices)
+            except TypeError:
+                self.choices = field.choices
+
+    cdef int run(self, value, path, list errors) except -1:
+        if TypeCheck.run(self, value, path, errors):
+            return 1
+        if self.choices is not None and value not in self.choices:
+            fail(errors, "Value '{given}' for '{key}' is not accepted. Choices are '{choices}'".format(
+                given=value,
+                key=self.field.name,
+                choices="', '".join(self.field.choices)
+            ), path)
+            return 1
+        return 0
+
+
+cdef class IntegerCheck(TypeCheck):
+    cdef object domain
+
+    def __init__(self, field):
+        super(IntegerCheck, self).__init__(field, int)
+        self.domain = tuple(field.domain) if field.domain else None
+
+    cdef int run(self, value, path, list errors) except -1:
+        if TypeCheck.run(self, value, path, errors):
+            return 1
+        if self.domain is not None and not (self.domain[0] <= value <= self.domain[1]):
+            fail(errors, "Value '{value}' for '{key}' has to be in range {domain}.".format(
+                value=value,
+                key=self.field.name,
+                domain=self.field.domain
+            ), path)
+            return 1
+        return 0
+
+
+cdef class ArrayCheck(TypeCheck):
+    cdef FieldCheck element
+
+    def __init__(self, field, FieldCheck element):
+        super(ArrayCheck, self).__init__(field, list)
+        self.element = element
+
+    cdef int run(self, value, path, list errors) except -1:
+        cdef Py_ssize_t index
+        if TypeCheck.run(self, value, path, errors):
+            return 1
+        for index in range(len(value)):
+            self.element.run(value[index], (path, index), errors)
+        return 0
+
+
+cdef class ModelCheck(TypeCheck):
+
+    def __init__(self, field):
+        super(ModelCheck, self).__init__(field, field.model_class)
+
+    cdef int run(self, value, path, list errors) except -1:
+        if TypeCheck.run(self, value, path, errors):
+            return 1
+        if errors is None and has_custom_validate(value):
+            try:
+                value.validate()
+            except ValidationError as error:
+                # paths of errors raised by the nested model are relative to it.
+                nested_path = getattr(error, 'path', None)
+                error.path = format_path(path if nested_path is None else (path, nested_path))
+                raise
+        else:
+            validate_model(value, path, errors)
+        return 0
+
+
+cdef class ModelFieldCheck(object):
+    """
+    Validates the value of a field of a model, including the null check.
+    """
+    cdef readonly object key
+    cdef object name
+    cdef bint nullable
+    cdef FieldCheck check
+
+    def __init__(self, key, field, FieldCheck check):
+        self.key = key
+        self.name = field.name
+        self.nullable = field.nullable
+        self.check = check
+
+
+cdef FieldCheck compile_check(field):
+    from garlicconfig.models import ModelField
+    if type(field) is StringField:
+        return StringCheck(field)
+    elif type(field) is BooleanField:
+        return TypeCheck(field, bool)
+    elif type(field) is IntegerField:
+        return IntegerCheck(field)
+    elif type(field) is ArrayField:
+        return ArrayCheck(field, compile_check(field.field))
+    elif type(field) is ModelField:
+        return ModelCheck(field)
+    return FieldCheck(field)
+
+
+cpdef tuple compile_validation_plan(meta):
+    """
+    Build the plan used to validate models for the given ModelMetaInfo. Built-in fields get specialized checks, other
+    fields are validated using their validate method.
+    """
+    return tuple([ModelFieldCheck(key, field, compile_check(field)) for key, field in six.iteritems(meta.fields)])
+
+
+cdef object base_validate = None
+
+
+cdef bint has_custom_validate(model) except -1:
+    global base_validate
+    if base_validate is None:
+        from garlicconfig.models import ConfigModel
+        base_validate = six.get_unbound_function(ConfigModel.validate)
+    return six.get_unbound_function(type(model).validate) is not base_validate
+
+
+cdef int run_plan(model, parent, list errors) except -1:
+    cdef ModelFieldCheck field_check
+    for field_check in model.__meta__.validation_plan:
+        value = getattr(model, field_check.key)
+        path = (parent, field_check.key)
+        if value is None:
+            if not field_check.nullable:
+                fail(errors, "Value for '{key}' is not allowed to be null.".format(key=field_check.name), path)
+        else:
+            field_check.check.run(value, path, errors)
+    return 0
+
+
+cdef int validate_model(model, path, list errors) except -1:
+    cdef Py_ssize_t count = len(errors) if errors is not None else 0
+    run_plan(model, path, errors)
+    # custom validate methods only run once fields are valid, they'd report the first invalid field again otherwise.
+    if errors is not None and len(errors) == count and has_custom_validate(model):
+        try:
+            model.validate()
+        except ValidationError as error:
+            if getattr(error, 'path', None) is None:
+                error.path = format_path(path)
+            errors.append(error)
+    return 0
+
+
+cpdef validate_model_fields(model):
+    """
+    Validate all fields of the given model, raising ValidationError for the first invalid one.
+    """
+    run_plan(model, None, None)
+
+
+cpdef list collect_validation_errors(model):
+    """
+    Validate the given model, collecting all errors instead of stopping at the first one.
+    :return: list of ValidationError instances, each with a path attribute holding the dot separated path of the
+    invalid value (None for errors raised by the validate method of the model itself).
+    """
+    cdef list errors = []
+    validate_model(model, None, errors)
+    return errors
+
+
+cpdef list validate_many(models):
+    """
+    Validate many models at once.
+    :return: list holding the list of errors for each of the models, see collect_validation_errors.
+    """
+    return [collect_validation_errors(model) for model in models]
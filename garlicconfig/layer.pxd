@@ -69,6 +69,7 @@ cdef extern from "GarlicConfig/garlicconfig.h" namespace "garlic":
 cdef class GarlicValue(object):
 
     cdef shared_ptr[LayerValue] native_value
+    cdef dict py_cache
 
     @staticmethod
     cdef map_object(const shared_ptr[LayerValue]& value)
@@ -79,15 +80,46 @@ cdef class GarlicValue(object):
     @staticmethod
     cdef map_value(const shared_ptr[LayerValue]& value)
 
+    @staticmethod
+    cdef map_frozen(const shared_ptr[LayerValue]& value, dict cache)
+
+    cdef convert(self, const shared_ptr[LayerValue]& value)
+    cdef GarlicValue view(self, const shared_ptr[LayerValue]& value)
+    cdef child(self, const shared_ptr[LayerValue]& value)
+
     @staticmethod
     cdef GarlicValue native_load(const shared_ptr[LayerValue]& value)
 
+    cdef const shared_ptr[LayerValue]* find(self, path) except NULL
+    cdef LayerValue* find_scalar(self, path, expected_type) except? NULL
+
+    @staticmethod
+    cdef str native_type_name(LayerValue* value)
+
+    @staticmethod
+    cdef shared_ptr[LayerValue] init_layer_value(object value) except *
+
     @staticmethod
-    cdef shared_ptr[LayerValue] init_layer_value(object value) except +
+    cdef shared_ptr[LayerValue] build_layer_value(object value, dict keys) except *
+
+    @staticmethod
+    cdef bytes encode_key(object key)
+
+    @staticmethod
+    cdef shared_ptr[LayerValue] build_other_layer_value(object value, dict keys) except *
+
+
+cdef class CompiledPath(object):
+
+    cdef vector[string] segments
+    cdef readonly object path
 
 
 cdef class LayerRetriever(object):
 
     cdef ConfigRepository repo
     cdef Decoder decoder
+    cdef readonly object cache
+
+    cdef list load(self, const vector[string]& names, unsigned int workers)
 
@@ -1,6 +1,12 @@
-from collections import Iterable
+try:
+    from collections.abc import Iterable, Mapping
+except ImportError:
+    from collections import Iterable, Mapping
+from multiprocessing import cpu_count
+from types import MappingProxyType
 
 from cython.operator cimport dereference as deref, preincrement as inc
+from libcpp cimport bool as cbool
 from libcpp.map cimport map
 from libcpp.memory cimport shared_ptr
 from libcpp.string cimport string
@@ -9,7 +15,7 @@ import six
 
 from garlicconfig.encoding cimport NativeDecoder, JsonDecoder
 from garlicconfig.exceptions cimport raise_py_error
-from garlicconfig.repositories cimport NativeConfigRepository
+from garlicconfig.repositories cimport NativeConfigRepository, RepositoryLock
 
 
 try:
@@ -18,16 +24,194 @@ except NameError:
     available_str = six.text_type
 
 
+cdef extern from "utility.cpp":
+
+    cdef shared_ptr[LayerValue] load_value_from_memory(NativeDecoder* decoder, const char* data, size_t size) except +raise_py_error
+
+    cdef cppclass BatchLoader:
+        BatchLoader(NativeConfigRepository* repo, RepositoryLock* lock, NativeDecoder* decoder, const vector[string]& names) except +
+        void run(unsigned int workers) nogil
+        void check() except +raise_py_error
+        const vector[shared_ptr[LayerValue]]& results()
+
+    cdef const shared_ptr[LayerValue]& resolve_segments(const shared_ptr[LayerValue]& value, const vector[string]& segments)
+    cdef const shared_ptr[LayerValue]& get_member(const shared_ptr[LayerValue]& value, const string& key)
+    cdef const shared_ptr[LayerValue]& get_element(const shared_ptr[LayerValue]& value, size_t index)
+    cdef size_t layer_size(const shared_ptr[LayerValue]& value)
+    cdef string dump_value(const shared_ptr[LayerValue]& value, cbool pretty) except +
+
+    cdef cppclass ValueChange:
+        vector[string] path
+        shared_ptr[LayerValue] value
+
+    cdef vector[ValueChange] diff_values(const shared_ptr[LayerValue]& first, const shared_ptr[LayerValue]& second) except +
+    cdef shared_ptr[LayerValue] patch_value(const shared_ptr[LayerValue]& value, const vector[string]& path, const shared_ptr[LayerValue]& member) except +
+
+
+cdef extern from "msgpack_utility.cpp":
+
+    cdef shared_ptr[LayerValue] load_msgpack(const char* data, size_t size) except +raise_py_error
+    cdef string dump_msgpack(const shared_ptr[LayerValue]& value) except +
+
+
+cdef extern from "snapshot_utility.cpp":
+
+    cdef string dump_snapshot(const shared_ptr[LayerValue]& value) except +
+    cdef shared_ptr[LayerValue] load_snapshot(const char* data, size_t size) except +
+
+
+def compile_path(path):
+    """
+    Compile a dot separated path so it can be resolved repeatedly without any string processing.
+    :param path: Dot separated path, e.g. 'db.pool.size'
+    :return: CompiledPath
+    """
+    return CompiledPath(path)
+
+
+cdef class CompiledPath(object):
+    """
+    A pre-split path that can be passed to GarlicValue.resolve instead of a dot separated str.
+    Calling a compiled path with a GarlicValue resolves it against that value.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for segment in path.split('.'):
+            self.segments.push_back(segment.encode('utf-8'))
+
+    def __call__(self, GarlicValue value):
+        return value.resolve(self)
+
+    def __repr__(self):
+        return 'CompiledPath({path!r})'.format(path=self.path)
+
+
 cdef class GarlicValue(object):
 
     def __init__(self, value):
         self.native_value = GarlicValue.init_layer_value(value)
 
     @staticmethod
-    cdef shared_ptr[LayerValue] init_layer_value(object value) except +:
+    def from_json(data, Decoder decoder=None):
+        """
+        Decode a GarlicValue straight from its serialized form, without building python objects first.
+        :param data: bytes (or any object supporting the buffer protocol) or str holding the serialized value.
+        :param decoder: The decoder to use, defaults to JsonDecoder.
+        :type decoder: garlicconfig.encoding.Decoder
+        :return: GarlicValue
+        """
+        cdef const unsigned char[:] buffer
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        decoder = decoder or JsonDecoder()
+        if not decoder.native_decoder:
+            value = decoder.decode(data)
+            return value if isinstance(value, GarlicValue) else GarlicValue(value)
+        buffer = data
+        if buffer.shape[0] == 0:
+            return GarlicValue.native_load(load_value_from_memory(decoder.native_decoder, b'', 0))
+        return GarlicValue.native_load(
+            load_value_from_memory(decoder.native_decoder, <const char*>&buffer[0], buffer.shape[0])
+        )
+
+    @staticmethod
+    def from_msgpack(data):
+        """
+        Decode a GarlicValue from MessagePack, see to_msgpack.
+        :param data: bytes or any object supporting the buffer protocol.
+        :return: GarlicValue
+        """
+        cdef const unsigned char[:] buffer = data
+        if buffer.shape[0] == 0:
+            return GarlicValue.native_load(load_msgpack(b'', 0))
+        return GarlicValue.native_load(load_msgpack(<const char*>&buffer[0], buffer.shape[0]))
+
+    def to_msgpack(self):
+        """
+        Encode the value as MessagePack.
+        :return: bytes
+        """
+        return dump_msgpack(self.native_value)
+
+    @staticmethod
+    def from_snapshot(data):
+        """
+        Load a GarlicValue from a binary snapshot (see to_snapshot). Unlike decoding, nothing needs to be parsed.
+        Use garlicconfig.snapshot.SnapshotValue to read snapshots in place without loading them.
+        :param data: bytes or any object supporting the buffer protocol, e.g. a memory mapped file.
+        :return: GarlicValue
+        """
+        cdef const unsigned char[:] buffer = data
+        if buffer.shape[0] == 0:
+            raise ValueError('Not a garlic snapshot.')
+        return GarlicValue.native_load(load_snapshot(<const char*>&buffer[0], buffer.shape[0]))
+
+    def to_snapshot(self):
+        """
+        Serialize the value to the compact binary snapshot format.
+        :return: bytes
+        """
+        return dump_snapshot(self.native_value)
+
+    @staticmethod
+    cdef shared_ptr[LayerValue] init_layer_value(object value) except *:
+        return GarlicValue.build_layer_value(value, {})
+
+    @staticmethod
+    cdef shared_ptr[LayerValue] build_layer_value(object value, dict keys) except *:
+        """
+        Build a native value, keys holds the UTF-8 encoded form of object keys seen so far so repeated keys (e.g. in
+        lists of objects) only get encoded once.
+        """
+        cdef ObjectValue* object_value = NULL
+        cdef ListValue* list_value = NULL
+        cdef shared_ptr[LayerValue] result
+        value_type = type(value)
+        # exact type checks first, they're much cheaper than isinstance checks against ABCs.
+        if value_type is dict:
+            object_value = new ObjectValue()
+            result = shared_ptr[LayerValue](object_value)
+            for key, item in (<dict>value).items():
+                native_key = keys.get(key)
+                if native_key is None:
+                    native_key = keys[key] = GarlicValue.encode_key(key)
+                deref(object_value).set(native_key, GarlicValue.build_layer_value(item, keys))
+            return result
+        elif value_type is list or value_type is tuple:
+            list_value = new ListValue()
+            result = shared_ptr[LayerValue](list_value)
+            for item in value:
+                deref(list_value).add(GarlicValue.build_layer_value(item, keys))
+            return result
+        elif value_type is six.text_type:
+            return shared_ptr[LayerValue](new StringValue(value.encode('utf-8')))
+        elif value_type is bool:
+            return shared_ptr[LayerValue](new BoolValue(value))
+        elif value_type is int:
+            return shared_ptr[LayerValue](new IntegerValue(value))
+        elif value_type is float:
+            return shared_ptr[LayerValue](new DoubleValue(value))
+        elif value is None:
+            return shared_ptr[LayerValue](new NullValue())
+        elif value_type is GarlicValue:
+            return (<GarlicValue>value).native_value
+        return GarlicValue.build_other_layer_value(value, keys)
+
+    @staticmethod
+    cdef bytes encode_key(object key):
+        if not isinstance(key, available_str):
+            raise TypeError('Object keys must be strings, not {invalid_type}'.format(invalid_type=type(key).__name__))
+        return key.encode('utf-8')
+
+    @staticmethod
+    cdef shared_ptr[LayerValue] build_other_layer_value(object value, dict keys) except *:
         cdef ObjectValue* object_value = NULL
         cdef ListValue* list_value = NULL
-        if isinstance(value, bool):
+        cdef shared_ptr[LayerValue] result
+        if isinstance(value, GarlicValue):
+            return (<GarlicValue>value).native_value
+        elif isinstance(value, bool):
             return shared_ptr[LayerValue](new BoolValue(value))
         elif isinstance(value, int):
             return shared_ptr[LayerValue](new IntegerValue(value))
@@ -35,20 +219,21 @@ cdef class GarlicValue(object):
             return shared_ptr[LayerValue](new DoubleValue(value))
         elif isinstance(value, available_str):
             return shared_ptr[LayerValue](new StringValue(value.encode('utf-8')))
-        elif isinstance(value, dict):
+        elif value is None:
+            return shared_ptr[LayerValue](new NullValue())
+        elif isinstance(value, Mapping):
             object_value = new ObjectValue()
+            result = shared_ptr[LayerValue](object_value)
             for key in value:
-                deref(object_value).set(key.encode('utf-8'), GarlicValue.init_layer_value(value[key]))
-            return shared_ptr[LayerValue](object_value)
+                deref(object_value).set(GarlicValue.encode_key(key), GarlicValue.build_layer_value(value[key], keys))
+            return result
         elif isinstance(value, Iterable):
             list_value = new ListValue()
+            result = shared_ptr[LayerValue](list_value)
             for item in value:
-                deref(list_value).add(GarlicValue.init_layer_value(item))
-            return shared_ptr[LayerValue](list_value)
-        elif value is None:
-            return shared_ptr[LayerValue](new NullValue())
-        else:
-            raise TypeError('Unsupported Type: {invalid_type}'.format(invalid_type=type(value).__name__))
+                deref(list_value).add(GarlicValue.build_layer_value(item, keys))
+            return result
+        raise TypeError('Unsupported Type: {invalid_type}'.format(invalid_type=type(value).__name__))
 
     @staticmethod
     cdef map_object(const shared_ptr[LayerValue]& value):
@@ -87,19 +272,370 @@ cdef class GarlicValue(object):
         elif deref(value).is_null():
             return None
 
+    @staticmethod
+    cdef map_frozen(const shared_ptr[LayerValue]& value, dict cache):
+        cdef size_t key
+        cdef dict members
+        cdef map[string, shared_ptr[LayerValue]].const_iterator member_it
+        cdef vector[shared_ptr[LayerValue]].const_iterator element_it
+        if not (deref(value).is_object() or deref(value).is_array()):
+            return GarlicValue.map_value(value)
+        key = <size_t>value.get()
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+        if deref(value).is_object():
+            members = {}
+            member_it = deref(value).begin_member()
+            while member_it != deref(value).end_member():
+                members[deref(member_it).first.decode('utf-8')] = GarlicValue.map_frozen(deref(member_it).second, cache)
+                inc(member_it)
+            result = MappingProxyType(members)
+        else:
+            elements = []
+            element_it = deref(value).begin_element()
+            while element_it != deref(value).end_element():
+                elements.append(GarlicValue.map_frozen(deref(element_it), cache))
+                inc(element_it)
+            result = tuple(elements)
+        # the entry holds on to the node, so its address can't get reused by another node while it's cached.
+        cache[key] = (GarlicValue.native_load(value), result)
+        return result
+
+    cdef convert(self, const shared_ptr[LayerValue]& value):
+        if self.py_cache is not None:
+            return GarlicValue.map_frozen(value, self.py_cache)
+        return GarlicValue.map_value(value)
+
+    cdef GarlicValue view(self, const shared_ptr[LayerValue]& value):
+        cdef GarlicValue garlic_value = GarlicValue.native_load(value)
+        garlic_value.py_cache = self.py_cache
+        return garlic_value
+
+    cdef child(self, const shared_ptr[LayerValue]& value):
+        if deref(value).is_object() or deref(value).is_array():
+            return self.view(value)
+        return GarlicValue.map_value(value)
+
+    def freeze(self):
+        """
+        Turn on the conversion cache for this value. Once frozen, py_value and resolve convert every object or array
+        only once and return immutable results: MappingProxyType instead of dict and tuple instead of list.
+        Values obtained from a frozen value (e.g. using resolve_node) share its cache. The cache gets dropped
+        whenever set, apply or patch change the value.
+        :return: self
+        """
+        if self.py_cache is None:
+            self.py_cache = {}
+        return self
+
+    @property
+    def frozen(self):
+        return self.py_cache is not None
+
     def py_value(self):
-        return GarlicValue.map_value(self.native_value)
+        return self.convert(self.native_value)
+
+    def dumps(self, pretty=False, sort_keys=True):
+        """
+        Encode the value as JSON natively, without converting it to python types first.
+        The output is identical to the one of JsonEncoder: keys are sorted and non-ascii characters are escaped.
+        :param pretty: Whether or not to use the human readable format of PrettyJSONEncoder.
+        :param sort_keys: Must be True, native objects keep their members sorted and don't remember insertion order.
+        :return: str
+        """
+        if not sort_keys:
+            raise ValueError('GarlicValue objects keep their keys sorted, insertion order is not available.')
+        return dump_value(self.native_value, pretty).decode('ascii')
+
+    def is_object(self):
+        return deref(self.native_value).is_object()
+
+    def is_array(self):
+        return deref(self.native_value).is_array()
+
+    def __len__(self):
+        if not (deref(self.native_value).is_object() or deref(self.native_value).is_array()):
+            raise TypeError("GarlicValue holding '{type}' has no len()".format(
+                type=GarlicValue.native_type_name(self.native_value.get())
+            ))
+        return layer_size(self.native_value)
+
+    def __bool__(self):
+        if deref(self.native_value).is_object() or deref(self.native_value).is_array():
+            return layer_size(self.native_value) > 0
+        return True
+
+    def __getitem__(self, key):
+        """
+        Access a member of an object or an element of an array. Objects and arrays are returned as GarlicValue
+        instances sharing the native data, other values are converted to python types.
+        """
+        cdef const shared_ptr[LayerValue]* result
+        cdef Py_ssize_t index
+        cdef Py_ssize_t size
+        if deref(self.native_value).is_object():
+            if not isinstance(key, available_str):
+                raise KeyError(key)
+            result = &get_member(self.native_value, key.encode('utf-8'))
+            if deref(result) == NotFoundPtr:
+                raise KeyError(key)
+            return self.child(deref(result))
+        elif deref(self.native_value).is_array():
+            if not isinstance(key, six.integer_types) or isinstance(key, bool):
+                raise TypeError('GarlicValue array indices must be integers.')
+            size = layer_size(self.native_value)
+            index = key + size if key < 0 else key
+            if not 0 <= index < size:
+                raise IndexError('GarlicValue index out of range.')
+            return self.child(get_element(self.native_value, index))
+        raise TypeError("GarlicValue holding '{type}' is not subscriptable.".format(
+            type=GarlicValue.native_type_name(self.native_value.get())
+        ))
+
+    def get(self, key, default=None):
+        """
+        Similar to dict.get, works on objects only.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, item):
+        if deref(self.native_value).is_object():
+            return isinstance(item, available_str) and get_member(self.native_value, item.encode('utf-8')) != NotFoundPtr
+        return item in self.values()
+
+    def keys(self):
+        """
+        :return: list of member names for objects.
+        """
+        cdef list keys = []
+        cdef map[string, shared_ptr[LayerValue]].const_iterator it
+        if not deref(self.native_value).is_object():
+            raise TypeError('Only GarlicValue objects have keys.')
+        it = deref(self.native_value).begin_member()
+        while it != deref(self.native_value).end_member():
+            keys.append(deref(it).first.decode('utf-8'))
+            inc(it)
+        return keys
+
+    def values(self):
+        """
+        :return: list of member values for objects or elements for arrays, see __getitem__.
+        """
+        cdef list values = []
+        cdef map[string, shared_ptr[LayerValue]].const_iterator member_it
+        cdef vector[shared_ptr[LayerValue]].const_iterator element_it
+        if deref(self.native_value).is_object():
+            member_it = deref(self.native_value).begin_member()
+            while member_it != deref(self.native_value).end_member():
+                values.append(self.child(deref(member_it).second))
+                inc(member_it)
+        elif deref(self.native_value).is_array():
+            element_it = deref(self.native_value).begin_element()
+            while element_it != deref(self.native_value).end_element():
+                values.append(self.child(deref(element_it)))
+                inc(element_it)
+        else:
+            raise TypeError('Only GarlicValue objects and arrays have values.')
+        return values
+
+    def items(self):
+        """
+        :return: list of (key, value) tuples for objects, see __getitem__.
+        """
+        cdef list items = []
+        cdef map[string, shared_ptr[LayerValue]].const_iterator it
+        if not deref(self.native_value).is_object():
+            raise TypeError('Only GarlicValue objects have items.')
+        it = deref(self.native_value).begin_member()
+        while it != deref(self.native_value).end_member():
+            items.append((deref(it).first.decode('utf-8'), self.child(deref(it).second)))
+            inc(it)
+        return items
+
+    def __iter__(self):
+        """
+        Iterates through member names for objects and elements for arrays.
+        """
+        if deref(self.native_value).is_object():
+            return iter(self.keys())
+        return iter(self.values())
+
+    cdef const shared_ptr[LayerValue]* find(self, path) except NULL:
+        if isinstance(path, CompiledPath):
+            return &resolve_segments(self.native_value, (<CompiledPath>path).segments)
+        return &deref(self.native_value).resolve(path.encode('utf-8'))
 
     def resolve(self, path):
-        cdef const shared_ptr[LayerValue]* result = &deref(self.native_value).resolve(path.encode('utf-8'))
+        """
+        Resolve a value using a dot separated path or a CompiledPath.
+        :return: The python representation of the value or None if it doesn't exist.
+        """
+        cdef const shared_ptr[LayerValue]* result = self.find(path)
+        if deref(result) != NotFoundPtr:
+            return self.convert(deref(result))
+
+    def resolve_many(self, paths):
+        """
+        Resolve several paths at once.
+        :param paths: iterable of dot separated paths or CompiledPath instances.
+        :return: tuple of resolved values, None for paths that don't exist.
+        """
+        cdef const shared_ptr[LayerValue]* result
+        cdef list values = []
+        for path in paths:
+            result = self.find(path)
+            values.append(self.convert(deref(result)) if deref(result) != NotFoundPtr else None)
+        return tuple(values)
+
+    def resolve_node(self, path):
+        """
+        Resolve a node without converting it to python types. The returned GarlicValue shares the native data with
+        this value, so it's cheap to create even for large subtrees.
+        :return: GarlicValue or None if the path doesn't exist.
+        """
+        cdef const shared_ptr[LayerValue]* result = self.find(path)
         if deref(result) != NotFoundPtr:
-            return GarlicValue.map_value(deref(result))
+            return self.view(deref(result))
+
+    cdef LayerValue* find_scalar(self, path, expected_type) except? NULL:
+        cdef const shared_ptr[LayerValue]* result = self.find(path)
+        cdef LayerValue* node
+        if deref(result) == NotFoundPtr or deref(result).get().is_null():
+            return NULL
+        node = deref(result).get()
+        if not (
+            (expected_type is int and node.is_int()) or
+            (expected_type is float and (node.is_double() or node.is_int())) or
+            (expected_type is bool and node.is_bool()) or
+            (expected_type is str and node.is_string())
+        ):
+            raise TypeError("Expected '{expected}' for '{path}', but got '{got}'.".format(
+                expected=expected_type.__name__,
+                path=getattr(path, 'path', path),
+                got=GarlicValue.native_type_name(node),
+            ))
+        return node
+
+    @staticmethod
+    cdef str native_type_name(LayerValue* value):
+        if value.is_string():
+            return 'str'
+        elif value.is_bool():
+            return 'bool'
+        elif value.is_int():
+            return 'int'
+        elif value.is_double():
+            return 'float'
+        elif value.is_object():
+            return 'dict'
+        elif value.is_array():
+            return 'list'
+        return 'NoneType'
+
+    def get_int(self, path, default=None):
+        """
+        Resolve an integer value. TypeError gets raised if the value exists but is not an integer.
+        :return: int or default if the value doesn't exist or is null.
+        """
+        cdef LayerValue* node = self.find_scalar(path, int)
+        return node.get_int() if node != NULL else default
+
+    def get_float(self, path, default=None):
+        """
+        Resolve a float value, integers are accepted and converted. TypeError gets raised for any other type.
+        :return: float or default if the value doesn't exist or is null.
+        """
+        cdef LayerValue* node = self.find_scalar(path, float)
+        if node == NULL:
+            return default
+        return node.get_double() if node.is_double() else <double>node.get_int()
+
+    def get_bool(self, path, default=None):
+        """
+        Resolve a boolean value. TypeError gets raised if the value exists but is not a boolean.
+        :return: bool or default if the value doesn't exist or is null.
+        """
+        cdef LayerValue* node = self.find_scalar(path, bool)
+        return node.get_bool() if node != NULL else default
+
+    def get_str(self, path, default=None):
+        """
+        Resolve a string value. TypeError gets raised if the value exists but is not a string.
+        :return: str or default if the value doesn't exist or is null.
+        """
+        cdef LayerValue* node = self.find_scalar(path, str)
+        return node.get_string().decode('utf-8') if node != NULL else default
+
+    def set(self, key, value):
+        """
+        Set a member of an object.
+        :param key: Name of the member, dots are not treated as path separators.
+        :param value: A basic python value or a GarlicValue. GarlicValue nodes get shared rather than copied.
+        """
+        if not deref(self.native_value).is_object():
+            raise TypeError('Only GarlicValue objects have members.')
+        deref(<ObjectValue*>self.native_value.get()).set(key.encode('utf-8'), GarlicValue.init_layer_value(value))
+        if self.py_cache is not None:
+            self.py_cache.clear()
 
     def clone(self):
         return GarlicValue.native_load(deref(self.native_value).clone())
 
     def apply(self, GarlicValue value):
         deref(self.native_value).apply(value.native_value)
+        if self.py_cache is not None:
+            self.py_cache.clear()
+
+    def diff(self, GarlicValue other):
+        """
+        List the changes turning this value into other. Objects are compared member by member, other values
+        (including arrays) are replaced as a whole. Subtrees shared by both values are skipped without being walked.
+        :return: list of ('set', path, value) and ('remove', path, None) tuples where path is a tuple of member names.
+        Objects and arrays are given as GarlicValue instances sharing the native data of other.
+        """
+        cdef vector[ValueChange] changes = diff_values(self.native_value, other.native_value)
+        cdef list result = []
+        cdef string segment
+        for change in changes:
+            path = tuple([segment.decode('utf-8') for segment in change.path])
+            if change.value:
+                result.append(('set', path, other.child(change.value)))
+            else:
+                result.append(('remove', path, None))
+        return result
+
+    def patch(self, changes):
+        """
+        Apply changes, as returned by diff, to this value. Missing objects along the path of a change get created.
+        Like set, GarlicValue nodes get shared rather than copied. Objects along the path of a change are copied
+        instead of being changed in place, so nodes shared with other values (e.g. by diff or set) are left intact and
+        values obtained from this one before patching (e.g. using resolve_node) don't see the changes.
+        :param changes: iterable of (operation, path, value) tuples. Paths are tuples of member names or dot separated
+        str.
+        :return: self
+        """
+        cdef vector[string] native_path
+        cdef shared_ptr[LayerValue] member
+        for operation, path, value in changes:
+            if isinstance(path, available_str):
+                path = path.split('.') if path else ()
+            native_path = [segment.encode('utf-8') for segment in path]
+            if operation == 'set':
+                member = GarlicValue.init_layer_value(value)
+            elif operation == 'remove':
+                member.reset()
+            else:
+                raise ValueError("Unknown operation '{operation}', expected 'set' or 'remove'.".format(
+                    operation=operation,
+                ))
+            self.native_value = patch_value(self.native_value, native_path, member)
+        if self.py_cache is not None:
+            self.py_cache.clear()
+        return self
 
     @staticmethod
     cdef GarlicValue native_load(const shared_ptr[LayerValue]& value):
@@ -108,16 +644,84 @@ cdef class GarlicValue(object):
         return garlic_value
 
 
-cdef extern from "utility.cpp":
-
-    cdef shared_ptr[LayerValue] load_value(NativeConfigRepository* repo, NativeDecoder* decoder, const string& name) except +raise_py_error
-
-
 cdef class LayerRetriever(object):
 
-    def __init__(self, ConfigRepository repository, Decoder decoder=None):
+    def __init__(self, ConfigRepository repository, Decoder decoder=None, cache=None):
+        """
+        :param repository: The repository to load configs from.
+        :param decoder: The decoder used to decode config contents, defaults to JsonDecoder.
+        :param cache: Optional LayerCache. If provided, decoded layers are kept in it and reused on later retrievals.
+        :type cache: garlicconfig.cache.LayerCache
+        """
         self.decoder = decoder or JsonDecoder()
         self.repo = repository
+        self.cache = cache
+
+    cdef list load(self, const vector[string]& names, unsigned int workers):
+        cdef BatchLoader* loader
+        cdef size_t index
+        if not self.decoder.native_decoder:
+            # python decoders need the GIL, configs get decoded one at a time.
+            values = [
+                self.decoder.decode(self.repo.retrieve_bytes(names[index].decode('utf-8')))
+                for index in range(names.size())
+            ]
+            return [value if isinstance(value, GarlicValue) else GarlicValue(value) for value in values]
+        loader = new BatchLoader(self.repo.native_repo, self.repo.lock, self.decoder.native_decoder, names)
+        try:
+            with nogil:
+                loader.run(workers)
+            loader.check()
+            return [GarlicValue.native_load(deref(loader).results()[index]) for index in range(names.size())]
+        finally:
+            del loader
 
     def retrieve(self, name):
-        return GarlicValue.native_load(load_value(self.repo.native_repo, self.decoder.native_decoder, name.encode('utf-8')))
+        """
+        Retrieve and decode a config. The GIL is released while the config is being read and decoded.
+        """
+        cdef GarlicValue value
+        cdef vector[string] native_names
+        version = None
+        if self.cache is not None:
+            value = self.cache.get(name, self.repo if self.cache.track_changes else None)
+            if value is not None:
+                return value
+            if self.cache.track_changes:
+                version = self.repo.version(name)  # taken before loading so concurrent changes are never missed.
+        native_names.push_back(name.encode('utf-8'))
+        value = self.load(native_names, 1)[0]
+        if self.cache is not None:
+            self.cache.set(name, value, version)
+        return value
+
+    def retrieve_many(self, names, workers=None):
+        """
+        Retrieve many configs at once. Configs get read and decoded concurrently by native threads without holding
+        the GIL. If any of the configs fails to load, the error gets raised once all workers are done.
+        :param names: iterable of config names.
+        :param workers: Number of threads to use, defaults to the number of CPUs.
+        :type workers: int
+        :return: dict mapping config names to GarlicValue instances.
+        """
+        cdef vector[string] native_names
+        cdef dict values = {}
+        cdef list pending = []
+        cdef list versions = []
+        for name in names:
+            if self.cache is not None:
+                values[name] = self.cache.get(name, self.repo if self.cache.track_changes else None)
+                if values[name] is not None:
+                    continue
+                versions.append(self.repo.version(name) if self.cache.track_changes else None)
+            else:
+                values[name] = None
+            pending.append(name)
+            native_names.push_back(name.encode('utf-8'))
+        if not pending:
+            return values
+        for index, value in enumerate(self.load(native_names, workers or cpu_count())):
+            values[pending[index]] = value
+            if self.cache is not None:
+                self.cache.set(pending[index], value, versions[index])
+        return values
@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+import threading
+import time
 from abc import ABCMeta, abstractmethod
+from string import Formatter
 
+from garlicconfig.cache import LayerCache
+from garlicconfig.exceptions import ConfigNotFound
 from garlicconfig.layer import LayerRetriever
+from garlicconfig.watch import ConfigWatcher
 
 import six
 
 
+_clock = getattr(time, 'monotonic', time.time)
+_PLACEHOLDER = re.compile(r'[^\W\d]\w*\Z', re.UNICODE)  # names only, positional fields aren't supported.
+
+
 @six.add_metaclass(ABCMeta)
 class ConfigManager(object):
     """
@@ -28,15 +39,275 @@ class ConfigManager(object):
 
 class FlatConfigManager(ConfigManager):
 
-    def __init__(self, repository, decoder=None, default_config_name=None):
+    def __init__(self, repository, decoder=None, default_config_name=None, cache=None):
         self.repository = repository
         self.decoder = decoder
         self.default_config_name = default_config_name
-        self.__layer_retriever = LayerRetriever(repository, decoder)
+        self.cache = cache
+        self.__layer_retriever = LayerRetriever(repository, decoder, cache)
+
+    def iterconfigs(self, parallel=False):
+        """
+        :param parallel: Load configs concurrently using native threads, pass an int to set the number of threads.
+        :type parallel: bool or int
+        """
+        if parallel:
+            workers = None if parallel is True else parallel
+            configs = self.__layer_retriever.retrieve_many(self.repository.list_configs(), workers)
+            for config in configs:
+                yield config, configs[config]
+        else:
+            for config in self.repository.list_configs():
+                yield config, self.__layer_retriever.retrieve(config)
+
+    def resolve(self, path, **filters):
+        return self.__layer_retriever.retrieve(filters.get('name', self.default_config_name)).resolve(path)
+
+    def follow(self, watcher=None):
+        """
+        Keep decoded configs up to date using a ConfigWatcher: changed configs are decoded once by the watcher and
+        replace the cached ones, so resolutions see new values without reloading anything else. A LayerCache is
+        created if the manager doesn't have one.
+        :param watcher: The watcher to follow, by default one gets created for the repository and started.
+        :type watcher: garlicconfig.watch.ConfigWatcher
+        :return: The followed watcher.
+        """
+        if self.cache is None:
+            self.cache = LayerCache()
+            self.__layer_retriever = LayerRetriever(self.repository, self.decoder, self.cache)
+        cache = self.cache
+
+        def update(name, value):
+            # the version the watcher took before decoding: if the config changed since, the cached value is stale.
+            version = watcher.version(name)
+            if value is None or version is None:
+                cache.invalidate(name)  # removed, possibly meanwhile, the watcher reports it next.
+            else:
+                cache.set(name, value, version if cache.track_changes else None)
+
+        if watcher is None:
+            watcher = ConfigWatcher(self.repository, self.decoder).start()
+        watcher.subscribe(update)
+        return watcher
+
+
+class LayeredConfigManager(ConfigManager):
+    """
+    Resolves paths against a stack of layers merged in order, e.g. base -> environment -> tenant.
+    Merged snapshots are built once per combination of layers and only get rebuilt when one of the layers they were
+    built from changes, gets added or gets removed.
+    """
+
+    def __init__(self, repository, layers, decoder=None, freeze=False, cache=None, check_interval=0):
+        """
+        :param repository: The repository layers get loaded from.
+        :param layers: Ordered list of layers, later layers override earlier ones. A layer is either a config name
+        that may contain filter placeholders (e.g. 'app.{env}') or a callable taking the filters dict and returning a
+        config name or None. Layers whose placeholders are not all provided or whose config doesn't exist are skipped.
+        Placeholders have to be plain names, without conversions or format specs.
+        :param decoder: The decoder used to decode layers.
+        :param freeze: Freeze merged snapshots, see GarlicValue.freeze.
+        :type freeze: bool
+        :param cache: LayerCache instance to keep decoded layers in, so rebuilding a snapshot only decodes the layers
+        that changed.
+        :param check_interval: Minimum number of seconds between checks for changed layers of a snapshot. 0 checks on
+        every resolution, which costs a repository version call per layer.
+        :type check_interval: float
+        """
+        self.repository = repository
+        self.layers = list(layers)
+        for layer in self.layers:
+            if callable(layer):
+                continue
+            for _, field, format_spec, conversion in Formatter().parse(layer):
+                if field is not None and (not _PLACEHOLDER.match(field) or format_spec or conversion):
+                    raise ValueError("Invalid layer '{layer}'.".format(layer=layer))
+        self.decoder = decoder
+        self.freeze = freeze
+        self.cache = cache
+        self.check_interval = check_interval
+        self.__layer_retriever = LayerRetriever(repository, decoder, cache)
+        self.__snapshots = {}
+        self.__layer_versions = {}
+
+    def layer_names(self, **filters):
+        """
+        :return: tuple of config names the given filters select, in merge order.
+        """
+        names = []
+        for layer in self.layers:
+            if callable(layer):
+                name = layer(filters)
+            else:
+                try:
+                    name = layer.format(**filters)
+                except KeyError:
+                    name = None
+            if name is not None:
+                names.append(name)
+        return tuple(names)
+
+    def snapshot(self, **filters):
+        """
+        Get the merged layers selected by the given filters. Snapshots are shared, don't mutate them.
+        If none of the selected layers exist, ConfigNotFound exception gets raised.
+        :return: GarlicValue
+        """
+        names = self.layer_names(**filters)
+        entry = self.__snapshots.get(names)
+        now = _clock()
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[0]
+        versions = tuple(self.__version(name) for name in names)
+        if entry is not None and entry[1] == versions:
+            entry[2] = now
+            return entry[0]
+        merged = None
+        for name, version in zip(names, versions):
+            if version is None:
+                continue
+            layer = self.__retrieve(name, version)
+            if merged is None:
+                merged = layer.clone()
+            else:
+                merged.apply(layer)
+        if merged is None:
+            raise ConfigNotFound('None of the layers {names} were found!'.format(names=list(names)))
+        if self.freeze:
+            merged.freeze()
+        self.__snapshots[names] = [merged, versions, now]
+        return merged
+
+    def clear(self):
+        """
+        Drop all merged snapshots.
+        """
+        self.__snapshots.clear()
 
     def iterconfigs(self):
         for config in self.repository.list_configs():
             yield config, self.__layer_retriever.retrieve(config)
 
     def resolve(self, path, **filters):
-        return self.__layer_retriever.retrieve(filters.get('name', self.default_config_name)).resolve(path)
+        return self.snapshot(**filters).resolve(path)
+
+    def __retrieve(self, name, version):
+        if self.cache is not None and self.__layer_versions.get(name) != version:
+            self.cache.invalidate(name)  # changed since it was cached, even if the cache doesn't track changes.
+        layer = self.__layer_retriever.retrieve(name)
+        self.__layer_versions[name] = version
+        return layer
+
+    def __version(self, name):
+        # versions are taken before layers get loaded, so changes made while merging trigger another rebuild.
+        try:
+            return self.repository.version(name)
+        except ConfigNotFound:
+            return None
+
+
+class IndexedConfigManager(ConfigManager):
+    """
+    Resolves paths against the config selected by filters, using name patterns such as 'app.{env}.{locale}'.
+    Config names are indexed by the filter values parsed from them once, so resolution doesn't need to scan the
+    repository. The index gets updated incrementally whenever configs get added or removed.
+    """
+
+    def __init__(self, repository, patterns, decoder=None, cache=None, check_interval=1.0):
+        """
+        :param repository: The repository configs get loaded from.
+        :param patterns: Ordered list of name patterns forming the fallback chain, most specific first, e.g.
+        ['app.{env}.{locale}', 'app.{env}', 'app']. Placeholder values can't contain dots.
+        :param decoder: The decoder used to decode configs.
+        :param cache: LayerCache instance to keep decoded configs in.
+        :param check_interval: Minimum number of seconds between checks for added or removed configs. 0 checks on
+        every resolution, call refresh to pick up changes right away.
+        :type check_interval: float
+        """
+        self.repository = repository
+        self.patterns = list(patterns)
+        self.decoder = decoder
+        self.cache = cache
+        self.check_interval = check_interval
+        self.__layer_retriever = LayerRetriever(repository, decoder, cache)
+        self.__fields = []
+        self.__regexes = []
+        for pattern in self.patterns:
+            fields = []
+            regex = ''
+            for literal, field, _, _ in Formatter().parse(pattern):
+                regex += re.escape(literal)
+                if field is not None:
+                    if not field or field in fields:
+                        raise ValueError("Invalid pattern '{pattern}'.".format(pattern=pattern))
+                    regex += r'([^.]+)'
+                    fields.append(field)
+            self.__fields.append(tuple(fields))
+            self.__regexes.append(re.compile(regex + r'\Z'))
+        self.__index = {}
+        self.__keys = {}
+        self.__catalog_version = None
+        self.__checked_at = None
+        self.__lock = threading.Lock()
+        self.refresh(force=True)
+
+    def __refresh_due(self):
+        return self.__checked_at is None or _clock() - self.__checked_at >= self.check_interval
+
+    def refresh(self, force=False):
+        """
+        Update the index if configs got added or removed since it was last updated. Repositories that don't support
+        catalog_version get listed again on every call.
+        :param force: Update the index even if the repository doesn't report any change.
+        :type force: bool
+        """
+        self.__checked_at = _clock()
+        try:
+            catalog_version = self.repository.catalog_version()
+        except NotImplementedError:
+            catalog_version = None
+        if not force and catalog_version is not None and catalog_version == self.__catalog_version:
+            return  # without catalog versions, the index gets rebuilt every time.
+        with self.__lock:
+            names = set(self.repository.list_configs())
+            for name in set(self.__keys) - names:
+                for key in self.__keys.pop(name):
+                    del self.__index[key]
+            for name in names - set(self.__keys):
+                self.__keys[name] = keys = []
+                for pattern_index, regex in enumerate(self.__regexes):
+                    match = regex.match(name)
+                    if match:
+                        keys.append((pattern_index, match.groups()))
+                        self.__index[keys[-1]] = name
+            self.__catalog_version = catalog_version
+
+    def config_name(self, **filters):
+        """
+        Find the config the given filters select: the first pattern all of whose placeholders are provided and whose
+        config exists. Filters not used by any pattern are ignored.
+        :return: str or None if no config matches.
+        """
+        if self.__refresh_due():
+            self.refresh()
+        for pattern_index, fields in enumerate(self.__fields):
+            try:
+                key = (pattern_index, tuple(six.text_type(filters[field]) for field in fields))
+            except KeyError:
+                continue
+            name = self.__index.get(key)
+            if name is not None:
+                return name
+        return None
+
+    def iterconfigs(self):
+        if self.__refresh_due():
+            self.refresh()
+        for config in sorted(self.__keys):
+            yield config, self.__layer_retriever.retrieve(config)
+
+    def resolve(self, path, **filters):
+        name = self.config_name(**filters)
+        if name is None:
+            raise ConfigNotFound('No config matches {filters}!'.format(filters=filters))
+        return self.__layer_retriever.retrieve(name).resolve(path)
@@ -1,35 +1,229 @@
 import copy
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 from garlicconfig.exceptions import ValidationError
-from garlicconfig.fields import ConfigField, validate_model_fields
+from garlicconfig.fields import (
+    ConfigField, collect_validation_errors, compile_garlic_dump_plan, compile_garlic_load_plan,
+    compile_validation_plan, dump_model_to_garlic, load_model_from_garlic, validate_model_fields,
+)
 from garlicconfig.layer import GarlicValue
 from garlicconfig.utils import assert_value_type
 
 import six
 
 
+_missing = object()
+_immutable_types = six.string_types + six.integer_types + (six.binary_type, float, bool, type(None))
+
+
+def _is_immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _immutable_types)
+
+
+class _LazyDefault(object):
+    """
+    Holds a mutable field default on the model class. A copy of the default is only made the first time the
+    attribute gets accessed on an instance, attributes assigned before that never copy the default at all.
+    """
+
+    def __init__(self, key, default):
+        self.key = key
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.default
+        value = instance.__dict__[self.key] = owner.__meta__.new_default(self.key)
+        return value
+
+
+class _LazyField(object):
+    """
+    Loads a field of a lazily hydrated model from its GarlicValue the first time it gets accessed.
+    """
+
+    def __init__(self, key, field, converter):
+        self.key = key
+        self.field = field
+        self.converter = converter
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return instance._lazy_values[self.key]
+        except KeyError:
+            pass
+        node = instance._garlic_value.get(self.key, _missing)
+        if node is _missing:
+            value = owner.__meta__.new_default(self.key)
+        elif type(self.field) is ModelField and isinstance(node, GarlicValue) and node.is_object():
+            value = self.field.model_class.lazy_from_garlic(node)
+        else:
+            if isinstance(node, GarlicValue):
+                node = node.py_value()
+            value = node if self.converter is None else self.converter(node)
+        instance._lazy_values[self.key] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance._lazy_values[self.key] = value
+
+
+def _is_identity(field, method):
+    return getattr(type(field), method) is getattr(ConfigField, method)
+
+
+def _compile_converter(field, method):
+    """
+    Returns the function converting values of the given field, or None if the field doesn't convert its values.
+    """
+    # garlicconfig.fields is still being initialized when this module gets imported.
+    from garlicconfig.fields import ArrayField
+    if _is_identity(field, method):
+        return None
+    if type(field) is ArrayField and _is_identity(field.field, method):
+        return _copy_list
+    return getattr(field, method)
+
+
+def _copy_list(value):
+    return list(value) if value else None
+
+
 class ModelMetaInfo(object):
 
     def __init__(self):
         self.fields = {}
+        self.default_fields = {}  # fields providing defaults: the most derived ones, unlike fields.
+        self.compact = False
+        self.model_class = None
+        self.__plans = {}
+
+    @property
+    def loads_natively(self):
+        """
+        Whether or not models can be loaded using garlic_load_plan, i.e. the model class doesn't override from_dict.
+        """
+        return self.model_class.from_dict.__func__ is ConfigModel.from_dict.__func__
+
+    @property
+    def dumps_natively(self):
+        """
+        Whether or not models can be dumped using garlic_dump_plan, i.e. the model class doesn't override py_value.
+        """
+        return six.get_unbound_function(self.model_class.py_value) is six.get_unbound_function(ConfigModel.py_value)
+
+    @property
+    def load_plan(self):
+        """
+        The plan used to load models: tuple of (key, converter) pairs where converter is None for fields storing values
+        as they are (e.g. StringField, IntegerField and BooleanField).
+        """
+        return self.__plan('load', lambda field: _compile_converter(field, 'to_model_value'))
+
+    @property
+    def dump_plan(self):
+        """
+        The plan used to dump models, see load_plan.
+        """
+        return self.__plan('dump', lambda field: _compile_converter(field, 'to_garlic_value'))
+
+    @property
+    def garlic_load_plan(self):
+        """
+        The plan used to load models from GarlicValue instances, see garlicconfig.fields.load_model_from_garlic.
+        """
+        plan = self.__plans.get('garlic_load')
+        if plan is None:
+            plan = self.__plans['garlic_load'] = compile_garlic_load_plan(self)
+        return plan
+
+    @property
+    def garlic_dump_plan(self):
+        """
+        The plan used to build GarlicValue instances from models, see garlicconfig.fields.dump_model_to_garlic.
+        """
+        plan = self.__plans.get('garlic_dump')
+        if plan is None:
+            plan = self.__plans['garlic_dump'] = compile_garlic_dump_plan(self)
+        return plan
+
+    @property
+    def validation_plan(self):
+        """
+        The plan used to validate models, see garlicconfig.fields.compile_validation_plan.
+        """
+        plan = self.__plans.get('validation')
+        if plan is None:
+            plan = self.__plans['validation'] = compile_validation_plan(self)
+        return plan
+
+    def new_default(self, key):
+        """
+        Make a new copy of the default value of the given field.
+        """
+        field = self.default_fields[key]
+        if isinstance(field, ModelField):
+            return field.model_class()
+        return copy.deepcopy(field.default)
+
+    def reset(self):
+        """
+        Drop compiled plans, call this method if fields get changed after the model class got created.
+        """
+        self.__plans.clear()
+
+    def __plan(self, name, compile_field):
+        plan = self.__plans.get(name)
+        if plan is None:
+            plan = self.__plans[name] = tuple((key, compile_field(field)) for key, field in six.iteritems(self.fields))
+        return plan
 
 
 class ModelMetaClass(type):
 
     def __new__(mcs, name, bases, attributes):
+        fields = dict((key, value) for key, value in six.iteritems(attributes) if isinstance(value, ConfigField))
+        # only a bool turns compact mode on or off, models may have a field named 'compact' as well.
+        compact = attributes.get('compact')
+        if not isinstance(compact, bool):
+            compact = any(base.__meta__.compact for base in bases if isinstance(base, ModelMetaClass))
+        if compact:
+            # fields are stored in slots, defaults are provided by __getattr__.
+            slotted = set(
+                slot for base in bases for klass in base.__mro__ for slot in klass.__dict__.get('__slots__', ())
+            )
+            attributes = dict((key, value) for key, value in six.iteritems(attributes) if key not in fields)
+            attributes['__slots__'] = tuple(attributes.get('__slots__', ())) + tuple(
+                sorted(key for key in fields if key not in slotted)
+            )
         new_class = super(ModelMetaClass, mcs).__new__(mcs, str(name), bases, attributes)
         meta = ModelMetaInfo()
-        for key in attributes:
-            field = attributes[key]
-            if isinstance(field, ConfigField):
-                # if a friendly name is provided, skip this step.
-                if not field.friendly_name:
-                    field.friendly_name = key
-                meta.fields[key] = field
-                setattr(new_class, key, field.default)
+        meta.compact = compact
+        meta.model_class = new_class
+        for key, field in six.iteritems(fields):
+            # if a friendly name is provided, skip this step.
+            if not field.friendly_name:
+                field.friendly_name = key
+            meta.fields[key] = field
+            if not compact:
+                # immutable defaults are shared by all instances, mutable ones get copied on first access.
+                default = field.default
+                setattr(new_class, key, default if _is_immutable(default) else _LazyDefault(key, default))
         for base in bases:
             if isinstance(base, ModelMetaClass):
                 meta.fields.update(base.__meta__.fields)
+        for base in reversed(bases):
+            if isinstance(base, ModelMetaClass):
+                meta.default_fields.update(base.__meta__.default_fields)
+        meta.default_fields.update(fields)
         new_class.__meta__ = meta
         return new_class
 
@@ -37,20 +231,57 @@ class ModelMetaClass(type):
 @six.add_metaclass(ModelMetaClass)
 class ConfigModel(object):
 
+    __slots__ = ()
+
     field_order = None  # Optional: how fields should be ordered when displayed
+    compact = False  # Optional: store fields in __slots__ instead of a per-instance dict, inherited by subclasses
 
-    def __init__(self):
-        for field_name in self.__meta__.fields:
-            value = getattr(self, field_name)
-            if value is not None:
-                setattr(self, field_name, copy.deepcopy(value))
+    def __getattr__(self, key):
+        # only reached for fields of compact models that were never assigned.
+        meta = type(self).__meta__
+        if key not in meta.default_fields:
+            raise AttributeError("'{cls}' object has no attribute '{key}'".format(cls=type(self).__name__, key=key))
+        default = meta.default_fields[key].default
+        if _is_immutable(default):
+            return default
+        value = meta.new_default(key)
+        setattr(self, key, value)
+        return value
 
     @classmethod
     def from_garlic(cls, garlic_value):
         """
         Instantiate a config model and load it using the given GarlicValue.
+        Only members matching fields get converted, nested models are loaded straight from the GarlicValue nodes.
+        Models overriding from_dict are loaded using it instead.
         """
-        return cls.from_dict(garlic_value.py_value())
+        if not garlic_value.is_object() or not cls.__meta__.loads_natively:
+            return cls.from_dict(garlic_value.py_value())
+        return load_model_from_garlic(garlic_value, cls)
+
+    @classmethod
+    def lazy_from_garlic(cls, garlic_value):
+        """
+        Instantiate a config model backed by the given GarlicValue. Fields get converted the first time they're
+        accessed, nested models become lazily hydrated models as well. Validating the model converts all fields.
+        The returned model is an instance of a subclass of this class.
+        """
+        if not garlic_value.is_object():
+            return cls.from_garlic(garlic_value)
+        lazy_class = cls.__dict__.get('_lazy_class')
+        if lazy_class is None:
+            attributes = {
+                key: _LazyField(key, cls.__meta__.fields[key], converter) for key, converter in cls.__meta__.load_plan
+            }
+            attributes['__slots__'] = ('_garlic_value', '_lazy_values')
+            attributes['__module__'] = cls.__module__
+            lazy_class = type(cls)(cls.__name__, (cls,), attributes)
+            lazy_class._lazy_class = lazy_class
+            cls._lazy_class = lazy_class
+        new_instance = lazy_class()
+        new_instance._garlic_value = garlic_value
+        new_instance._lazy_values = {}
+        return new_instance
 
     @classmethod
     def from_dict(cls, value):
@@ -59,11 +290,12 @@ class ConfigModel(object):
         """
         new_instance = cls()
         if value:
-            for key, field in six.iteritems(cls.__meta__.fields):
+            for key, converter in cls.__meta__.load_plan:
                 try:
-                    setattr(new_instance, key, field.to_model_value(value[key]))
+                    item = value[key]
                 except KeyError:
-                    pass
+                    continue
+                setattr(new_instance, key, item if converter is None else converter(item))
         return new_instance
 
     @classmethod
@@ -95,16 +327,22 @@ class ConfigModel(object):
     def garlic_value(self):
         """
         Returns an instance of GarlicValue representing this model.
+        Nested models are built as GarlicValue instances directly rather than going through python dicts, unless
+        they override py_value.
         """
-        return GarlicValue(self.py_value())
+        if not self.__meta__.dumps_natively:
+            return GarlicValue(self.py_value())
+        return dump_model_to_garlic(self)
 
     def py_value(self):
         """
         Returns an instance of python dictionary containing only basic types so it can be used for encoding.
         """
         obj = {}
-        for key, field in six.iteritems(self.__meta__.fields):
-            dict_value = field.to_garlic_value(getattr(self, key))
+        for key, converter in self.__meta__.dump_plan:
+            dict_value = getattr(self, key)
+            if converter is not None:
+                dict_value = converter(dict_value)
             if dict_value is not None:
                 obj[key] = dict_value
         return obj
@@ -115,6 +353,14 @@ class ConfigModel(object):
         """
         validate_model_fields(self)
 
+    def validation_errors(self):
+        """
+        Validates the current model, collecting all errors instead of raising the first one.
+        :return: list of ValidationError instances. Their path attribute holds the dot separated path of the invalid
+        value, e.g. 'servers.2.port'.
+        """
+        return collect_validation_errors(self)
+
 
 class ModelField(ConfigField):
 
@@ -143,7 +389,7 @@ class ModelField(ConfigField):
     def to_model_value(self, value):
         if not value:
             return self.model_class()  # initialize a new instance
-        if not isinstance(value, dict):
+        if not isinstance(value, Mapping):
             raise ValidationError("Value for {key} must be a python dict.".format(key=self.name))
         return self.model_class.from_dict(value)
 
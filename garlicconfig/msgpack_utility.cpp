@@ -0,0 +1,300 @@
+#include <climits>
+#include <cstdint>
+#include <cstring>
+#include <istream>
+#include <memory>
+#include <stdexcept>
+#include <string>
+
+#include "GarlicConfig/garlicconfig.h"
+
+
+using namespace std;
+using namespace garlic;
+
+
+/*
+ * MessagePack support for LayerValue trees. Maps need string keys, binary data is decoded as strings and extension
+ * types are not supported. Since LayerValue integers are ints, integers out of their range are decoded as doubles.
+ */
+namespace msgpack {
+
+const size_t MAX_DEPTH = 512;
+
+
+class Parser {
+public:
+    Parser(const char* data, size_t size) : cursor(reinterpret_cast<const unsigned char*>(data)),
+                                            end(reinterpret_cast<const unsigned char*>(data) + size) {}
+
+    shared_ptr<LayerValue> parse() {
+        auto value = parse_value(0);
+        if (cursor != end) {
+            fail("unexpected data after the value");
+        }
+        return value;
+    }
+
+private:
+    const unsigned char* cursor;
+    const unsigned char* end;
+
+    [[noreturn]] static void fail(const string& reason) {
+        throw runtime_error("Invalid MessagePack data: " + reason + ".");
+    }
+
+    const unsigned char* take(size_t size) {
+        if (size_t(end - cursor) < size) {
+            fail("unexpected end of data");
+        }
+        const unsigned char* data = cursor;
+        cursor += size;
+        return data;
+    }
+
+    uint64_t read_uint(size_t size) {
+        const unsigned char* data = take(size);
+        uint64_t value = 0;
+        for (size_t i = 0; i < size; ++i) {
+            value = value << 8 | data[i];
+        }
+        return value;
+    }
+
+    int64_t read_int(size_t size) {
+        uint64_t value = read_uint(size);
+        uint64_t sign = uint64_t(1) << (size * 8 - 1);
+        if (size < 8 && (value & sign)) {
+            value |= ~uint64_t(0) << (size * 8);  // sign extend.
+        }
+        return static_cast<int64_t>(value);
+    }
+
+    static shared_ptr<LayerValue> integer(int64_t value) {
+        if (value < INT_MIN || value > INT_MAX) {
+            return make_shared<DoubleValue>(static_cast<double>(value));
+        }
+        return make_shared<IntegerValue>(static_cast<int>(value));
+    }
+
+    static shared_ptr<LayerValue> unsigned_integer(uint64_t value) {
+        if (value > uint64_t(INT_MAX)) {
+            return make_shared<DoubleValue>(static_cast<double>(value));
+        }
+        return make_shared<IntegerValue>(static_cast<int>(value));
+    }
+
+    string read_string(size_t size) {
+        return string(reinterpret_cast<const char*>(take(size)), size);
+    }
+
+    string read_key() {
+        uint8_t type = read_uint(1);
+        if ((type & 0xe0) == 0xa0) {
+            return read_string(type & 0x1f);
+        }
+        switch (type) {
+            case 0xd9: case 0xc4: return read_string(read_uint(1));
+            case 0xda: case 0xc5: return read_string(read_uint(2));
+            case 0xdb: case 0xc6: return read_string(read_uint(4));
+        }
+        fail("map keys have to be strings");
+    }
+
+    shared_ptr<LayerValue> read_array(size_t size, size_t depth) {
+        auto value = make_shared<ListValue>();
+        for (size_t i = 0; i < size; ++i) {
+            value->add(parse_value(depth + 1));
+        }
+        return value;
+    }
+
+    shared_ptr<LayerValue> read_map(size_t size, size_t depth) {
+        auto value = make_shared<ObjectValue>();
+        for (size_t i = 0; i < size; ++i) {
+            string key = read_key();
+            value->set(key, parse_value(depth + 1));
+        }
+        return value;
+    }
+
+    shared_ptr<LayerValue> parse_value(size_t depth) {
+        if (depth > MAX_DEPTH) {
+            fail("too deeply nested");
+        }
+        uint8_t type = read_uint(1);
+        if (type <= 0x7f) {
+            return make_shared<IntegerValue>(type);
+        }
+        if (type >= 0xe0) {
+            return make_shared<IntegerValue>(static_cast<int8_t>(type));
+        }
+        if ((type & 0xf0) == 0x80) {
+            return read_map(type & 0x0f, depth);
+        }
+        if ((type & 0xf0) == 0x90) {
+            return read_array(type & 0x0f, depth);
+        }
+        if ((type & 0xe0) == 0xa0) {
+            return make_shared<StringValue>(read_string(type & 0x1f));
+        }
+        switch (type) {
+            case 0xc0: return make_shared<NullValue>();
+            case 0xc2: return make_shared<BoolValue>(false);
+            case 0xc3: return make_shared<BoolValue>(true);
+            case 0xc4: case 0xd9: return make_shared<StringValue>(read_string(read_uint(1)));
+            case 0xc5: case 0xda: return make_shared<StringValue>(read_string(read_uint(2)));
+            case 0xc6: case 0xdb: return make_shared<StringValue>(read_string(read_uint(4)));
+            case 0xca: {
+                uint32_t bits = read_uint(4);
+                float value;
+                memcpy(&value, &bits, sizeof(value));
+                return make_shared<DoubleValue>(value);
+            }
+            case 0xcb: {
+                uint64_t bits = read_uint(8);
+                double value;
+                memcpy(&value, &bits, sizeof(value));
+                return make_shared<DoubleValue>(value);
+            }
+            case 0xcc: return unsigned_integer(read_uint(1));
+            case 0xcd: return unsigned_integer(read_uint(2));
+            case 0xce: return unsigned_integer(read_uint(4));
+            case 0xcf: return unsigned_integer(read_uint(8));
+            case 0xd0: return integer(read_int(1));
+            case 0xd1: return integer(read_int(2));
+            case 0xd2: return integer(read_int(4));
+            case 0xd3: return integer(read_int(8));
+            case 0xdc: return read_array(read_uint(2), depth);
+            case 0xdd: return read_array(read_uint(4), depth);
+            case 0xde: return read_map(read_uint(2), depth);
+            case 0xdf: return read_map(read_uint(4), depth);
+        }
+        fail("unsupported type");
+    }
+};
+
+
+class Writer {
+public:
+    string write(const shared_ptr<LayerValue>& value) {
+        output.clear();
+        write_value(value);
+        return move(output);
+    }
+
+private:
+    string output;
+
+    void put_uint(uint64_t value, size_t size) {
+        for (size_t i = size; i-- > 0;) {
+            output += char(value >> (i * 8));
+        }
+    }
+
+    void put_header(size_t size, uint8_t fix_type, size_t fix_limit, uint8_t type16, uint8_t type32) {
+        if (size < fix_limit) {
+            output += char(fix_type | size);
+        } else if (size <= 0xffff) {
+            output += char(type16);
+            put_uint(size, 2);
+        } else if (size <= 0xffffffff) {
+            output += char(type32);
+            put_uint(size, 4);
+        } else {
+            throw length_error("Value is too large for MessagePack.");
+        }
+    }
+
+    void write_string(const string& value) {
+        if (value.size() >= 32 && value.size() <= 0xff) {
+            output += char(0xd9);
+            put_uint(value.size(), 1);
+        } else {
+            put_header(value.size(), 0xa0, 32, 0xda, 0xdb);
+        }
+        output += value;
+    }
+
+    void write_int(int value) {
+        if (value >= 0) {
+            if (value <= 0x7f) {
+                output += char(value);
+            } else if (value <= 0xff) {
+                output += char(0xcc);
+                put_uint(value, 1);
+            } else if (value <= 0xffff) {
+                output += char(0xcd);
+                put_uint(value, 2);
+            } else {
+                output += char(0xce);
+                put_uint(value, 4);
+            }
+        } else if (value >= -32) {
+            output += char(value);
+        } else if (value >= INT8_MIN) {
+            output += char(0xd0);
+            put_uint(static_cast<uint8_t>(value), 1);
+        } else if (value >= INT16_MIN) {
+            output += char(0xd1);
+            put_uint(static_cast<uint16_t>(value), 2);
+        } else {
+            output += char(0xd2);
+            put_uint(static_cast<uint32_t>(value), 4);
+        }
+    }
+
+    void write_value(const shared_ptr<LayerValue>& value) {
+        if (value->is_object()) {
+            put_header(distance(value->begin_member(), value->end_member()), 0x80, 16, 0xde, 0xdf);
+            for (auto it = value->begin_member(); it != value->end_member(); ++it) {
+                write_string(it->first);
+                write_value(it->second);
+            }
+        } else if (value->is_array()) {
+            put_header(distance(value->begin_element(), value->end_element()), 0x90, 16, 0xdc, 0xdd);
+            for (auto it = value->begin_element(); it != value->end_element(); ++it) {
+                write_value(*it);
+            }
+        } else if (value->is_string()) {
+            write_string(value->get_string());
+        } else if (value->is_bool()) {
+            output += char(value->get_bool() ? 0xc3 : 0xc2);
+        } else if (value->is_int()) {
+            write_int(value->get_int());
+        } else if (value->is_double()) {
+            double number = value->get_double();
+            uint64_t bits;
+            memcpy(&bits, &number, sizeof(bits));
+            output += char(0xcb);
+            put_uint(bits, 8);
+        } else {
+            output += char(0xc0);
+        }
+    }
+};
+
+}  // namespace msgpack
+
+
+class MsgPackDecoder : public Decoder {
+public:
+    shared_ptr<LayerValue> load(istream& input) const override {
+        string data;
+        char buffer[64 * 1024];
+        while (input.read(buffer, sizeof(buffer)) || input.gcount()) {
+            data.append(buffer, input.gcount());
+        }
+        return msgpack::Parser(data.data(), data.size()).parse();
+    }
+};
+
+
+shared_ptr<LayerValue> load_msgpack(const char* data, size_t size) {
+    return msgpack::Parser(data, size).parse();
+}
+
+
+string dump_msgpack(const shared_ptr<LayerValue>& value) {
+    return msgpack::Writer().write(value);
+}
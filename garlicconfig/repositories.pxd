@@ -16,12 +16,19 @@ cdef extern from "GarlicConfig/garlicconfig.h" namespace "garlic":
         pass
 
 
+cdef extern from "utility.cpp":
+
+    cdef cppclass RepositoryLock:
+        RepositoryLock() except +
+
+
 cdef class ConfigRepository(object):
     """
     Base class for garlic config repositories. Repository classes are responsible for loading config files.
     This is a base class, you cannot construct instances of this class.
     """
     cdef NativeConfigRepository* native_repo
+    cdef RepositoryLock* lock
 
 
 cdef class FileConfigRepository(ConfigRepository):
@@ -29,6 +36,7 @@ cdef class FileConfigRepository(ConfigRepository):
     A repository that uses files with garlic extension to store config data. Note that the content could be in any format.
     """
     cdef NativeFileConfigRepository* file_repo
+    cdef readonly object root_path
 
 
 cdef class MemoryConfigRepository(ConfigRepository):
@@ -36,3 +44,5 @@ cdef class MemoryConfigRepository(ConfigRepository):
     A repository that uses memory to store garlic configs, this should be used if temporary access is needed.
     """
     cdef NativeMemoryConfigRepository* memory_repo
+    cdef readonly unsigned long long generation
+    cdef dict generations
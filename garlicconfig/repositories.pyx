@@ -1,13 +1,193 @@
+import binascii
+import errno
+import io
+import os
+import stat
+
+from libcpp.set cimport set
 from libcpp.string cimport string
 
 from exceptions cimport raise_py_error
-from repositories cimport NativeConfigRepository, NativeFileConfigRepository, NativeMemoryConfigRepository
+from repositories cimport NativeConfigRepository, NativeFileConfigRepository, NativeMemoryConfigRepository, RepositoryLock
+
+from garlicconfig.exceptions import ConfigNotFound
 
 
 cdef extern from 'utility.cpp':
 
-    cdef void save_str_to_repo(NativeConfigRepository* repo, const string& name, const string& content) except +raise_py_error
-    cdef string read_str_from_repo(NativeConfigRepository* repo, const string& name) except +raise_py_error
+    cdef void save_buffer_to_repo(NativeConfigRepository* repo, RepositoryLock* lock, const string& name, const char* data, size_t size) nogil except +raise_py_error
+    cdef set[string] list_repo_configs(NativeConfigRepository* repo, RepositoryLock* lock) nogil except +raise_py_error
+
+    cdef cppclass ConfigReader:
+        ConfigReader(NativeConfigRepository* repo, RepositoryLock* lock, const string& name) except +
+        void run() nogil
+        void check() except +raise_py_error
+        const string& content()
+
+    cdef cppclass ConfigStream:
+        ConfigStream(NativeConfigRepository* repo, RepositoryLock* lock, const string& name) except +raise_py_error
+        size_t read(char* buffer, size_t size) nogil except +raise_py_error
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+cdef class ConfigStreamReader(object):
+    """
+    Reads a config of a repository in chunks, see ConfigRepository.open.
+    """
+    cdef ConfigStream* stream
+    cdef ConfigRepository repository
+
+    def __init__(self, ConfigRepository repository, name):
+        self.repository = repository  # keeps the native repository alive while reading.
+        self.stream = new ConfigStream(repository.native_repo, repository.lock, name.encode('UTF-8'))
+
+    def readinto(self, unsigned char[:] buffer not None):
+        """
+        Read up to len(buffer) bytes into the buffer, the GIL is released while reading.
+        :return: int for the number of bytes read, 0 at the end of the config.
+        """
+        cdef size_t size = buffer.shape[0]
+        if not size:
+            return 0
+        with nogil:
+            size = self.stream.read(<char*>&buffer[0], size)
+        return size
+
+    def __dealloc__(self):
+        del self.stream
+
+
+class ConfigInputStream(io.RawIOBase):
+    """
+    Raw binary stream reading a config, returned by ConfigRepository.open wrapped in a buffered reader.
+    """
+
+    def __init__(self, repository, name):
+        super(ConfigInputStream, self).__init__()
+        self.name = name
+        self.__reader = ConfigStreamReader(repository, name)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.__reader.readinto(buffer)
+
+    def close(self):
+        self.__reader = None
+        super(ConfigInputStream, self).close()
+
+
+class ConfigOutputStream(io.RawIOBase):
+    """
+    Raw binary stream writing a config, returned by ConfigRepository.open wrapped in a buffered writer.
+    Written data is kept in memory and saved to the repository once the stream gets closed.
+    """
+
+    def __init__(self, repository, name):
+        super(ConfigOutputStream, self).__init__()
+        self.name = name
+        self.__repository = repository
+        self.__buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.__buffer.write(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.__repository.save_bytes(self.name, self.__buffer.getbuffer())
+            finally:
+                self.__buffer = None
+        super(ConfigOutputStream, self).close()
+
+    def discard(self):
+        """
+        Close the stream without saving the written data.
+        """
+        self.__buffer = None
+        super(ConfigOutputStream, self).close()
+
+
+class AtomicFileOutputStream(io.FileIO):
+    """
+    Writes a config file of a FileConfigRepository through a temporary file in the same directory, which replaces
+    the config file once the stream gets closed. Readers never see partially written configs.
+    The config file keeps its permissions, new ones get the default permissions for the current umask.
+    """
+
+    def __init__(self, path):
+        fd, self.temp_path = _create_temp_file(path)
+        self.config_path = path
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            mode = None  # new config, the temporary file already has the default permissions.
+        if mode is not None:
+            try:
+                os.chmod(self.temp_path, mode)
+            except BaseException:
+                os.close(fd)
+                os.remove(self.temp_path)
+                raise
+        super(AtomicFileOutputStream, self).__init__(fd, 'wb')
+
+    def close(self):
+        if not self.closed:
+            super(AtomicFileOutputStream, self).close()
+            _replace(self.temp_path, self.config_path)
+
+    def discard(self):
+        """
+        Close the stream and remove the temporary file, leaving the config file untouched.
+        """
+        if not self.closed:
+            super(AtomicFileOutputStream, self).close()
+            os.remove(self.temp_path)
+
+
+def _create_temp_file(path):
+    # unlike mkstemp, files are created with the default permissions for the umask (rather than 0600), without
+    # having to change the umask of the process to find out what it is.
+    directory, file_name = os.path.split(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0)
+    while True:
+        temp_path = os.path.join(directory, '.{file_name}.{suffix}'.format(
+            file_name=file_name, suffix=binascii.hexlify(os.urandom(6)).decode('ascii')
+        ))
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+
+class ConfigWriter(io.BufferedWriter):
+    """
+    Buffered writer returned by ConfigRepository.open. When used as a context manager, the config is only saved if
+    the with block completes, written data is discarded if it raises.
+    """
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.raw.discard()
+        return super(ConfigWriter, self).__exit__(exc_type, exc_value, traceback)
+
+
+class ConfigTextWriter(io.TextIOWrapper):
+    """
+    Text stream returned by ConfigRepository.open for writing, see ConfigWriter.
+    """
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.buffer.raw.discard()
+        return super(ConfigTextWriter, self).__exit__(exc_type, exc_value, traceback)
 
 
 cdef class ConfigRepository(object):
@@ -23,7 +203,8 @@ cdef class ConfigRepository(object):
         """
         cdef set[string] configs
         if self.native_repo:
-            configs = self.native_repo.list_configs()
+            with nogil:
+                configs = list_repo_configs(self.native_repo, self.lock)
             for item in configs:
                 yield item.decode('UTF-8')
 
@@ -33,21 +214,123 @@ cdef class ConfigRepository(object):
         :param name: The name of the config. Config data can later be accessed by passing this name to retrieve method.
         :param content: The str content of this config.
         """
+        self.save_bytes(name, content.encode('UTF-8'))
+
+    def save_bytes(self, name, const unsigned char[:] content not None):
+        """
+        Save a config given as bytes or any other object supporting the buffer protocol (bytearray, memoryview, ...).
+        The content is written straight from the buffer, the GIL is released while writing.
+        :param name: The name of the config.
+        :param content: The binary content of this config.
+        """
+        cdef string native_name = name.encode('UTF-8')
+        cdef size_t size = content.shape[0]
+        cdef const char* data = <const char*>&content[0] if size else NULL
         if self.native_repo:
-            save_str_to_repo(self.native_repo, name.encode('UTF-8'), content.encode('UTF-8'))
+            with nogil:
+                save_buffer_to_repo(self.native_repo, self.lock, native_name, data, size)
 
     def retrieve(self, name):
         """
         Retrieve a config. If no config with such name is available, ConfigNotFound exception gets raised.
+        The GIL is released while the config is being read.
         :param name: Name of the config.
         :return: str
         """
+        cdef ConfigReader* reader
         if self.native_repo:
-            return read_str_from_repo(self.native_repo, name.encode('UTF-8')).decode('UTF-8')
+            reader = new ConfigReader(self.native_repo, self.lock, name.encode('UTF-8'))
+            try:
+                with nogil:
+                    reader.run()
+                reader.check()
+                return reader.content().decode('UTF-8')
+            finally:
+                del reader
+
+    def retrieve_bytes(self, name):
+        """
+        Retrieve the raw content of a config without decoding it. If no config with such name is available,
+        ConfigNotFound exception gets raised.
+        :param name: Name of the config.
+        :return: bytes
+        """
+        cdef ConfigReader* reader
+        if self.native_repo:
+            reader = new ConfigReader(self.native_repo, self.lock, name.encode('UTF-8'))
+            try:
+                with nogil:
+                    reader.run()
+                reader.check()
+                return reader.content()
+            finally:
+                del reader
+
+    def open(self, name, mode='r'):
+        """
+        Open a config as a file-like object so large configs can be read or written in chunks.
+        Configs opened for writing are saved when the returned stream gets closed, unless it is used in a with block
+        that raises.
+        :param name: Name of the config.
+        :param mode: One of 'r', 'rb', 'w' and 'wb'. Text modes use UTF-8.
+        :return: A buffered binary stream or a text stream wrapping it.
+        """
+        if mode not in ('r', 'rb', 'w', 'wb'):
+            raise ValueError("Invalid mode '{mode}', expected one of 'r', 'rb', 'w' and 'wb'.".format(mode=mode))
+        if mode[0] == 'r':
+            stream = io.BufferedReader(self._open_input(name))
+            if 'b' not in mode:
+                stream = io.TextIOWrapper(stream, encoding='UTF-8')
+        else:
+            stream = ConfigWriter(self._open_output(name))
+            if 'b' not in mode:
+                stream = ConfigTextWriter(stream, encoding='UTF-8')
+        return stream
+
+    def _open_input(self, name):
+        return ConfigInputStream(self, name)
+
+    def _open_output(self, name):
+        return ConfigOutputStream(self, name)
+
+    def version(self, name):
+        """
+        Returns a token identifying the current version of a config. Tokens are cheap to compute and can be compared
+        to tell whether or not a config has changed without reading it. If no config with such name is available,
+        ConfigNotFound exception gets raised.
+        :param name: Name of the config.
+        :return: hashable token
+        """
+        raise NotImplementedError
+
+    def catalog_version(self):
+        """
+        Returns a token identifying the current set of configs in this repository. The token changes whenever configs
+        get added or removed, so it can be used to tell whether or not list_configs has to be called again.
+        :return: hashable token
+        """
+        raise NotImplementedError
+
+    def changed_since(self, token):
+        """
+        Determines whether or not a config has changed (or got removed) since the given token was taken.
+        :param token: A token previously returned by the version method.
+        :return: bool
+        """
+        try:
+            return self.version(token[0]) != token
+        except ConfigNotFound:
+            return True
+
+    def __cinit__(self):
+        # native repositories aren't thread-safe, but they're used without the GIL: reads share the lock, saves take
+        # it exclusively.
+        self.lock = new RepositoryLock()
 
     def __dealloc__(self):
         if self.native_repo:
             del self.native_repo
+        del self.lock
 
 
 cdef class FileConfigRepository(ConfigRepository):
@@ -55,9 +338,50 @@ cdef class FileConfigRepository(ConfigRepository):
     A repository that uses files with garlic extension to store config data. Note that the content could be in any format.
     """
 
+    extension = '.garlic'
+
     def __init__(self, root_path):
+        self.root_path = root_path
         self.native_repo = self.file_repo = new NativeFileConfigRepository(root_path.encode('UTF-8'))
 
+    def config_path(self, name):
+        """
+        :return: str for the path of the file storing the given config.
+        """
+        return os.path.join(self.root_path, name + self.extension)
+
+    def _open_input(self, name):
+        try:
+            return io.FileIO(self.config_path(name), 'rb')
+        except (IOError, OSError):
+            if os.path.isfile(self.config_path(name)):
+                raise
+            raise ConfigNotFound("Config '{name}' was not found!".format(name=name))
+
+    def _open_output(self, name):
+        return AtomicFileOutputStream(self.config_path(name))
+
+    def version(self, name):
+        """
+        Versions of file configs are based on the modification time, size and inode of their files.
+        """
+        try:
+            file_stat = os.stat(self.config_path(name))
+        except OSError:
+            raise ConfigNotFound("Config '{name}' was not found!".format(name=name))
+        return name, getattr(file_stat, 'st_mtime_ns', file_stat.st_mtime), file_stat.st_size, file_stat.st_ino
+
+    def catalog_version(self):
+        """
+        Catalog versions are the names of the config files in the root directory. The modification time of the
+        directory isn't used, it doesn't change when files get added or removed within the same clock tick.
+        """
+        extension = self.extension
+        return frozenset(
+            file_name for file_name in os.listdir(self.root_path)
+            if file_name.endswith(extension) and not file_name.startswith('.')
+        )
+
 
 cdef class MemoryConfigRepository(ConfigRepository):
     """
@@ -66,3 +390,25 @@ cdef class MemoryConfigRepository(ConfigRepository):
 
     def __init__(self):
         self.native_repo = self.memory_repo = new NativeMemoryConfigRepository()
+        self.generation = 0
+        self.generations = {}
+
+    def save_bytes(self, name, content):
+        ConfigRepository.save_bytes(self, name, content)
+        self.generation += 1
+        self.generations[name] = self.generation
+
+    def version(self, name):
+        """
+        Versions of memory configs are generation numbers, bumped every time a config is saved.
+        """
+        try:
+            return name, self.generations[name]
+        except KeyError:
+            raise ConfigNotFound("Config '{name}' was not found!".format(name=name))
+
+    def catalog_version(self):
+        """
+        Memory configs can't be removed, the catalog version is the number of configs.
+        """
+        return len(self.generations)
@@ -0,0 +1,54 @@
+from libc.stdint cimport uint32_t
+from libcpp cimport bool as cbool
+from libcpp.memory cimport shared_ptr
+from libcpp.string cimport string
+from libcpp.vector cimport vector
+
+from garlicconfig.layer cimport LayerValue
+
+
+cdef extern from "snapshot_utility.cpp" namespace "snapshot":
+
+    cdef enum Tag:
+        TAG_NULL
+        TAG_BOOL
+        TAG_INT
+        TAG_DOUBLE
+        TAG_STRING
+        TAG_ARRAY
+        TAG_OBJECT
+
+    cdef const uint32_t NOT_FOUND
+
+    cdef cppclass Reader:
+        Reader()
+        Reader(const char* data, size_t size) except +
+        uint32_t root()
+        uint32_t tag(uint32_t node) except +
+        cbool get_bool(uint32_t node) except +
+        int get_int(uint32_t node) except +
+        double get_double(uint32_t node) except +
+        string get_string(uint32_t node) except +
+        uint32_t count(uint32_t node) except +
+        uint32_t element(uint32_t node, uint32_t index) except +
+        string key(uint32_t node, uint32_t index) except +
+        uint32_t member(uint32_t node, uint32_t index) except +
+        uint32_t find(uint32_t node, const char* name, size_t length) except +
+        uint32_t resolve(uint32_t node, const vector[string]& segments) except +
+        shared_ptr[LayerValue] load(uint32_t node) except +
+
+
+cdef class SnapshotValue(object):
+
+    cdef Reader reader
+    cdef uint32_t node
+    cdef const unsigned char[:] data
+
+    @staticmethod
+    cdef SnapshotValue create(const unsigned char[:] data, Reader reader, uint32_t node)
+
+    cdef SnapshotValue view(self, uint32_t node)
+    cdef convert(self, uint32_t node)
+    cdef child(self, uint32_t node)
+    cdef uint32_t find(self, path) except *
+    cdef str type_name(self)
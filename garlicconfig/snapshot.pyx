@@ -0,0 +1,354 @@
+"""
+Binary snapshots of GarlicValue trees. Snapshots have a string table, offset indexed nodes and sorted member tables,
+so values can be looked up in place, e.g. straight from a memory mapped file, without loading or parsing anything.
+"""
+import io
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from libc.stdint cimport uint32_t
+from libcpp.string cimport string
+
+from garlicconfig.layer cimport CompiledPath, GarlicValue
+
+from garlicconfig.layer import LayerRetriever
+
+import six
+
+
+try:
+    available_str = basestring
+except NameError:
+    available_str = six.text_type
+
+_clock = getattr(time, 'monotonic', time.time)
+_replace = getattr(os, 'replace', os.rename)
+
+
+def map_file(path):
+    """
+    Memory map a file read-only.
+    :return: mmap.mmap
+    """
+    with io.open(path, 'rb') as snapshot_file:
+        if not os.fstat(snapshot_file.fileno()).st_size:
+            raise ValueError('Not a garlic snapshot.')  # empty files can't be mapped.
+        return mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_snapshot(path, data):
+    """
+    Atomically write a snapshot to a file. The snapshot is written to a temporary file in the same directory which
+    then replaces the given path, so readers never see partially written snapshots and files already mapped by
+    readers are left intact.
+    :param data: bytes of the snapshot, see GarlicValue.to_snapshot.
+    """
+    directory, file_name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + file_name + '.', dir=directory)
+    try:
+        with io.open(fd, 'wb') as output:
+            output.write(data)
+        _replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def compile_repository(repository, decoder=None, names=None):
+    """
+    Pack configs of a repository into a single snapshot. The root of the snapshot is an object mapping config names
+    to their decoded values.
+    :param repository: The repository to read configs from.
+    :type repository: garlicconfig.repositories.ConfigRepository
+    :param decoder: The decoder used to decode configs, defaults to JsonDecoder.
+    :param names: Names of the configs to include, defaults to all configs in the repository.
+    :return: bytes
+    """
+    values = LayerRetriever(repository, decoder).retrieve_many(sorted(names or repository.list_configs()))
+    root = GarlicValue({})
+    for name, value in six.iteritems(values):
+        root.set(name, value)
+    return root.to_snapshot()
+
+
+cdef class SnapshotValue(object):
+    """
+    A read-only value backed by a binary snapshot. Lookups are done in place: members are found by binary search and
+    only the values being accessed get converted to python types. Objects and arrays are returned as SnapshotValue
+    instances sharing the same data.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: bytes or any object supporting the buffer protocol holding a snapshot, see
+        GarlicValue.to_snapshot. The data must not change while in use.
+        """
+        cdef const unsigned char[:] buffer = data
+        if buffer.shape[0] == 0:
+            raise ValueError('Not a garlic snapshot.')
+        self.data = buffer
+        self.reader = Reader(<const char*>&buffer[0], buffer.shape[0])
+        self.node = self.reader.root()
+
+    @staticmethod
+    def open(path):
+        """
+        Memory map a snapshot file. Pages of the file only get read when accessed and are shared between processes.
+        :return: SnapshotValue
+        """
+        return SnapshotValue(map_file(path))
+
+    @staticmethod
+    cdef SnapshotValue create(const unsigned char[:] data, Reader reader, uint32_t node):
+        cdef SnapshotValue value = SnapshotValue.__new__(SnapshotValue)
+        value.data = data
+        value.reader = reader
+        value.node = node
+        return value
+
+    cdef SnapshotValue view(self, uint32_t node):
+        return SnapshotValue.create(self.data, self.reader, node)
+
+    cdef convert(self, uint32_t node):
+        cdef uint32_t tag = self.reader.tag(node)
+        cdef uint32_t index
+        if tag == TAG_STRING:
+            return self.reader.get_string(node).decode('utf-8')
+        elif tag == TAG_BOOL:
+            return self.reader.get_bool(node)
+        elif tag == TAG_INT:
+            return self.reader.get_int(node)
+        elif tag == TAG_DOUBLE:
+            return self.reader.get_double(node)
+        elif tag == TAG_OBJECT:
+            return {
+                self.reader.key(node, index).decode('utf-8'): self.convert(self.reader.member(node, index))
+                for index in range(self.reader.count(node))
+            }
+        elif tag == TAG_ARRAY:
+            return [self.convert(self.reader.element(node, index)) for index in range(self.reader.count(node))]
+        return None
+
+    cdef child(self, uint32_t node):
+        cdef uint32_t tag = self.reader.tag(node)
+        if tag == TAG_OBJECT or tag == TAG_ARRAY:
+            return self.view(node)
+        return self.convert(node)
+
+    cdef uint32_t find(self, path) except *:
+        cdef string segment
+        cdef uint32_t node = self.node
+        if isinstance(path, CompiledPath):
+            return self.reader.resolve(node, (<CompiledPath>path).segments)
+        for part in path.split('.'):
+            segment = part.encode('utf-8')
+            node = self.reader.find(node, segment.c_str(), segment.size())
+            if node == NOT_FOUND:
+                break
+        return node
+
+    cdef str type_name(self):
+        return ('NoneType', 'bool', 'int', 'float', 'str', 'list', 'dict')[self.reader.tag(self.node)]
+
+    def py_value(self):
+        return self.convert(self.node)
+
+    def garlic_value(self):
+        """
+        Load the value into a regular, mutable GarlicValue.
+        """
+        return GarlicValue.native_load(self.reader.load(self.node))
+
+    def is_object(self):
+        return self.reader.tag(self.node) == TAG_OBJECT
+
+    def is_array(self):
+        return self.reader.tag(self.node) == TAG_ARRAY
+
+    def __len__(self):
+        cdef uint32_t tag = self.reader.tag(self.node)
+        if not (tag == TAG_OBJECT or tag == TAG_ARRAY):
+            raise TypeError("SnapshotValue holding '{type}' has no len()".format(type=self.type_name()))
+        return self.reader.count(self.node)
+
+    def __bool__(self):
+        cdef uint32_t tag = self.reader.tag(self.node)
+        if tag == TAG_OBJECT or tag == TAG_ARRAY:
+            return self.reader.count(self.node) > 0
+        return True
+
+    def __getitem__(self, key):
+        """
+        Access a member of an object or an element of an array, see GarlicValue.__getitem__.
+        """
+        cdef string native_key
+        cdef uint32_t node
+        cdef Py_ssize_t index
+        cdef Py_ssize_t size
+        cdef uint32_t tag = self.reader.tag(self.node)
+        if tag == TAG_OBJECT:
+            if not isinstance(key, available_str):
+                raise KeyError(key)
+            native_key = key.encode('utf-8')
+            node = self.reader.find(self.node, native_key.c_str(), native_key.size())
+            if node == NOT_FOUND:
+                raise KeyError(key)
+            return self.child(node)
+        elif tag == TAG_ARRAY:
+            if not isinstance(key, six.integer_types) or isinstance(key, bool):
+                raise TypeError('SnapshotValue array indices must be integers.')
+            size = self.reader.count(self.node)
+            index = key + size if key < 0 else key
+            if not 0 <= index < size:
+                raise IndexError('SnapshotValue index out of range.')
+            return self.child(self.reader.element(self.node, index))
+        raise TypeError("SnapshotValue holding '{type}' is not subscriptable.".format(type=self.type_name()))
+
+    def get(self, key, default=None):
+        """
+        Similar to dict.get, works on objects only.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, item):
+        cdef string native_key
+        if self.is_object():
+            if not isinstance(item, available_str):
+                return False
+            native_key = item.encode('utf-8')
+            return self.reader.find(self.node, native_key.c_str(), native_key.size()) != NOT_FOUND
+        return item in self.values()
+
+    def keys(self):
+        """
+        :return: list of member names for objects.
+        """
+        cdef uint32_t index
+        if not self.is_object():
+            raise TypeError('Only SnapshotValue objects have keys.')
+        return [self.reader.key(self.node, index).decode('utf-8') for index in range(self.reader.count(self.node))]
+
+    def values(self):
+        """
+        :return: list of member values for objects or elements for arrays, see __getitem__.
+        """
+        cdef uint32_t index
+        if self.is_object():
+            return [self.child(self.reader.member(self.node, index)) for index in range(self.reader.count(self.node))]
+        elif self.is_array():
+            return [self.child(self.reader.element(self.node, index)) for index in range(self.reader.count(self.node))]
+        raise TypeError('Only SnapshotValue objects and arrays have values.')
+
+    def items(self):
+        """
+        :return: list of (key, value) tuples for objects, see __getitem__.
+        """
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        """
+        Iterates through member names for objects and elements for arrays.
+        """
+        if self.is_object():
+            return iter(self.keys())
+        return iter(self.values())
+
+    def resolve(self, path):
+        """
+        Resolve a value using a dot separated path or a CompiledPath.
+        :return: The python representation of the value or None if it doesn't exist.
+        """
+        cdef uint32_t node = self.find(path)
+        if node != NOT_FOUND:
+            return self.convert(node)
+
+    def resolve_node(self, path):
+        """
+        Resolve a node without converting it to python types.
+        :return: SnapshotValue or None if the path doesn't exist.
+        """
+        cdef uint32_t node = self.find(path)
+        if node != NOT_FOUND:
+            return self.view(node)
+
+
+class SharedSnapshot(object):
+    """
+    A snapshot file shared by many processes, e.g. pre-forked workers. Snapshots are memory mapped, so every process
+    resolves values against the same physical pages instead of holding its own decoded copy. A new generation gets
+    published by atomically replacing the file, each process picks it up on its next lookup. Use a path on a tmpfs
+    mount (e.g. /dev/shm) to keep snapshots in shared memory only.
+    """
+
+    def __init__(self, path, check_interval=0):
+        """
+        :param path: Path of the snapshot file.
+        :param check_interval: Minimum number of seconds between checks for a new generation. 0 checks on every
+        lookup, which costs a stat call.
+        :type check_interval: float
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.generation = 0
+        self.__lock = threading.Lock()
+        self.__value = None
+        self.__stamp = None
+        self.__checked_at = None
+
+    def publish(self, value):
+        """
+        Publish a new generation of the snapshot.
+        :param value: GarlicValue or the bytes of a snapshot, see compile_repository.
+        """
+        write_snapshot(self.path, value.to_snapshot() if isinstance(value, GarlicValue) else value)
+
+    def __stamp_of(self, stat):
+        return stat.st_dev, stat.st_ino, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size
+
+    def current(self):
+        """
+        The current generation of the snapshot, mapped again if it got replaced since the last check. Values obtained
+        from earlier generations stay valid.
+        :return: SnapshotValue
+        """
+        now = _clock() if self.check_interval else None
+        if self.__value is not None and now is not None and now - self.__checked_at < self.check_interval:
+            return self.__value
+        with self.__lock:
+            stamp = self.__stamp_of(os.stat(self.path))
+            if stamp != self.__stamp:
+                with io.open(self.path, 'rb') as snapshot_file:
+                    # the stamp of the open file is what got mapped, even if the path got replaced meanwhile.
+                    stamp = self.__stamp_of(os.fstat(snapshot_file.fileno()))
+                    if not stamp[3]:
+                        raise ValueError('Not a garlic snapshot.')
+                    value = SnapshotValue(mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ))
+                self.__value = value
+                self.__stamp = stamp
+                self.generation += 1
+            self.__checked_at = now
+            return self.__value
+
+    def resolve(self, path):
+        """
+        See SnapshotValue.resolve.
+        """
+        return self.current().resolve(path)
+
+    def resolve_node(self, path):
+        """
+        See SnapshotValue.resolve_node.
+        """
+        return self.current().resolve_node(path)
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __contains__(self, item):
+        return item in self.current()
@@ -0,0 +1,376 @@
+#include <cstdint>
+#include <cstring>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+#include "GarlicConfig/garlicconfig.h"
+
+
+using namespace std;
+using namespace garlic;
+
+
+/*
+ * Binary snapshots of LayerValue trees, all integers are little endian:
+ *
+ *   header    magic "GARLICSS", uint32 format version, uint32 root node offset, uint32 string table offset,
+ *             uint32 string count
+ *   nodes     4 byte aligned, children always precede their parents:
+ *             uint32 tag, followed by
+ *               bool    uint32 0 or 1
+ *               int     int32
+ *               double  8 bytes (IEEE 754)
+ *               string  uint32 string index
+ *               array   uint32 count, count * uint32 element offsets
+ *               object  uint32 count, count * (uint32 key string index, uint32 value offset), sorted by key bytes
+ *   strings   count * (uint32 data offset, uint32 size), followed by the string data. Strings are deduplicated.
+ *
+ * Snapshots can be used in place (e.g. memory mapped), every read is bounds checked so corrupt data raises
+ * invalid_argument rather than crashing.
+ */
+namespace snapshot {
+
+const char MAGIC[8] = {'G', 'A', 'R', 'L', 'I', 'C', 'S', 'S'};
+const uint32_t FORMAT_VERSION = 1;
+const uint32_t HEADER_SIZE = 24;
+const uint32_t NOT_FOUND = 0;  // the header lives at offset 0, so no node ever does.
+
+enum Tag : uint32_t {
+    TAG_NULL = 0,
+    TAG_BOOL = 1,
+    TAG_INT = 2,
+    TAG_DOUBLE = 3,
+    TAG_STRING = 4,
+    TAG_ARRAY = 5,
+    TAG_OBJECT = 6,
+};
+
+
+inline uint32_t read_u32(const char* data) {
+    const unsigned char* bytes = reinterpret_cast<const unsigned char*>(data);
+    return uint32_t(bytes[0]) | uint32_t(bytes[1]) << 8 | uint32_t(bytes[2]) << 16 | uint32_t(bytes[3]) << 24;
+}
+
+
+class Writer {
+public:
+    string write(const shared_ptr<LayerValue>& root) {
+        data.assign(HEADER_SIZE, '\0');
+        strings.clear();
+        string_indices.clear();
+        uint32_t root_offset = write_node(root);
+        uint32_t strings_offset = size();
+        uint32_t string_data_offset = strings_offset + 8 * strings.size();
+        for (const string* value : strings) {
+            put_u32(string_data_offset);
+            put_u32(value->size());
+            string_data_offset += value->size();
+        }
+        for (const string* value : strings) {
+            data += *value;
+        }
+        if (data.size() > UINT32_MAX) {
+            throw length_error("Value is too large for a snapshot.");
+        }
+        data.replace(0, sizeof(MAGIC), MAGIC, sizeof(MAGIC));
+        set_u32(8, FORMAT_VERSION);
+        set_u32(12, root_offset);
+        set_u32(16, strings_offset);
+        set_u32(20, strings.size());
+        return move(data);
+    }
+
+private:
+    string data;
+    vector<const string*> strings;
+    unordered_map<string, uint32_t> string_indices;
+
+    uint32_t size() const {
+        return static_cast<uint32_t>(data.size());
+    }
+
+    void put_u32(uint32_t value) {
+        char bytes[4] = {char(value), char(value >> 8), char(value >> 16), char(value >> 24)};
+        data.append(bytes, 4);
+    }
+
+    void set_u32(size_t offset, uint32_t value) {
+        char bytes[4] = {char(value), char(value >> 8), char(value >> 16), char(value >> 24)};
+        data.replace(offset, 4, bytes, 4);
+    }
+
+    uint32_t string_index(const string& value) {
+        auto inserted = string_indices.emplace(value, strings.size());
+        if (inserted.second) {
+            strings.push_back(&inserted.first->first);
+        }
+        return inserted.first->second;
+    }
+
+    uint32_t write_node(const shared_ptr<LayerValue>& value) {
+        if (value->is_object()) {
+            vector<pair<uint32_t, uint32_t>> members;
+            // members are kept in a map ordered by key, which is the order lookups binary search in.
+            for (auto it = value->begin_member(); it != value->end_member(); ++it) {
+                members.emplace_back(string_index(it->first), write_node(it->second));
+            }
+            uint32_t offset = size();
+            put_u32(TAG_OBJECT);
+            put_u32(members.size());
+            for (const auto& member : members) {
+                put_u32(member.first);
+                put_u32(member.second);
+            }
+            return offset;
+        }
+        if (value->is_array()) {
+            vector<uint32_t> elements;
+            for (auto it = value->begin_element(); it != value->end_element(); ++it) {
+                elements.push_back(write_node(*it));
+            }
+            uint32_t offset = size();
+            put_u32(TAG_ARRAY);
+            put_u32(elements.size());
+            for (uint32_t element : elements) {
+                put_u32(element);
+            }
+            return offset;
+        }
+        uint32_t offset = size();
+        if (value->is_string()) {
+            put_u32(TAG_STRING);
+            put_u32(string_index(value->get_string()));
+        } else if (value->is_bool()) {
+            put_u32(TAG_BOOL);
+            put_u32(value->get_bool() ? 1 : 0);
+        } else if (value->is_int()) {
+            put_u32(TAG_INT);
+            put_u32(static_cast<uint32_t>(value->get_int()));
+        } else if (value->is_double()) {
+            double number = value->get_double();
+            uint64_t bits;
+            memcpy(&bits, &number, sizeof(bits));
+            put_u32(TAG_DOUBLE);
+            put_u32(static_cast<uint32_t>(bits));
+            put_u32(static_cast<uint32_t>(bits >> 32));
+        } else {
+            put_u32(TAG_NULL);
+        }
+        return offset;
+    }
+};
+
+
+/*
+ * A read-only view of a snapshot, it doesn't own the data. Nodes are identified by their offsets.
+ */
+class Reader {
+public:
+    Reader() : data(nullptr), size(0), root_offset(NOT_FOUND), strings_offset(0), string_count(0) {}
+
+    Reader(const char* data, size_t size) : data(data), size(size) {
+        if (size < HEADER_SIZE || memcmp(data, MAGIC, sizeof(MAGIC)) != 0) {
+            throw invalid_argument("Not a garlic snapshot.");
+        }
+        if (read_u32(data + 8) != FORMAT_VERSION) {
+            throw invalid_argument("Unsupported snapshot format version.");
+        }
+        root_offset = read_u32(data + 12);
+        strings_offset = read_u32(data + 16);
+        string_count = read_u32(data + 20);
+        check(strings_offset, uint64_t(string_count) * 8);
+        tag(root_offset);
+    }
+
+    uint32_t root() const {
+        return root_offset;
+    }
+
+    uint32_t tag(uint32_t node) const {
+        if (node < HEADER_SIZE || node % 4) {
+            corrupt();
+        }
+        uint32_t value = u32(node);
+        if (value > TAG_OBJECT) {
+            corrupt();
+        }
+        return value;
+    }
+
+    bool get_bool(uint32_t node) const {
+        return u32(node + 4) != 0;
+    }
+
+    int get_int(uint32_t node) const {
+        return static_cast<int32_t>(u32(node + 4));
+    }
+
+    double get_double(uint32_t node) const {
+        uint64_t bits = uint64_t(u32(node + 4)) | uint64_t(u32(node + 8)) << 32;
+        double value;
+        memcpy(&value, &bits, sizeof(value));
+        return value;
+    }
+
+    string get_string(uint32_t node) const {
+        return string_at(u32(node + 4));
+    }
+
+    /*
+     * Number of elements of an array or members of an object.
+     */
+    uint32_t count(uint32_t node) const {
+        uint32_t value = u32(node + 4);
+        check(node + 8, uint64_t(value) * (tag(node) == TAG_OBJECT ? 8 : 4));
+        return value;
+    }
+
+    uint32_t element(uint32_t node, uint32_t index) const {
+        return child(node, u32(node + 8 + 4 * index));
+    }
+
+    string key(uint32_t node, uint32_t index) const {
+        return string_at(u32(node + 8 + 8 * index));
+    }
+
+    uint32_t member(uint32_t node, uint32_t index) const {
+        return child(node, u32(node + 12 + 8 * index));
+    }
+
+    /*
+     * Binary search an object's members, returns NOT_FOUND if there's no such member.
+     */
+    uint32_t find(uint32_t node, const char* name, size_t length) const {
+        if (tag(node) != TAG_OBJECT) {
+            return NOT_FOUND;
+        }
+        uint32_t low = 0;
+        uint32_t high = count(node);
+        while (low < high) {
+            uint32_t middle = low + (high - low) / 2;
+            const char* key_data;
+            uint32_t key_size;
+            string_data(u32(node + 8 + 8 * middle), key_data, key_size);
+            int compared = memcmp(key_data, name, min<size_t>(key_size, length));
+            if (compared == 0) {
+                compared = key_size < length ? -1 : (key_size > length ? 1 : 0);
+            }
+            if (compared == 0) {
+                return member(node, middle);
+            }
+            if (compared < 0) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        return NOT_FOUND;
+    }
+
+    uint32_t resolve(uint32_t node, const vector<string>& segments) const {
+        for (const auto& segment : segments) {
+            node = find(node, segment.data(), segment.size());
+            if (node == NOT_FOUND) {
+                break;
+            }
+        }
+        return node;
+    }
+
+    /*
+     * Copy a node into a regular LayerValue tree.
+     */
+    shared_ptr<LayerValue> load(uint32_t node) const {
+        switch (tag(node)) {
+            case TAG_BOOL:
+                return make_shared<BoolValue>(get_bool(node));
+            case TAG_INT:
+                return make_shared<IntegerValue>(get_int(node));
+            case TAG_DOUBLE:
+                return make_shared<DoubleValue>(get_double(node));
+            case TAG_STRING:
+                return make_shared<StringValue>(get_string(node));
+            case TAG_ARRAY: {
+                auto value = make_shared<ListValue>();
+                uint32_t size = count(node);
+                for (uint32_t i = 0; i < size; ++i) {
+                    value->add(load(element(node, i)));
+                }
+                return value;
+            }
+            case TAG_OBJECT: {
+                auto value = make_shared<ObjectValue>();
+                uint32_t size = count(node);
+                for (uint32_t i = 0; i < size; ++i) {
+                    value->set(key(node, i), load(member(node, i)));
+                }
+                return value;
+            }
+            default:
+                return make_shared<NullValue>();
+        }
+    }
+
+private:
+    const char* data;
+    size_t size;
+    uint32_t root_offset;
+    uint32_t strings_offset;
+    uint32_t string_count;
+
+    [[noreturn]] static void corrupt() {
+        throw invalid_argument("Corrupt garlic snapshot.");
+    }
+
+    void check(uint64_t offset, uint64_t length) const {
+        if (offset + length > size) {
+            corrupt();
+        }
+    }
+
+    uint32_t u32(uint64_t offset) const {
+        check(offset, 4);
+        return read_u32(data + offset);
+    }
+
+    uint32_t child(uint32_t node, uint32_t offset) const {
+        // children precede their parents, which also rules out cycles in corrupt data.
+        if (offset >= node) {
+            corrupt();
+        }
+        return offset;
+    }
+
+    void string_data(uint32_t index, const char*& value, uint32_t& length) const {
+        if (index >= string_count) {
+            corrupt();
+        }
+        uint32_t offset = u32(strings_offset + 8 * uint64_t(index));
+        length = u32(strings_offset + 8 * uint64_t(index) + 4);
+        check(offset, length);
+        value = data + offset;
+    }
+
+    string string_at(uint32_t index) const {
+        const char* value;
+        uint32_t length;
+        string_data(index, value, length);
+        return string(value, length);
+    }
+};
+
+}  // namespace snapshot
+
+
+string dump_snapshot(const shared_ptr<LayerValue>& value) {
+    return snapshot::Writer().write(value);
+}
+
+
+shared_ptr<LayerValue> load_snapshot(const char* data, size_t size) {
+    snapshot::Reader reader(data, size);
+    return reader.load(reader.root());
+}
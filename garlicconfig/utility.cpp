@@ -1,6 +1,21 @@
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <condition_variable>
+#include <cstdio>
+#include <cstdlib>
+#include <exception>
 #include <iostream>
+#include <iterator>
+#include <mutex>
+#include <stdexcept>
+#include <streambuf>
 #include <string>
 #include <map>
+#include <set>
+#include <system_error>
+#include <thread>
+#include <vector>
 
 #include "GarlicConfig/garlicconfig.h"
 
@@ -9,18 +24,675 @@ using namespace std;
 using namespace garlic;
 
 
-void save_str_to_repo(ConfigRepository* repo, const string& name, const string& content) {
-    repo->save(name, [&content](ostream& output_stream) {
-        output_stream << content;
+/*
+ * Native repositories aren't thread-safe, yet they're accessed without the GIL. Every repository has one of these
+ * locks: reads (retrieve, list_configs) can run concurrently, saves get exclusive access. Waiting writers block new
+ * readers so a steady stream of reads can't starve them.
+ */
+class RepositoryLock {
+public:
+    RepositoryLock() : readers(0), waiting_writers(0), writing(false) {}
+
+    void lock_shared() {
+        unique_lock<mutex> guard(state_mutex);
+        changed.wait(guard, [this]() { return !writing && !waiting_writers; });
+        ++readers;
+    }
+
+    void unlock_shared() {
+        lock_guard<mutex> guard(state_mutex);
+        if (!--readers) {
+            changed.notify_all();
+        }
+    }
+
+    void lock() {
+        unique_lock<mutex> guard(state_mutex);
+        ++waiting_writers;
+        changed.wait(guard, [this]() { return !writing && !readers; });
+        --waiting_writers;
+        writing = true;
+    }
+
+    void unlock() {
+        lock_guard<mutex> guard(state_mutex);
+        writing = false;
+        changed.notify_all();
+    }
+
+private:
+    mutex state_mutex;
+    condition_variable changed;
+    size_t readers;
+    size_t waiting_writers;
+    bool writing;
+};
+
+
+class SharedRepositoryLock {
+public:
+    explicit SharedRepositoryLock(RepositoryLock* lock) : lock(lock) {
+        lock->lock_shared();
+    }
+
+    ~SharedRepositoryLock() {
+        lock->unlock_shared();
+    }
+
+private:
+    RepositoryLock* lock;
+};
+
+
+void save_buffer_to_repo(ConfigRepository* repo, RepositoryLock* lock, const string& name, const char* data,
+                         size_t size) {
+    lock_guard<RepositoryLock> guard(*lock);
+    repo->save(name, [data, size](ostream& output_stream) {
+        output_stream.write(data, size);
     });
 }
 
 
-string read_str_from_repo(ConfigRepository* repo, const string& name) {
+set<string> list_repo_configs(ConfigRepository* repo, RepositoryLock* lock) {
+    SharedRepositoryLock guard(lock);
+    return repo->list_configs();
+}
+
+
+string read_str_from_repo(ConfigRepository* repo, RepositoryLock* lock, const string& name) {
+    SharedRepositoryLock guard(lock);
     return string(istreambuf_iterator<char>(repo->retrieve(name)->rdbuf()), {});
 }
 
 
-shared_ptr<LayerValue> load_value(ConfigRepository* repo, Decoder* decoder, const string& name) {
+/*
+ * Reads a config into a string. Like BatchLoader, run() never throws so it can be called without the GIL, errors get
+ * re-thrown by check().
+ */
+class ConfigReader {
+public:
+    ConfigReader(ConfigRepository* repo, RepositoryLock* lock, const string& name) : repo(repo), lock(lock), name(name) {}
+
+    void run() {
+        try {
+            data = read_str_from_repo(repo, lock, name);
+        } catch (...) {
+            error = current_exception();
+        }
+    }
+
+    void check() const {
+        if (error) {
+            rethrow_exception(error);
+        }
+    }
+
+    const string& content() const {
+        return data;
+    }
+
+private:
+    ConfigRepository* repo;
+    RepositoryLock* lock;
+    string name;
+    string data;
+    exception_ptr error;
+};
+
+
+/*
+ * Reads a config in chunks, so large configs never have to be held in memory as a whole. Every chunk is read holding
+ * the repository lock, a config saved while it's being streamed may still be seen partially.
+ */
+class ConfigStream {
+public:
+    ConfigStream(ConfigRepository* repo, RepositoryLock* lock, const string& name) : lock(lock) {
+        SharedRepositoryLock guard(lock);
+        stream = repo->retrieve(name);
+    }
+
+    size_t read(char* buffer, size_t size) {
+        SharedRepositoryLock guard(lock);
+        stream->read(buffer, size);
+        return stream->gcount();
+    }
+
+private:
+    RepositoryLock* lock;
+    unique_ptr<istream> stream;
+};
+
+
+/*
+ * A read-only stream buffer over memory owned by someone else, so data can be decoded without copying it.
+ */
+class MemoryBuffer : public streambuf {
+public:
+    MemoryBuffer(const char* data, size_t size) {
+        char* begin = const_cast<char*>(data);
+        setg(begin, begin, begin + size);
+    }
+};
+
+
+shared_ptr<LayerValue> load_value_from_memory(Decoder* decoder, const char* data, size_t size) {
+    MemoryBuffer buffer(data, size);
+    istream input_stream(&buffer);
+    return decoder->load(input_stream);
+}
+
+
+shared_ptr<LayerValue> load_value(ConfigRepository* repo, RepositoryLock* lock, Decoder* decoder, const string& name) {
+    SharedRepositoryLock guard(lock);
     return decoder->load(*repo->retrieve(name));
 }
+
+
+/*
+ * Loads many configs concurrently. run() never throws and doesn't need the GIL, the first error is kept and gets
+ * re-thrown by check() so it can be translated to a python exception.
+ */
+class BatchLoader {
+public:
+    BatchLoader(ConfigRepository* repo, RepositoryLock* lock, Decoder* decoder, const vector<string>& names)
+        : repo(repo), lock(lock), decoder(decoder), names(names), values(names.size()), failed(false) {}
+
+    void run(unsigned int workers) {
+        atomic<size_t> next(0);
+        auto work = [this, &next]() {
+            size_t index;
+            while (!failed && (index = next++) < names.size()) {
+                try {
+                    values[index] = load_value(repo, lock, decoder, names[index]);
+                } catch (...) {
+                    lock_guard<mutex> lock(error_mutex);
+                    if (!error) {
+                        error = current_exception();
+                    }
+                    failed = true;
+                }
+            }
+        };
+        vector<thread> threads;
+        workers = min<size_t>(workers, names.size());
+        for (unsigned int i = 1; i < workers; ++i) {
+            try {
+                threads.emplace_back(work);
+            } catch (const system_error&) {
+                break;  // carry on with the threads we've got.
+            }
+        }
+        work();
+        for (auto& worker : threads) {
+            worker.join();
+        }
+    }
+
+    void check() const {
+        if (error) {
+            rethrow_exception(error);
+        }
+    }
+
+    const vector<shared_ptr<LayerValue>>& results() const {
+        return values;
+    }
+
+private:
+    ConfigRepository* repo;
+    RepositoryLock* lock;
+    Decoder* decoder;
+    vector<string> names;
+    vector<shared_ptr<LayerValue>> values;
+    atomic<bool> failed;
+    exception_ptr error;
+    mutex error_mutex;
+};
+
+
+const shared_ptr<LayerValue>& resolve_segments(const shared_ptr<LayerValue>& value, const vector<string>& segments) {
+    const shared_ptr<LayerValue>* current = &value;
+    for (const auto& segment : segments) {
+        if (!(*current)->is_object()) {
+            return NotFoundPtr;
+        }
+        current = &(*current)->resolve(segment);
+        if (*current == NotFoundPtr) {
+            return NotFoundPtr;
+        }
+    }
+    return *current;
+}
+
+
+const shared_ptr<LayerValue>& get_member(const shared_ptr<LayerValue>& value, const string& key) {
+    if (!value->is_object()) {
+        return NotFoundPtr;
+    }
+    if (key.find('.') == string::npos) {
+        return value->resolve(key);
+    }
+    // keys containing dots can't be resolved as paths, look them up directly.
+    auto it = find_if(value->begin_member(), value->end_member(), [&key](const pair<const string, shared_ptr<LayerValue>>& member) {
+        return member.first == key;
+    });
+    return it != value->end_member() ? it->second : NotFoundPtr;
+}
+
+
+const shared_ptr<LayerValue>& get_element(const shared_ptr<LayerValue>& value, size_t index) {
+    return *(value->begin_element() + index);
+}
+
+
+size_t layer_size(const shared_ptr<LayerValue>& value) {
+    if (value->is_object()) {
+        return distance(value->begin_member(), value->end_member());
+    }
+    return distance(value->begin_element(), value->end_element());
+}
+
+
+/*
+ * Writes LayerValue trees as JSON, producing the same output as the python encoders: json.dumps with sort_keys and
+ * ensure_ascii for the compact format and PrettyJSONEncoder (indent of 2) for the pretty one. Members are kept in a
+ * sorted map, so keys are always written in sorted order.
+ */
+class JsonWriter {
+public:
+    explicit JsonWriter(bool pretty) : pretty(pretty) {}
+
+    string write(const shared_ptr<LayerValue>& value) {
+        output.clear();
+        if (pretty) {
+            write_pretty(value, 0);
+        } else {
+            write_compact(value);
+        }
+        return move(output);
+    }
+
+private:
+    bool pretty;
+    string output;
+
+    static bool is_container(const shared_ptr<LayerValue>& value) {
+        return value->is_object() || value->is_array();
+    }
+
+    void write_compact(const shared_ptr<LayerValue>& value) {
+        if (value->is_object()) {
+            output += '{';
+            for (auto it = value->begin_member(); it != value->end_member(); ++it) {
+                if (it != value->begin_member()) {
+                    output += ',';
+                }
+                write_string(it->first);
+                output += ':';
+                write_compact(it->second);
+            }
+            output += '}';
+        } else if (value->is_array()) {
+            output += '[';
+            for (auto it = value->begin_element(); it != value->end_element(); ++it) {
+                if (it != value->begin_element()) {
+                    output += ',';
+                }
+                write_compact(*it);
+            }
+            output += ']';
+        } else {
+            write_scalar(value);
+        }
+    }
+
+    void write_pretty(const shared_ptr<LayerValue>& value, size_t indent) {
+        if (value->is_object()) {
+            // mirrors PrettyJSONEncoder, which also puts an empty line in empty objects.
+            output += "{\n";
+            for (auto it = value->begin_member(); it != value->end_member(); ++it) {
+                if (it != value->begin_member()) {
+                    output += ",\n";
+                }
+                output.append(indent + 2, ' ');
+                write_string(it->first);
+                output += ": ";
+                write_pretty(it->second, indent + 2);
+            }
+            output += '\n';
+            output.append(indent, ' ');
+            output += '}';
+        } else if (value->is_array()) {
+            if (none_of(value->begin_element(), value->end_element(), is_container)) {
+                // arrays of primitives are kept on a single line.
+                output += '[';
+                for (auto it = value->begin_element(); it != value->end_element(); ++it) {
+                    if (it != value->begin_element()) {
+                        output += ", ";
+                    }
+                    write_scalar(*it);
+                }
+                output += ']';
+                return;
+            }
+            output += "[\n";
+            for (auto it = value->begin_element(); it != value->end_element(); ++it) {
+                if (it != value->begin_element()) {
+                    output += ",\n";
+                }
+                output.append(indent + 2, ' ');
+                write_pretty(*it, indent + 2);
+            }
+            output += '\n';
+            output.append(indent, ' ');
+            output += ']';
+        } else {
+            write_scalar(value);
+        }
+    }
+
+    void write_scalar(const shared_ptr<LayerValue>& value) {
+        if (value->is_string()) {
+            write_string(value->get_string());
+        } else if (value->is_bool()) {
+            output += value->get_bool() ? "true" : "false";
+        } else if (value->is_int()) {
+            output += to_string(value->get_int());
+        } else if (value->is_double()) {
+            write_double(value->get_double());
+        } else {
+            output += "null";
+        }
+    }
+
+    void write_double(double value) {
+        if (isnan(value)) {
+            output += "NaN";
+            return;
+        }
+        if (isinf(value)) {
+            output += value < 0 ? "-Infinity" : "Infinity";
+            return;
+        }
+        // find the shortest representation that round trips, like python's float repr.
+        char buffer[32];
+        for (int precision = 1; precision <= 17; ++precision) {
+            snprintf(buffer, sizeof(buffer), "%.*e", precision - 1, value);
+            if (strtod(buffer, nullptr) == value) {
+                break;
+            }
+        }
+        // buffer is [-]d[.ddd]e[+-]xx, lay the digits out the way repr does.
+        const char* cursor = buffer;
+        if (*cursor == '-') {
+            output += '-';
+            ++cursor;
+        }
+        string digits;
+        for (; *cursor != 'e'; ++cursor) {
+            if (*cursor != '.') {
+                digits += *cursor;
+            }
+        }
+        int exponent = atoi(cursor + 1);
+        if (exponent < -4 || exponent >= 16) {
+            output += digits[0];
+            if (digits.size() > 1) {
+                output += '.';
+                output.append(digits, 1, string::npos);
+            }
+            char exponent_buffer[8];
+            snprintf(exponent_buffer, sizeof(exponent_buffer), "e%c%02d", exponent < 0 ? '-' : '+', abs(exponent));
+            output += exponent_buffer;
+        } else if (exponent < 0) {
+            output += "0.";
+            output.append(-exponent - 1, '0');
+            output += digits;
+        } else if (static_cast<size_t>(exponent) + 1 >= digits.size()) {
+            output += digits;
+            output.append(exponent + 1 - digits.size(), '0');
+            output += ".0";
+        } else {
+            output.append(digits, 0, exponent + 1);
+            output += '.';
+            output.append(digits, exponent + 1, string::npos);
+        }
+    }
+
+    void write_escape(unsigned int code_point) {
+        static const char hex[] = "0123456789abcdef";
+        output += "\\u";
+        output += hex[(code_point >> 12) & 0xf];
+        output += hex[(code_point >> 8) & 0xf];
+        output += hex[(code_point >> 4) & 0xf];
+        output += hex[code_point & 0xf];
+    }
+
+    void write_string(const string& value) {
+        output += '"';
+        size_t size = value.size();
+        for (size_t i = 0; i < size; ++i) {
+            unsigned char c = value[i];
+            switch (c) {
+                case '"': output += "\\\""; continue;
+                case '\\': output += "\\\\"; continue;
+                case '\n': output += "\\n"; continue;
+                case '\r': output += "\\r"; continue;
+                case '\t': output += "\\t"; continue;
+                case '\b': output += "\\b"; continue;
+                case '\f': output += "\\f"; continue;
+            }
+            if (c >= 0x20 && c < 0x7f) {
+                output += c;
+                continue;
+            }
+            if (c < 0x80) {
+                write_escape(c);
+                continue;
+            }
+            // decode utf-8, non ascii characters are escaped like json.dumps does with ensure_ascii.
+            unsigned int code_point;
+            size_t length;
+            if ((c & 0xe0) == 0xc0) {
+                code_point = c & 0x1f;
+                length = 1;
+            } else if ((c & 0xf0) == 0xe0) {
+                code_point = c & 0x0f;
+                length = 2;
+            } else if ((c & 0xf8) == 0xf0) {
+                code_point = c & 0x07;
+                length = 3;
+            } else {
+                write_escape(0xfffd);
+                continue;
+            }
+            if (i + length >= size) {
+                write_escape(0xfffd);  // truncated sequence.
+                break;
+            }
+            for (size_t j = 1; j <= length; ++j) {
+                code_point = (code_point << 6) | (static_cast<unsigned char>(value[i + j]) & 0x3f);
+            }
+            i += length;
+            if (code_point >= 0x10000) {
+                code_point -= 0x10000;
+                write_escape(0xd800 | (code_point >> 10));
+                write_escape(0xdc00 | (code_point & 0x3ff));
+            } else {
+                write_escape(code_point);
+            }
+        }
+        output += '"';
+    }
+};
+
+
+string dump_value(const shared_ptr<LayerValue>& value, bool pretty) {
+    return JsonWriter(pretty).write(value);
+}
+
+
+bool values_equal(const shared_ptr<LayerValue>& first, const shared_ptr<LayerValue>& second) {
+    if (first == second) {
+        return true;  // shared subtrees are never walked.
+    }
+    if (first->is_object()) {
+        if (!second->is_object()) {
+            return false;
+        }
+        auto first_it = first->begin_member();
+        auto second_it = second->begin_member();
+        for (; first_it != first->end_member() && second_it != second->end_member(); ++first_it, ++second_it) {
+            if (first_it->first != second_it->first || !values_equal(first_it->second, second_it->second)) {
+                return false;
+            }
+        }
+        return first_it == first->end_member() && second_it == second->end_member();
+    }
+    if (first->is_array()) {
+        if (!second->is_array()) {
+            return false;
+        }
+        auto first_it = first->begin_element();
+        auto second_it = second->begin_element();
+        for (; first_it != first->end_element() && second_it != second->end_element(); ++first_it, ++second_it) {
+            if (!values_equal(*first_it, *second_it)) {
+                return false;
+            }
+        }
+        return first_it == first->end_element() && second_it == second->end_element();
+    }
+    if (first->is_string()) {
+        return second->is_string() && first->get_string() == second->get_string();
+    }
+    if (first->is_bool()) {
+        return second->is_bool() && first->get_bool() == second->get_bool();
+    }
+    if (first->is_int()) {
+        return second->is_int() && first->get_int() == second->get_int();
+    }
+    if (first->is_double()) {
+        return second->is_double() && first->get_double() == second->get_double();
+    }
+    return second->is_null() && first->is_null();
+}
+
+
+/*
+ * A change produced by diff_values, value is null for removed members.
+ */
+struct ValueChange {
+    vector<string> path;
+    shared_ptr<LayerValue> value;
+};
+
+
+void diff_members(const shared_ptr<LayerValue>& first, const shared_ptr<LayerValue>& second, vector<string>& path,
+                  vector<ValueChange>& changes) {
+    // members are sorted by key, so both objects get walked in a single merge pass.
+    auto first_it = first->begin_member();
+    auto second_it = second->begin_member();
+    while (first_it != first->end_member() || second_it != second->end_member()) {
+        if (second_it == second->end_member() || (first_it != first->end_member() && first_it->first < second_it->first)) {
+            path.push_back(first_it->first);
+            changes.push_back({path, nullptr});
+            path.pop_back();
+            ++first_it;
+        } else if (first_it == first->end_member() || second_it->first < first_it->first) {
+            path.push_back(second_it->first);
+            changes.push_back({path, second_it->second});
+            path.pop_back();
+            ++second_it;
+        } else {
+            if (first_it->second != second_it->second) {
+                path.push_back(first_it->first);
+                if (first_it->second->is_object() && second_it->second->is_object()) {
+                    diff_members(first_it->second, second_it->second, path, changes);
+                } else if (!values_equal(first_it->second, second_it->second)) {
+                    changes.push_back({path, second_it->second});
+                }
+                path.pop_back();
+            }
+            ++first_it;
+            ++second_it;
+        }
+    }
+}
+
+
+/*
+ * Lists the changes turning first into second: objects are compared member by member, any other value (including
+ * arrays) is replaced as a whole.
+ */
+vector<ValueChange> diff_values(const shared_ptr<LayerValue>& first, const shared_ptr<LayerValue>& second) {
+    vector<ValueChange> changes;
+    vector<string> path;
+    if (first->is_object() && second->is_object()) {
+        diff_members(first, second, path, changes);
+    } else if (!values_equal(first, second)) {
+        changes.push_back({path, second});
+    }
+    return changes;
+}
+
+
+shared_ptr<LayerValue> copy_members(const shared_ptr<LayerValue>& node, const string& key,
+                                    const shared_ptr<LayerValue>& value) {
+    // nodes may be shared with other values (e.g. the ones returned by diff_values), so they're never changed in place.
+    // The copy shares all other members, value replaces the member or, if null, drops it.
+    auto copy = make_shared<ObjectValue>();
+    for (auto it = node->begin_member(); it != node->end_member(); ++it) {
+        if (it->first != key) {
+            copy->set(it->first, it->second);
+        }
+    }
+    if (value) {
+        copy->set(key, value);
+    }
+    return copy;
+}
+
+
+shared_ptr<LayerValue> patch_member(const shared_ptr<LayerValue>& node, const vector<string>& path, size_t depth,
+                                    const shared_ptr<LayerValue>& value) {
+    if (depth == path.size()) {
+        return value;
+    }
+    if (!node) {
+        if (!value) {
+            return node;  // removing something that doesn't exist.
+        }
+        return patch_member(make_shared<ObjectValue>(), path, depth, value);
+    }
+    if (!node->is_object()) {
+        if (!value) {
+            return node;
+        }
+        string parent;
+        for (size_t i = 0; i < depth; ++i) {
+            parent += (i ? "." : "") + path[i];
+        }
+        throw invalid_argument("Can't set members of '" + parent + "', it's not an object.");
+    }
+    const string& key = path[depth];
+    const shared_ptr<LayerValue>& member = get_member(node, key);
+    shared_ptr<LayerValue> current = member == NotFoundPtr ? nullptr : member;
+    shared_ptr<LayerValue> patched = patch_member(current, path, depth + 1, value);
+    if (patched == current) {
+        return node;
+    }
+    return copy_members(node, key, patched);
+}
+
+
+/*
+ * Applies a change to value and returns the patched root. Objects along the path get copied rather than changed, so
+ * value and any node it shares with other values stay intact. Returns value itself if nothing changed.
+ */
+shared_ptr<LayerValue> patch_value(const shared_ptr<LayerValue>& value, const vector<string>& path,
+                                   const shared_ptr<LayerValue>& member) {
+    if (path.empty() && !member) {
+        throw invalid_argument("The root of a value can't be removed.");
+    }
+    return patch_member(value, path, 0, member);
+}
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Watch repositories for config changes. File repositories are watched using inotify on Linux, other platforms and
+repositories fall back to polling config versions.
+"""
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from garlicconfig.exceptions import ConfigNotFound
+from garlicconfig.layer import LayerRetriever
+from garlicconfig.repositories import FileConfigRepository
+
+import six
+
+
+_clock = getattr(time, 'monotonic', time.time)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+
+class _Inotify(object):
+    """
+    Minimal inotify binding reporting names of files created, replaced, written or removed in a directory.
+    watching turns False once the directory itself gets removed, moved or unmounted, no more events come in then.
+    """
+
+    def __init__(self, path):
+        inotify_init1, inotify_add_watch = _load_inotify()
+        self.watching = True
+        self.fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+        if inotify_add_watch(self.fd, os.fsencode(path) if six.PY3 else path, mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, 'inotify_add_watch failed for {path}'.format(path=path))
+
+    def read(self):
+        """
+        Read the pending events without blocking.
+        :return: tuple of (set of str file names, bool for whether events got lost)
+        """
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as error:
+                if error.errno == errno.EAGAIN:
+                    return names, overflow
+                raise
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED):
+                    self.watching = False
+                elif name:
+                    names.add(name.decode('utf-8', 'surrogateescape' if six.PY3 else 'replace'))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher(object):
+    """
+    Watches a repository and notifies subscribers with the name and the newly decoded GarlicValue of every config that
+    changes. Removed configs are notified with None. Only changed configs get decoded again.
+    Changes can be picked up by a background thread (start/stop) or by calling check.
+    """
+
+    def __init__(self, repository, decoder=None, debounce=0.05, poll_interval=1.0, use_inotify=None, on_error=None):
+        """
+        :param repository: The repository to watch.
+        :type repository: garlicconfig.repositories.ConfigRepository
+        :param decoder: The decoder used to decode changed configs, defaults to JsonDecoder.
+        :param debounce: Number of seconds to wait for more changes once a change is seen, so rapid writes to the same
+        config only get decoded once.
+        :type debounce: float
+        :param poll_interval: Number of seconds between polls when inotify is not used.
+        :type poll_interval: float
+        :param use_inotify: Whether or not to use inotify, defaults to using it for file repositories on Linux. If the
+        watched directory gets removed or replaced, the watcher watches the new directory or falls back to polling.
+        :type use_inotify: bool
+        :param on_error: Called with the config name and the exception when a changed config fails to decode (the
+        change is skipped) or, when running in the background, a subscriber raises (the name is None).
+        """
+        if use_inotify is None:
+            use_inotify = isinstance(repository, FileConfigRepository) and _load_inotify() is not None
+        if use_inotify and not isinstance(repository, FileConfigRepository):
+            raise TypeError('inotify can only be used to watch FileConfigRepository instances.')
+        if use_inotify and _load_inotify() is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform.')
+        self.repository = repository
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.on_error = on_error
+        self.__retriever = LayerRetriever(repository, decoder)
+        self.__subscribers = []
+        self.__inotify = _Inotify(repository.root_path) if use_inotify else None
+        self.__versions = self.__scan_versions()  # taken after the inotify watch is set, no change is missed.
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.__wakeup = None
+
+    @property
+    def uses_inotify(self):
+        return self.__inotify is not None
+
+    def subscribe(self, callback):
+        """
+        :param callback: Called with (name, value) for every changed config, value is None for removed configs.
+        :return: The callback, so this can be used as a decorator.
+        """
+        self.__subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.__subscribers.remove(callback)
+
+    def version(self, name):
+        """
+        Subscribers can use this to tell which version of a config the value they got notified with was decoded from,
+        versions are taken before configs get decoded.
+        :return: The repository version of the config when the watcher last saw it change, None if it's unknown.
+        """
+        return self.__versions.get(name)
+
+    def __scan_versions(self):
+        versions = {}
+        for name in self.repository.list_configs():
+            try:
+                versions[name] = self.repository.version(name)
+            except ConfigNotFound:
+                pass  # removed meanwhile.
+        return versions
+
+    def __poll_changes(self):
+        versions = self.__scan_versions()
+        changed = set(name for name, version in six.iteritems(versions) if self.__versions.get(name) != version)
+        changed.update(name for name in self.__versions if name not in versions)
+        self.__versions = versions
+        return changed
+
+    def __config_names(self, file_names):
+        extension = self.repository.extension
+        return set(
+            file_name[:-len(extension)] for file_name in file_names
+            if file_name.endswith(extension) and not file_name.startswith('.')
+        )
+
+    def __wait(self, fds, timeout):
+        try:
+            readable, _, _ = select.select(fds, [], [], max(timeout, 0))
+        except (OSError, select.error) as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            readable = []
+        return readable
+
+    def __inotify_changes(self, timeout):
+        fds = [self.__inotify.fd] + ([self.__wakeup[0]] if self.__wakeup else [])
+        if self.__inotify.fd not in self.__wait(fds, timeout):
+            return set()
+        file_names, overflow = self.__inotify.read()
+        # keep collecting until no more events come in within the debounce period.
+        while self.__inotify.fd in self.__wait([self.__inotify.fd], self.debounce):
+            more, more_overflow = self.__inotify.read()
+            file_names.update(more)
+            overflow = overflow or more_overflow
+        if not self.__inotify.watching:
+            self.__rewatch()
+            return self.__poll_changes()
+        if overflow:
+            return self.__poll_changes()
+        changed = self.__config_names(file_names)
+        # keep versions current, so rescans after an overflow only report what changed since.
+        for name in changed:
+            try:
+                self.__versions[name] = self.repository.version(name)
+            except ConfigNotFound:
+                self.__versions.pop(name, None)
+        return changed
+
+    def __rewatch(self):
+        # the watched directory is gone, watch the one now at the root path if there is one.
+        self.__inotify.close()
+        try:
+            self.__inotify = _Inotify(self.repository.root_path)
+        except OSError:
+            self.__inotify = None  # poll from now on.
+
+    def __polled_changes(self, timeout):
+        deadline = _clock() + timeout
+        changed = self.__poll_changes()
+        while not changed and not self.__stopped.is_set() and _clock() < deadline:
+            self.__stopped.wait(min(self.poll_interval, deadline - _clock()))
+            changed = self.__poll_changes()
+        # configs still being written keep changing, wait for them to settle.
+        while changed and self.debounce:
+            time.sleep(self.debounce)
+            more = self.__poll_changes()
+            if not more:
+                break
+            changed.update(more)
+        return changed
+
+    def check(self, timeout=0):
+        """
+        Pick up changes and notify subscribers.
+        :param timeout: Number of seconds to wait for a change.
+        :type timeout: float
+        :return: dict mapping names of changed configs to their new GarlicValue, None for removed configs.
+        """
+        with self.__lock:
+            if self.__inotify is not None:
+                changed = self.__inotify_changes(timeout)
+            else:
+                changed = self.__polled_changes(timeout)
+            changes = {}
+            for name in sorted(changed):
+                try:
+                    changes[name] = self.__retriever.retrieve(name)
+                except ConfigNotFound:
+                    changes[name] = None
+                except Exception as error:
+                    if self.on_error is not None:
+                        self.on_error(name, error)
+            for name in sorted(changes):
+                for callback in list(self.__subscribers):
+                    callback(name, changes[name])
+            return changes
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            try:
+                self.check(self.poll_interval)
+            except Exception as error:
+                if self.on_error is not None:
+                    self.on_error(None, error)
+
+    def start(self):
+        """
+        Start watching in a background daemon thread.
+        :return: self
+        """
+        if self.__thread is None:
+            self.__stopped.clear()
+            self.__wakeup = os.pipe()
+            self.__thread = threading.Thread(target=self.__run, name='garlicconfig-watcher')
+            self.__thread.daemon = True
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the background thread, if running.
+        """
+        if self.__thread is not None:
+            self.__stopped.set()
+            os.write(self.__wakeup[1], b'\0')
+            self.__thread.join()
+            self.__thread = None
+            for fd in self.__wakeup:
+                os.close(fd)
+            self.__wakeup = None
+
+    def close(self):
+        """
+        Stop watching and release the inotify handle.
+        """
+        self.stop()
+        if self.__inotify is not None:
+            self.__inotify.close()
+            self.__inotify = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
@@ -10,7 +10,8 @@ common_params = dict(
     include_dirs=[os.path.join(CGET_PATH, 'include')],
     library_dirs=[os.path.join(CGET_PATH, 'lib'), os.path.join(CGET_PATH, 'lib64')],
     libraries=['GarlicConfig'],
-    extra_compile_args=['-std=c++11']
+    extra_compile_args=['-std=c++11', '-pthread'],
+    extra_link_args=['-pthread'],
 )
 
 
@@ -28,6 +29,7 @@ ext_modules = [
     create_extension('layer'),
     create_extension('encoding'),
     create_extension('fields'),
+    create_extension('snapshot'),
 ]
 
 with open('VERSION', 'r') as reader:
@@ -2,16 +2,40 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import gc
 import json
 import os
 import shutil
+import tempfile
+import threading
+import time
 import unittest
+import weakref
+from collections import OrderedDict
 
-from garlicconfig import encoding
+from garlicconfig import cli, encoding, watch
+from garlicconfig.cache import LayerCache
 from garlicconfig.exceptions import ConfigNotFound, ValidationError
-from garlicconfig.fields import ArrayField, BooleanField, IntegerField, StringField
+from garlicconfig.fields import ArrayField, BooleanField, IntegerField, StringField, validate_many
+from garlicconfig.layer import GarlicValue, LayerRetriever, compile_path
+from garlicconfig.managers import FlatConfigManager, IndexedConfigManager, LayeredConfigManager
 from garlicconfig.models import ConfigModel, ModelField
 from garlicconfig.repositories import FileConfigRepository, MemoryConfigRepository
+from garlicconfig.snapshot import SharedSnapshot, SnapshotValue, compile_repository, write_snapshot
+from garlicconfig.watch import ConfigWatcher
+
+import six
+
+try:
+    import asyncio
+    from garlicconfig.aio import AsyncConfigManager, AsyncConfigRepository
+except (ImportError, SyntaxError):
+    asyncio = None
+
+
+class CliConfig(ConfigModel):
+    name = StringField(nullable=False, default='config')
+    port = IntegerField(domain=(1, 65535))
 
 
 class TestConfigFields(unittest.TestCase):
@@ -596,6 +620,296 @@ class TestConfigModel(unittest.TestCase):
         actual_result_json = json.dumps(ParentConfig.get_model_desc_dict(), sort_keys=True)
         self.assertEqual(actual_result_json, expected_end_result_json)
 
+    def test_lazy_defaults(self):
+        class ListConfig(ConfigModel):
+            tags = ArrayField(StringField(), default=['a'])
+            name = StringField(default='n')
+            child = ModelField(self.ChildModel)
+
+        first, second = ListConfig(), ListConfig()
+        self.assertEqual(first.__dict__, {})
+        first.tags.append('b')
+        first.child.age = 30
+        self.assertEqual(second.tags, ['a'])
+        self.assertEqual(second.child.age, 21)
+        self.assertEqual(ListConfig.tags, ['a'])
+        self.assertIsInstance(ListConfig.child, self.ChildModel)
+        self.assertEqual(ListConfig.__meta__.new_default('tags'), ['a'])
+        self.assertEqual(set(first.__dict__), {'tags', 'child'})
+
+        loaded = ListConfig.from_dict({'tags': ['c'], 'child': {'age': 5}})
+        self.assertEqual(set(loaded.__dict__), {'tags', 'child'})
+        self.assertEqual(loaded.py_value(), {'tags': ['c'], 'name': 'n', 'child': {'age': 5, 'working': True}})
+
+        # defaults overridden by subclasses win, for regular and compact models alike.
+        for is_compact in (False, True):
+            class BaseConfig(ConfigModel):
+                compact = is_compact
+                tags = ArrayField(StringField(), default=['base'])
+
+            class SubConfig(BaseConfig):
+                tags = ArrayField(StringField(), default=['sub'])
+
+            class SubSubConfig(SubConfig):
+                pass
+
+            self.assertEqual(BaseConfig().tags, ['base'])
+            self.assertEqual(SubConfig().tags, ['sub'])
+            self.assertEqual(SubSubConfig().tags, ['sub'])
+
+    def test_compact(self):
+        class CompactParent(ConfigModel):
+            compact = True
+            name = StringField(default='n')
+            age = IntegerField(nullable=False, default=21)
+
+        class CompactChild(CompactParent):
+            tags = ArrayField(StringField(), default=['a'])
+            child = ModelField(self.ParentModel)
+
+        config = CompactChild()
+        self.assertFalse(hasattr(config, '__dict__'))
+        self.assertEqual(CompactChild.__slots__, ('child', 'tags'))
+        self.assertEqual(set(CompactChild.__meta__.fields), {'name', 'age', 'tags', 'child'})
+        self.assertEqual((config.name, config.age, config.tags), ('n', 21, ['a']))
+        config.tags.append('b')
+        config.child.name = 'c'
+        self.assertEqual(CompactChild().tags, ['a'])
+        self.assertEqual(config.py_value(), {
+            'name': 'n', 'age': 21, 'tags': ['a', 'b'], 'child': {'name': 'c', 'age': 21},
+        })
+        with self.assertRaises(AttributeError):
+            config.other = 1
+        with self.assertRaises(AttributeError):
+            config.other
+
+        loaded = CompactChild.from_dict({'name': 'x', 'tags': ['y'], 'child': {'age': 3}})
+        self.assertEqual(loaded.py_value(), {'name': 'x', 'age': 21, 'tags': ['y'], 'child': {'age': 3}})
+        loaded.validate()
+        loaded.age = None
+        with self.assertRaises(ValidationError):
+            loaded.validate()
+
+        # a field named compact doesn't turn compact mode on.
+        class LayoutConfig(ConfigModel):
+            compact = BooleanField(default=True)
+            width = IntegerField(default=80)
+
+        class WideLayoutConfig(LayoutConfig):
+            height = IntegerField(default=24)
+
+        for model_class in (LayoutConfig, WideLayoutConfig):
+            layout = model_class.from_dict({'compact': False})
+            self.assertTrue(hasattr(layout, '__dict__'))
+            self.assertFalse(layout.compact)
+            self.assertEqual(layout.width, 80)
+        self.assertNotIn('__slots__', LayoutConfig.__dict__)
+
+    def test_garlic_hydration(self):
+        class UpperField(StringField):
+
+            def to_model_value(self, value):
+                return value.upper()
+
+        class GarlicConfig(ConfigModel):
+            name = StringField()
+            code = UpperField()
+            tags = ArrayField(StringField())
+            kids = ArrayField(ModelField(self.ParentModel))
+            child = ModelField(self.ChildModel)
+            empty = ModelField(self.OptionalConfig)
+
+        data = {
+            'name': 'a', 'code': 'b', 'tags': ['x'], 'kids': [{'name': 'k'}, {}], 'child': {'occupation': 'o'},
+            'unknown': {'deeply': ['nested']},
+        }
+        config = GarlicConfig.from_garlic(GarlicValue(data))
+        self.assertEqual((config.name, config.code, config.tags), ('a', 'B', ['x']))
+        self.assertEqual([kid.name for kid in config.kids], ['k', None])
+        self.assertEqual((config.child.occupation, config.child.working), ('o', True))
+        self.assertEqual(config.py_value(), GarlicConfig.from_dict(data).py_value())
+        self.assertIsNone(GarlicConfig.from_garlic(GarlicValue({'kids': [], 'tags': []})).kids)
+        with self.assertRaises(ValidationError):
+            GarlicConfig.from_garlic(GarlicValue({'child': [1]}))
+
+        garlic_value = config.garlic_value()
+        self.assertEqual(garlic_value.py_value(), config.py_value())
+        self.assertNotIn('empty', garlic_value)
+        self.assertEqual(GarlicConfig().garlic_value().py_value(), {'child': {'age': 21, 'working': True}})
+
+        # overridden from_dict and py_value hooks are used, at the top level and for nested models.
+        class HookedConfig(ConfigModel):
+            name = StringField()
+
+            @classmethod
+            def from_dict(cls, value):
+                instance = super(HookedConfig, cls).from_dict(value)
+                instance.name = instance.name.upper() if instance.name else instance.name
+                return instance
+
+            def py_value(self):
+                value = super(HookedConfig, self).py_value()
+                value['extra'] = 1
+                return value
+
+        class HookedParentConfig(ConfigModel):
+            hooked = ModelField(HookedConfig)
+            hooked_list = ArrayField(ModelField(HookedConfig))
+
+        self.assertEqual(HookedConfig.from_garlic(GarlicValue({'name': 'abc'})).name, 'ABC')
+        self.assertEqual(HookedConfig.from_dict({'name': 'abc'}).garlic_value().py_value(), {'name': 'ABC', 'extra': 1})
+        hooked_data = {'hooked': {'name': 'abc'}, 'hooked_list': [{'name': 'def'}]}
+        parent = HookedParentConfig.from_garlic(GarlicValue(hooked_data))
+        self.assertEqual((parent.hooked.name, parent.hooked_list[0].name), ('ABC', 'DEF'))
+        self.assertEqual(parent.garlic_value().py_value(), parent.py_value())
+        self.assertEqual(parent.garlic_value().py_value()['hooked'], {'name': 'ABC', 'extra': 1})
+
+        value = GarlicValue({'a': 1})
+        value.set('b', GarlicValue({'c': [1, 2]}))
+        value.set('a', 'x')
+        self.assertEqual(value.py_value(), {'a': 'x', 'b': {'c': [1, 2]}})
+        with self.assertRaises(TypeError):
+            GarlicValue([]).set('a', 1)
+
+    def test_lazy_from_garlic(self):
+        class UpperField(StringField):
+
+            def to_model_value(self, value):
+                return value.upper()
+
+        class LazyConfig(ConfigModel):
+            name = StringField()
+            code = UpperField()
+            tags = ArrayField(StringField(), default=['t'])
+            child = ModelField(self.ChildModel)
+
+        value = GarlicValue({'name': 'a', 'code': 'b', 'child': {'occupation': 'o', 'age': 30}, 'other': 1})
+        config = LazyConfig.lazy_from_garlic(value)
+        self.assertIsInstance(config, LazyConfig)
+        self.assertIs(type(LazyConfig.lazy_from_garlic(value)), type(config))
+        self.assertEqual(config._lazy_values, {})
+        self.assertEqual(config.code, 'B')
+        self.assertEqual(set(config._lazy_values), {'code'})
+        self.assertEqual(config.tags, ['t'])
+        self.assertIsInstance(config.child, self.ChildModel)
+        self.assertEqual(config.child._lazy_values, {})
+        self.assertEqual((config.child.occupation, config.child.working), ('o', True))
+
+        config.name = 'c'
+        self.assertEqual(config.name, 'c')
+        self.assertEqual(config.py_value(), {
+            'name': 'c', 'code': 'B', 'tags': ['t'], 'child': {'occupation': 'o', 'age': 30, 'working': True},
+        })
+        config.validate()
+        config.child.age = 'old'
+        with self.assertRaises(ValidationError):
+            config.validate()
+
+        class CompactConfig(ConfigModel):
+            compact = True
+            name = StringField(default='n')
+
+        compact = CompactConfig.lazy_from_garlic(GarlicValue({}))
+        self.assertEqual(compact.name, 'n')
+        self.assertEqual(CompactConfig.lazy_from_garlic(GarlicValue({'name': 'x'})).name, 'x')
+
+    def test_validation_errors(self):
+        class EvenField(IntegerField):
+
+            def validate(self, value):
+                super(EvenField, self).validate(value)
+                if value % 2:
+                    raise ValidationError('odd')
+
+        class ServerConfig(ConfigModel):
+            host = StringField(nullable=False, default='localhost')
+            port = IntegerField(domain=(1, 65535))
+            mode = StringField(choices=['a', 'b'])
+
+        class CheckedConfig(ConfigModel):
+            name = StringField()
+
+            def validate(self):
+                super(CheckedConfig, self).validate()
+                if self.name == 'bad':
+                    raise ValidationError('bad name')
+
+        class FleetConfig(ConfigModel):
+            name = StringField(nullable=False)
+            enabled = BooleanField()
+            even = EvenField()
+            servers = ArrayField(ModelField(ServerConfig))
+            tags = ArrayField(StringField())
+            checked = ModelField(CheckedConfig)
+
+        fleet = FleetConfig.from_dict({
+            'enabled': 1,
+            'even': 3,
+            'servers': [{'host': 'a', 'port': 80}, {'host': None, 'port': 0, 'mode': 'c'}],
+            'tags': ['x', 1],
+            'checked': {'name': 'bad'},
+        })
+        errors = fleet.validation_errors()
+        self.assertEqual([(error.path, str(error)) for error in errors], [
+            ('name', "Value for 'name' is not allowed to be null."),
+            ('enabled', "Expected 'bool' for 'enabled', but got 'int'."),
+            ('even', 'odd'),
+            ('servers.1.host', "Value for 'host' is not allowed to be null."),
+            ('servers.1.port', "Value '0' for 'port' has to be in range (1, 65535)."),
+            ('servers.1.mode', "Value 'c' for 'mode' is not accepted. Choices are 'a', 'b'"),
+            ('tags.1', "Expected 'str' for 'StringField', but got 'int'."),
+            ('checked', 'bad name'),
+        ])
+        with self.assertRaises(ValidationError) as context:
+            fleet.validate()
+        self.assertEqual(str(context.exception), "Value for 'name' is not allowed to be null.")
+
+        fleet.name = 'fleet'
+        fleet.enabled = True
+        fleet.even = 2
+        fleet.tags = ['x']
+        fleet.servers = [ServerConfig.from_dict({'host': 'a', 'port': 80, 'mode': 'b'})]
+        with self.assertRaises(ValidationError) as context:
+            fleet.validate()
+        self.assertEqual((str(context.exception), context.exception.path), ('bad name', 'checked'))
+        fleet.checked.name = 'good'
+        fleet.validate()
+        self.assertEqual([len(errors) for errors in validate_many([fleet, FleetConfig(), fleet])], [0, 1, 0])
+
+    def test_compiled_plans(self):
+        class UpperField(StringField):
+
+            def to_model_value(self, value):
+                return value.upper()
+
+        class PlanConfig(ConfigModel):
+            name = StringField()
+            code = UpperField()
+            tags = ArrayField(StringField())
+            codes = ArrayField(UpperField())
+            child = ModelField(self.ParentModel)
+
+        plan = dict(PlanConfig.__meta__.load_plan)
+        self.assertIsNone(plan['name'])
+        self.assertIsNotNone(plan['code'])
+        self.assertIsNotNone(plan['tags'])
+        self.assertIsNone(dict(PlanConfig.__meta__.dump_plan)['code'])
+
+        data = {'name': 'a', 'code': 'b', 'tags': ['x', 'y'], 'codes': ['c'], 'child': {'name': 'd'}, 'other': 1}
+        config = PlanConfig.from_dict(data)
+        self.assertEqual((config.name, config.code, config.tags, config.codes), ('a', 'B', ['x', 'y'], ['C']))
+        self.assertIsNot(config.tags, data['tags'])
+        self.assertEqual(config.child.name, 'd')
+        self.assertEqual(config.py_value(), {
+            'name': 'a', 'code': 'B', 'tags': ['x', 'y'], 'codes': ['C'], 'child': {'name': 'd', 'age': 21},
+        })
+        self.assertIsNone(PlanConfig.from_dict({'tags': []}).tags)
+
+        PlanConfig.__meta__.fields['name'] = UpperField(name='name')
+        self.assertEqual(PlanConfig.from_dict({'name': 'e'}).name, 'e')
+        PlanConfig.__meta__.reset()
+        self.assertEqual(PlanConfig.from_dict({'name': 'e'}).name, 'E')
+
 
 class TestEncoder(unittest.TestCase):
 
@@ -626,6 +940,122 @@ class TestEncoder(unittest.TestCase):
         with self.assertRaises(TypeError):
             encoding.encode(test, cls=str)
 
+        # values native values can't hold and overridden py_value methods fall back to json.
+        test.age = 2 ** 40
+        self.assertEqual(json.loads(encoding.encode(test, pretty=False))['age'], 2 ** 40)
+        self.assertIn('"age": 1099511627776', encoding.encode(test, pretty=True))
+
+        class ExtraConfig(self.Test):
+
+            def py_value(self):
+                value = super(ExtraConfig, self).py_value()
+                value['extra'] = True
+                return value
+
+        extra = ExtraConfig()
+        extra.name = 'x'
+        self.assertEqual(encoding.encode(extra, pretty=False), '{"extra":true,"name":"x"}')
+        self.assertEqual(encoding.encode(extra), '{\n  "extra": true,\n  "name": "x"\n}')
+
+        class LookupField(StringField):
+
+            def to_garlic_value(self, value):
+                return {1: value}
+
+        class LookupConfig(ConfigModel):
+            lookup = LookupField()
+
+        lookup = LookupConfig()
+        lookup.lookup = 'a'
+        self.assertEqual(encoding.encode(lookup, pretty=False), '{"lookup":{"1":"a"}}')
+        with self.assertRaises(TypeError):
+            GarlicValue({1: 'a'})
+
+    def test_native_json(self):
+        data = {
+            'name': u'caf\xe9 \U0001f600 "quoted" \\ \n\t\x01\x7f',
+            'numbers': [1, -2, 0.1, 1.5, 100.0, 1e16, 1.5e-07, 123456.789, -0.0],
+            'flags': [True, False, None],
+            'empty': {'list': [], 'object': {}},
+            'nested': [{'a': 1}, [1, [2]], 'x'],
+        }
+        value = GarlicValue(data)
+        self.assertEqual(value.dumps(), json.dumps(data, sort_keys=True, separators=(',', ':')))
+        self.assertEqual(
+            value.dumps(pretty=True),
+            json.dumps(data, sort_keys=True, indent=2, cls=encoding.PrettyJSONEncoder)
+        )
+        self.assertEqual(GarlicValue.from_json(value.dumps()).py_value(), data)
+        self.assertEqual(value.resolve_node('flags').dumps(pretty=True), '[true, false, null]')
+        self.assertEqual(GarlicValue(float('inf')).dumps(), 'Infinity')
+        self.assertEqual(value.dumps(sort_keys=True), value.dumps())
+        with self.assertRaises(ValueError):
+            value.dumps(sort_keys=False)
+
+
+class LinesDecoder(encoding.Decoder):
+    """
+    Decodes 'key = value' lines, used to test python decoders.
+    """
+
+    def decode(self, data):
+        lines = bytes(data).decode('utf-8').splitlines()
+        return dict(tuple(part.strip() for part in line.split('=', 1)) for line in lines if line.strip())
+
+
+class TestDecoders(unittest.TestCase):
+
+    def test_msgpack(self):
+        data = {
+            'name': 'caf\xe9', 'long': 'x' * 40, 'empty': '', 'flags': [True, False, None],
+            'numbers': [0, 127, 128, 255, 256, 65535, 65536, -1, -32, -33, -128, -129, -32768, -32769, 2 ** 31 - 1,
+                        -2 ** 31, 0.5, -1e300],
+            'nested': {'list': list(range(20)), 'object': dict(('k{i}'.format(i=i), i) for i in range(20))},
+        }
+        value = GarlicValue(data)
+        packed = value.to_msgpack()
+        self.assertEqual(GarlicValue.from_msgpack(packed).py_value(), data)
+        self.assertEqual(GarlicValue.from_msgpack(bytearray(packed)).py_value(), data)
+        self.assertEqual(GarlicValue.from_json(packed, encoding.MsgPackDecoder()).py_value(), data)
+        self.assertEqual(GarlicValue({'a': [1, -1, 'b']}).to_msgpack(), b'\x81\xa1a\x93\x01\xff\xa1b')
+
+        # encodings produced by other implementations.
+        self.assertEqual(GarlicValue.from_msgpack(b'\xca\x3f\x80\x00\x00').py_value(), 1.0)
+        self.assertEqual(GarlicValue.from_msgpack(b'\xc4\x02ab').py_value(), 'ab')
+        self.assertEqual(GarlicValue.from_msgpack(b'\xdc\x00\x01\xd3' + b'\xff' * 8).py_value(), [-1])
+        self.assertEqual(GarlicValue.from_msgpack(b'\xcf\x00\x00\x00\x01\x00\x00\x00\x00').py_value(), 2.0 ** 32)
+
+        for invalid in (b'', b'\x92\x01', b'\x81\x01\x02', b'\xc1', b'\x01\x02', b'\x91' * 1000):
+            with self.assertRaises(RuntimeError):
+                GarlicValue.from_msgpack(invalid)
+
+    def test_msgpack_configs(self):
+        repo = MemoryConfigRepository()
+        repo.save_bytes('app', GarlicValue({'db': {'port': 5432}}).to_msgpack())
+        manager = FlatConfigManager(repo, decoder=encoding.MsgPackDecoder(), default_config_name='app')
+        self.assertEqual(manager.resolve('db.port'), 5432)
+        self.assertEqual(dict(manager.iterconfigs(parallel=True))['app'].py_value(), {'db': {'port': 5432}})
+
+        test = TestEncoder.Test()
+        test.name = 'Peyman'
+        test.matrix = [[1, 2], [3, 4]]
+        encoded = encoding.encode(test, cls=encoding.MsgPackEncoder)
+        self.assertEqual(GarlicValue.from_msgpack(encoded).py_value(), test.py_value())
+
+    def test_python_decoder(self):
+        repo = MemoryConfigRepository()
+        repo.save('app', 'name = app\nhost = localhost\n')
+        repo.save('other', 'name = other')
+        manager = FlatConfigManager(repo, decoder=LinesDecoder(), default_config_name='app')
+        self.assertEqual(manager.resolve('host'), 'localhost')
+        configs = dict(manager.iterconfigs(parallel=True))
+        self.assertEqual(configs['other'].py_value(), {'name': 'other'})
+        self.assertEqual(GarlicValue.from_json('a = 1', LinesDecoder()).py_value(), {'a': '1'})
+
+        self.assertEqual(encoding.JsonDecoder().decode(b'{"a": 1}').py_value(), {'a': 1})
+        with self.assertRaises(NotImplementedError):
+            LayerRetriever(repo, encoding.Decoder()).retrieve('app')
+
 
 class TestMemoryConfigRepository(unittest.TestCase):
 
@@ -638,6 +1068,118 @@ class TestMemoryConfigRepository(unittest.TestCase):
         memory_repo.save('config1', 'data')
         self.assertEqual(memory_repo.retrieve('config1'), 'data')
 
+    def test_versions(self):
+        memory_repo = MemoryConfigRepository()
+        with self.assertRaises(ConfigNotFound):
+            memory_repo.version('config1')
+        memory_repo.save('config1', 'data')
+        memory_repo.save('config2', 'data')
+        token = memory_repo.version('config1')
+        self.assertFalse(memory_repo.changed_since(token))
+        memory_repo.save('config2', 'other data')
+        self.assertFalse(memory_repo.changed_since(token))
+        memory_repo.save('config1', 'data')
+        self.assertTrue(memory_repo.changed_since(token))
+        self.assertEqual(memory_repo.generation, 4)
+
+    def test_bytes_and_streams(self):
+        memory_repo = MemoryConfigRepository()
+        memory_repo.save_bytes('config1', bytearray(b'{"name": "caf\xc3\xa9"}'))
+        self.assertEqual(memory_repo.retrieve('config1'), u'{"name": "caf\xe9"}')
+        self.assertEqual(bytes(memory_repo.retrieve_bytes('config1')), b'{"name": "caf\xc3\xa9"}')
+        memory_repo.save_bytes('empty', b'')
+        self.assertEqual(memory_repo.retrieve('empty'), '')
+
+        with memory_repo.open('config2', 'wb') as output:
+            for index in range(1000):
+                output.write(b'line %d\n' % index)
+        self.assertEqual(memory_repo.generation, 3)
+        with memory_repo.open('config2') as config:
+            lines = list(config)
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines[-1], 'line 999\n')
+        with memory_repo.open('config2', 'rb') as config:
+            self.assertEqual(config.read(7), b'line 0\n')
+        with self.assertRaises(ConfigNotFound):
+            memory_repo.open('missing', 'rb')
+        with self.assertRaises(ValueError):
+            memory_repo.open('config2', 'a')
+        with self.assertRaises(RuntimeError):
+            with memory_repo.open('config2', 'w') as output:
+                output.write('partial')
+                raise RuntimeError
+        self.assertEqual(memory_repo.generation, 3)
+        self.assertEqual(memory_repo.retrieve('config2').count('\n'), 1000)
+
+    def test_concurrent_access(self):
+        memory_repo = MemoryConfigRepository()
+        names = ['config{index}'.format(index=index) for index in range(20)]
+        for name in names:
+            memory_repo.save(name, '{"value": 0}')
+        retriever = LayerRetriever(memory_repo)
+        errors = []
+
+        def save():
+            try:
+                for value in range(200):
+                    for name in names:
+                        memory_repo.save(name, json.dumps({'value': value}))
+            except Exception as error:
+                errors.append(error)
+
+        def retrieve():
+            try:
+                for _ in range(50):
+                    values = retriever.retrieve_many(names, workers=4)
+                    for name in names:
+                        json.loads(memory_repo.retrieve(name))
+                        self.assertIsNotNone(values[name].resolve('value'))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=save), threading.Thread(target=retrieve), threading.Thread(target=retrieve)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(json.loads(memory_repo.retrieve('config0')), {'value': 199})
+
+    def test_cache_tracks_changes(self):
+        memory_repo = MemoryConfigRepository()
+        memory_repo.save('config1', '{"name": "first"}')
+        cache = LayerCache(track_changes=True)
+        manager = FlatConfigManager(memory_repo, default_config_name='config1', cache=cache)
+        self.assertEqual(manager.resolve('name'), 'first')
+        self.assertEqual(manager.resolve('name'), 'first')
+        memory_repo.save('config1', '{"name": "second"}')
+        self.assertEqual(manager.resolve('name'), 'second')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_cache_checks_changes_unlocked(self):
+        cache = LayerCache(track_changes=True)
+        blocked = []
+
+        class CheckedRepository(MemoryConfigRepository):
+
+            def changed_since(self, token):
+                # other lookups go on while the repository is being checked.
+                thread = threading.Thread(target=cache.invalidate, args=('other',))
+                thread.start()
+                thread.join(1)
+                blocked.append(thread.is_alive())
+                return MemoryConfigRepository.changed_since(self, token)
+
+        memory_repo = CheckedRepository()
+        memory_repo.save('config1', '{"name": "first"}')
+        cache.set('config1', GarlicValue({'name': 'first'}), memory_repo.version('config1'))
+        self.assertEqual(cache.get('config1', memory_repo).resolve('name'), 'first')
+        memory_repo.save('config1', '{"name": "second"}')
+        self.assertIsNone(cache.get('config1', memory_repo))
+        self.assertNotIn('config1', cache)
+        self.assertEqual(blocked, [False, False])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
 
 class TestFileConfigRepository(unittest.TestCase):
 
@@ -660,9 +1202,886 @@ class TestFileConfigRepository(unittest.TestCase):
 
         self.assertEqual(set(file_repo.list_configs()), {'config1'})
 
+    def test_file_versions(self):
+        file_repo = FileConfigRepository(root_path=self.TEST_DIR)
+        with self.assertRaises(ConfigNotFound):
+            file_repo.version('config1')
+        file_repo.save('config1', 'data')
+        self.assertEqual(file_repo.config_path('config1'), os.path.join(self.TEST_DIR, 'config1.garlic'))
+        token = file_repo.version('config1')
+        self.assertFalse(file_repo.changed_since(token))
+        file_repo.save('config1', 'more data')
+        self.assertTrue(file_repo.changed_since(token))
+        token = file_repo.version('config1')
+        os.remove(file_repo.config_path('config1'))
+        self.assertTrue(file_repo.changed_since(token))
+
+    def test_file_bytes_and_streams(self):
+        file_repo = FileConfigRepository(root_path=self.TEST_DIR)
+        with self.assertRaises(ConfigNotFound):
+            file_repo.retrieve_bytes('config1')
+        with self.assertRaises(ConfigNotFound):
+            file_repo.open('config1')
+        file_repo.save_bytes('config1', b'{"a": 1}')
+        content = file_repo.retrieve_bytes('config1')
+        file_repo.save_bytes('config1', b'{}')  # rewritten in place.
+        self.assertEqual(content, b'{"a": 1}')
+        file_repo.save_bytes('empty', memoryview(b''))
+        self.assertEqual(file_repo.retrieve_bytes('empty'), b'')
+
+        with file_repo.open('config1', 'w') as output:
+            output.write(u'{"name": "caf\xe9"}')
+            # nothing is visible until the stream is closed.
+            self.assertEqual(file_repo.retrieve('config1'), '{}')
+        self.assertEqual(file_repo.retrieve('config1'), u'{"name": "caf\xe9"}')
+        self.assertEqual(set(os.listdir(self.TEST_DIR)), {'config1.garlic', 'empty.garlic'})
+        with file_repo.open('config1', 'rb') as config:
+            self.assertEqual(config.read(), b'{"name": "caf\xc3\xa9"}')
+
+        for mode in ('w', 'wb'):
+            with self.assertRaises(RuntimeError):
+                with file_repo.open('config1', mode) as output:
+                    output.write(b'partial' if mode == 'wb' else 'partial')
+                    raise RuntimeError
+        self.assertEqual(file_repo.retrieve('config1'), u'{"name": "caf\xe9"}')
+        self.assertEqual(set(os.listdir(self.TEST_DIR)), {'config1.garlic', 'empty.garlic'})
+
+    def test_file_permissions(self):
+        file_repo = FileConfigRepository(root_path=self.TEST_DIR)
+        umask = os.umask(0o022)
+        try:
+            with file_repo.open('config1', 'w') as output:
+                output.write('{}')
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(file_repo.config_path('config1')).st_mode & 0o777, 0o644)
+        os.chmod(file_repo.config_path('config1'), 0o640)
+        with file_repo.open('config1', 'w') as output:
+            output.write('{"a": 1}')
+        self.assertEqual(os.stat(file_repo.config_path('config1')).st_mode & 0o777, 0o640)
+
+    def tearDown(self):
+        shutil.rmtree(self.TEST_DIR)
+
+
+class TestGarlicValue(unittest.TestCase):
+
+    def setUp(self):
+        self.value = GarlicValue({
+            'db': {
+                'pool': {'size': 10, 'timeout': 1.5},
+                'hosts': ['a', 'b'],
+            },
+            'name': 'test',
+        })
+
+    def test_conversions(self):
+        data = {'list': [1, 'a', None], 'tuple': (True, 1.5), 'set': {2}, 'nested': [{'key': 1}, {'key': 2}]}
+        self.assertEqual(GarlicValue(data).py_value(), {
+            'list': [1, 'a', None], 'tuple': [True, 1.5], 'set': [2], 'nested': [{'key': 1}, {'key': 2}],
+        })
+        self.assertEqual(GarlicValue(OrderedDict([('a', 1)])).py_value(), {'a': 1})
+        self.assertEqual(GarlicValue({'frozen': self.value.freeze().resolve('db.pool')}).resolve('frozen.size'), 10)
+        with self.assertRaises(TypeError):
+            GarlicValue({'a': object()})
+
+    def test_from_json(self):
+        data = {'db': {'hosts': ['a', 'b'], 'port': 5432}, 'name': 'тест'}
+        encoded = json.dumps(data)
+        self.assertEqual(GarlicValue.from_json(encoded).py_value(), data)
+        self.assertEqual(GarlicValue.from_json(encoded.encode('utf-8')).py_value(), data)
+        decoded = GarlicValue.from_json(bytearray(encoded.encode('utf-8')), encoding.JsonDecoder())
+        self.assertEqual(decoded.py_value(), data)
+        with self.assertRaises(Exception):
+            GarlicValue.from_json('{"a": ')
+
+    def test_compiled_paths(self):
+        path = compile_path('db.pool.size')
+        self.assertEqual(path.path, 'db.pool.size')
+        self.assertEqual(self.value.resolve(path), 10)
+        self.assertEqual(path(self.value), 10)
+        self.assertEqual(compile_path('db.pool')(self.value), {'size': 10, 'timeout': 1.5})
+        self.assertIsNone(compile_path('db.pool.size.value')(self.value))
+        self.assertIsNone(compile_path('db.missing')(self.value))
+        self.assertIsNone(compile_path('')(self.value))
+
+        self.assertEqual(
+            self.value.resolve_many([path, 'db.pool.timeout', 'name', 'nothing', compile_path('db.hosts')]),
+            (10, 1.5, 'test', None, ['a', 'b']),
+        )
+
+    def test_nodes_and_typed_accessors(self):
+        pool = self.value.resolve_node('db.pool')
+        self.assertIsInstance(pool, GarlicValue)
+        self.assertEqual(pool.resolve('size'), 10)
+        self.assertIsNone(self.value.resolve_node('db.nothing'))
+
+        # nodes share native data with the value they were resolved from.
+        pool.apply(GarlicValue({'size': 20}))
+        self.assertEqual(self.value.resolve('db.pool.size'), 20)
+
+        self.assertEqual(self.value.get_int('db.pool.size'), 20)
+        self.assertEqual(self.value.get_int(compile_path('db.pool.size')), 20)
+        self.assertEqual(self.value.get_float('db.pool.timeout'), 1.5)
+        self.assertEqual(self.value.get_float('db.pool.size'), 20.0)
+        self.assertEqual(self.value.get_str('name'), 'test')
+        self.assertEqual(GarlicValue({'on': False}).get_bool('on'), False)
+        self.assertIsNone(self.value.get_int('db.nothing'))
+        self.assertEqual(self.value.get_int('db.nothing', 5), 5)
+        self.assertEqual(GarlicValue({'size': None}).get_int('size', 5), 5)
+
+        with self.assertRaises(TypeError):
+            self.value.get_int('name')
+        with self.assertRaises(TypeError):
+            self.value.get_str('db.pool')
+        with self.assertRaises(TypeError):
+            GarlicValue({'on': True}).get_int('on')
+
+    def test_mapping_protocol(self):
+        db = self.value['db']
+        self.assertIsInstance(db, GarlicValue)
+        self.assertTrue(db.is_object())
+        self.assertEqual(len(db), 2)
+        self.assertEqual(sorted(db), ['hosts', 'pool'])
+        self.assertEqual(db.keys(), ['hosts', 'pool'])
+        self.assertIn('pool', db)
+        self.assertNotIn('size', db)
+        self.assertEqual(db['pool']['size'], 10)
+        self.assertEqual(dict(db['pool'].items()), {'size': 10, 'timeout': 1.5})
+        self.assertEqual(db.get('nothing', 1), 1)
+        with self.assertRaises(KeyError):
+            db['nothing']
+
+        hosts = db['hosts']
+        self.assertTrue(hosts.is_array())
+        self.assertEqual(list(hosts), ['a', 'b'])
+        self.assertEqual(hosts[-1], 'b')
+        self.assertIn('a', hosts)
+        with self.assertRaises(IndexError):
+            hosts[2]
+        with self.assertRaises(TypeError):
+            hosts['a']
+
+        self.assertEqual(GarlicValue({'a.b': 1})['a.b'], 1)
+        self.assertFalse(GarlicValue({}))
+        self.assertFalse(GarlicValue([]))
+        self.assertTrue(GarlicValue(0))
+        with self.assertRaises(TypeError):
+            len(GarlicValue(1))
+        with self.assertRaises(TypeError):
+            GarlicValue('text')[0]
+
+    def test_frozen(self):
+        class PoolConfig(ConfigModel):
+            size = IntegerField()
+            timeout = IntegerField()
+
+        class DatabaseConfig(ConfigModel):
+            pool = ModelField(PoolConfig)
+            hosts = ArrayField(StringField())
+
+        self.assertFalse(self.value.frozen)
+        self.assertIs(self.value.freeze(), self.value)
+        self.assertTrue(self.value.frozen)
+
+        py_value = self.value.py_value()
+        self.assertIs(self.value.py_value(), py_value)
+        self.assertEqual(py_value['db']['hosts'], ('a', 'b'))
+        with self.assertRaises(TypeError):
+            py_value['name'] = 'changed'
+        self.assertIs(self.value.resolve('db'), py_value['db'])
+        self.assertIs(self.value.resolve_node('db').py_value(), py_value['db'])
+        self.assertIs(self.value['db'].py_value(), py_value['db'])
+
+        config = DatabaseConfig.from_garlic(self.value.resolve_node('db'))
+        self.assertEqual(config.pool.size, 10)
+        self.assertEqual(config.hosts, ['a', 'b'])
+
+        self.value.apply(GarlicValue({'db': {'pool': {'size': 5}}}))
+        self.assertEqual(self.value.py_value()['db']['pool']['size'], 5)
+        self.assertIsNot(self.value.py_value(), py_value)
+        self.assertFalse(self.value.clone().frozen)
+
+        # replaced nodes never show up as stale cache entries, even if their memory gets reused.
+        for index in range(100):
+            self.value.patch([('set', 'db.hosts', [str(index)])])
+            self.assertEqual(self.value.resolve('db.hosts'), (str(index),))
+
+
+class TestDiff(unittest.TestCase):
+
+    BEFORE = {
+        'name': 'app',
+        'db': {'host': 'localhost', 'port': 5432, 'pool': {'size': 5}},
+        'tags': ['a', 'b'],
+        'ratio': 1,
+        'old': True,
+    }
+    AFTER = {
+        'name': 'app',
+        'db': {'host': 'db.local', 'port': 5432, 'pool': {'size': 5}, 'timeout': 3},
+        'tags': ['a', 'c'],
+        'ratio': 1.0,
+        'new': {'x': [1]},
+    }
+
+    def test_diff(self):
+        before = GarlicValue(self.BEFORE)
+        after = GarlicValue(self.AFTER)
+        changes = before.diff(after)
+        self.assertEqual(
+            [(operation, path, value.py_value() if isinstance(value, GarlicValue) else value)
+             for operation, path, value in changes],
+            [
+                ('set', ('db', 'host'), 'db.local'),
+                ('set', ('db', 'timeout'), 3),
+                ('set', ('new',), {'x': [1]}),
+                ('remove', ('old',), None),
+                ('set', ('ratio',), 1.0),
+                ('set', ('tags',), ['a', 'c']),
+            ],
+        )
+        self.assertEqual(before.diff(before.clone()), [])
+        self.assertEqual(GarlicValue(1).diff(GarlicValue('1')), [('set', (), '1')])
+
+        # subtrees shared by both values are skipped.
+        shared = GarlicValue({'big': list(range(1000))})
+        first = GarlicValue({'a': 1})
+        second = GarlicValue({'a': 2})
+        first.set('shared', shared)
+        second.set('shared', shared)
+        self.assertEqual(first.diff(second), [('set', ('a',), 2)])
+
+    def test_patch(self):
+        before = GarlicValue(self.BEFORE)
+        after = GarlicValue(self.AFTER)
+        self.assertIs(before.patch(before.diff(after)), before)
+        self.assertEqual(before.py_value(), self.AFTER)
+        self.assertEqual(before.diff(after), [])
+
+        value = GarlicValue({'a': {'b': 1}}).freeze()
+        self.assertEqual(value.resolve('a.b'), 1)
+        value.patch([
+            ('set', 'x.y.z', 'deep'),
+            ('remove', ('a', 'b'), None),
+            ('remove', 'missing.path', None),
+            ('set', ('dotted.key',), 1),
+        ])
+        self.assertEqual(value.py_value(), {'a': {}, 'x': {'y': {'z': 'deep'}}, 'dotted.key': 1})
+        value.patch([('remove', ('dotted.key',), None)])
+        self.assertNotIn('dotted.key', value)
+        value.patch([('set', (), [1, 2])])
+        self.assertEqual(value.py_value(), (1, 2))
+
+        # nodes shared with other values are never changed.
+        first = GarlicValue({'v': 1})
+        second = GarlicValue({'w': {'k': 1}})
+        first.patch(first.diff(second))
+        first.patch([('set', 'w.k', 99)])
+        self.assertEqual(first.py_value(), {'w': {'k': 99}})
+        self.assertEqual(second.py_value(), {'w': {'k': 1}})
+        source = GarlicValue({'n': {'k': 1}})
+        target = GarlicValue({})
+        target.set('n', source.resolve_node('n'))
+        target.patch([('set', 'n.k', 2), ('remove', 'n.k', None)])
+        self.assertEqual(target.py_value(), {'n': {}})
+        self.assertEqual(source.py_value(), {'n': {'k': 1}})
+
+        with self.assertRaises(ValueError):
+            GarlicValue({'a': 1}).patch([('set', 'a.b', 1)])
+        with self.assertRaises(ValueError):
+            GarlicValue({'a': 1}).patch([('remove', (), None)])
+        with self.assertRaises(ValueError):
+            GarlicValue({'a': 1}).patch([('rename', 'a', 'b')])
+
+
+class TestSnapshot(unittest.TestCase):
+
+    DATA = {
+        'name': 'caf\xe9',
+        'db': {'host': 'localhost', 'port': 5432, 'ratio': 0.25, 'replicas': [{'host': 'r1'}, {'host': 'r2'}]},
+        'flags': [True, False, None, -7],
+        'empty': {},
+        'dotted.key': 1,
+    }
+
+    def test_round_trip(self):
+        value = GarlicValue(self.DATA)
+        data = value.to_snapshot()
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(GarlicValue.from_snapshot(data).py_value(), self.DATA)
+        self.assertEqual(GarlicValue.from_snapshot(bytearray(data)).py_value(), self.DATA)
+        self.assertEqual(GarlicValue.from_snapshot(GarlicValue('text').to_snapshot()).py_value(), 'text')
+        # strings are stored once.
+        self.assertEqual(GarlicValue(['a' * 100] * 10).to_snapshot().count(b'a' * 100), 1)
+
+    def test_lookups(self):
+        snapshot = SnapshotValue(GarlicValue(self.DATA).to_snapshot())
+        self.assertEqual(snapshot.py_value(), self.DATA)
+        self.assertEqual(snapshot.resolve('db.port'), 5432)
+        self.assertEqual(snapshot.resolve(compile_path('db.ratio')), 0.25)
+        self.assertIsNone(snapshot.resolve('db.missing'))
+        self.assertIsNone(snapshot.resolve('name.missing'))
+        self.assertEqual(snapshot['dotted.key'], 1)
+        self.assertEqual(snapshot.keys(), sorted(self.DATA))
+        self.assertIn('empty', snapshot)
+        self.assertNotIn('missing', snapshot)
+        self.assertFalse(snapshot['empty'])
+
+        replicas = snapshot.resolve_node('db.replicas')
+        self.assertIsInstance(replicas, SnapshotValue)
+        self.assertTrue(replicas.is_array())
+        self.assertEqual(len(replicas), 2)
+        self.assertEqual(replicas[-1]['host'], 'r2')
+        self.assertEqual([item.py_value() for item in replicas], [{'host': 'r1'}, {'host': 'r2'}])
+        self.assertEqual(snapshot['flags'].values(), [True, False, None, -7])
+        with self.assertRaises(IndexError):
+            replicas[2]
+        with self.assertRaises(KeyError):
+            snapshot['missing']
+        with self.assertRaises(TypeError):
+            len(snapshot.resolve_node('name'))
+
+        garlic_value = snapshot.resolve_node('db').garlic_value()
+        garlic_value.set('port', 1)
+        self.assertEqual(garlic_value.resolve('port'), 1)
+        self.assertEqual(snapshot.resolve('db.port'), 5432)
+
+    def test_corrupt(self):
+        data = GarlicValue(self.DATA).to_snapshot()
+        for corrupt in (b'', b'GARLICSS', b'x' * 100, data[:len(data) // 2]):
+            with self.assertRaises(ValueError):
+                GarlicValue.from_snapshot(corrupt)
+        with self.assertRaises(ValueError):
+            SnapshotValue(data[:len(data) // 2]).py_value()
+
+    def test_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            repo = FileConfigRepository(directory)
+            repo.save('app', json.dumps(self.DATA))
+            repo.save('other', '{"a": [1, 2]}')
+            path = os.path.join(directory, 'configs.snapshot')
+            write_snapshot(path, compile_repository(repo))
+            snapshot = SnapshotValue.open(path)
+            self.assertEqual(snapshot.keys(), ['app', 'other'])
+            self.assertEqual(snapshot.resolve('app.db.host'), 'localhost')
+            self.assertEqual(snapshot['other'].py_value(), {'a': [1, 2]})
+
+            write_snapshot(path, compile_repository(repo, names=['other']))
+            self.assertEqual(snapshot.resolve('app.db.host'), 'localhost')  # mapped data is left intact.
+            self.assertEqual(SnapshotValue.open(path).keys(), ['other'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'configs.snapshot')
+            publisher = SharedSnapshot(path)
+            publisher.publish(GarlicValue({'app': {'workers': 1}}))
+            worker = SharedSnapshot(path)
+            throttled = SharedSnapshot(path, check_interval=3600)
+            self.assertEqual(worker.resolve('app.workers'), 1)
+            self.assertEqual(throttled.resolve('app.workers'), 1)
+            node = worker.resolve_node('app')
+
+            publisher.publish(GarlicValue({'app': {'workers': 2}}).to_snapshot())
+            self.assertEqual(worker.resolve('app.workers'), 2)
+            self.assertEqual(worker['app']['workers'], 2)
+            self.assertEqual(worker.generation, 2)
+            self.assertEqual(node['workers'], 1)  # earlier generations stay valid.
+            self.assertEqual(throttled.resolve('app.workers'), 1)
+            self.assertIn('app', throttled)
+
+            # the wall clock going back doesn't stop checks.
+            brief = SharedSnapshot(path, check_interval=0.01)
+            self.assertEqual(brief.resolve('app.workers'), 2)
+            wall_clock = time.time
+            time.time = lambda: wall_clock() - 3600
+            try:
+                publisher.publish(GarlicValue({'app': {'workers': 3}}))
+                time.sleep(0.05)
+                self.assertEqual(brief.resolve('app.workers'), 3)
+            finally:
+                time.time = wall_clock
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestLayerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = MemoryConfigRepository()
+        self.repo.save('config1', '{"db": {"host": "localhost", "port": 5432}}')
+        self.repo.save('config2', '{"db": {"host": "remote"}}')
+
+    def test_manager_cache(self):
+        cache = LayerCache()
+        manager = FlatConfigManager(self.repo, default_config_name='config1', cache=cache)
+        self.assertEqual(manager.resolve('db.host'), 'localhost')
+        self.assertEqual(manager.resolve('db.port'), 5432)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # cached layers are served even if the repository changes, until invalidated.
+        self.repo.save('config1', '{"db": {"host": "changed"}}')
+        self.assertEqual(manager.resolve('db.host'), 'localhost')
+        cache.invalidate('config1')
+        self.assertEqual(manager.resolve('db.host'), 'changed')
+        self.assertEqual(manager.resolve('db.host', name='config2'), 'remote')
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        with self.assertRaises(ConfigNotFound):
+            manager.resolve('db.host', name='missing')
+        self.assertNotIn('missing', cache)
+
+    def test_bounds(self):
+        cache = LayerCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now the least recently used entry.
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+        cache = LayerCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+        with self.assertRaises(ValueError):
+            LayerCache(max_size=0)
+        with self.assertRaises(ValueError):
+            LayerCache(ttl=-1)
+
+
+class TestConfigWatcher(unittest.TestCase):
+
+    TEST_DIR = 'watchdata'
+
+    def setUp(self):
+        os.mkdir(self.TEST_DIR)
+        self.repo = FileConfigRepository(self.TEST_DIR)
+        self.repo.save('app', '{"workers": 1}')
+        self.repo.save('other', '{"workers": 1}')
+
+    def tearDown(self):
+        shutil.rmtree(self.TEST_DIR)
+
+    def check_changes(self, watcher):
+        notified = []
+        errors = []
+        watcher.subscribe(lambda name, value: notified.append((name, value and value.py_value())))
+        watcher.on_error = lambda name, error: errors.append(name)
+        self.assertEqual(watcher.check(), {})
+
+        for workers in range(2, 5):
+            self.repo.save('app', json.dumps({'workers': workers}))
+        changes = watcher.check(timeout=5)
+        self.assertEqual(list(changes), ['app'])
+        self.assertEqual(notified, [('app', {'workers': 4})])
+
+        with self.repo.open('new', 'w') as output:
+            output.write('{"workers": 5}')
+        os.remove(self.repo.config_path('other'))
+        self.repo.save('broken', '{"workers": ')
+        with open(os.path.join(self.TEST_DIR, 'ignored.txt'), 'w') as output:
+            output.write('{}')
+        changes = watcher.check(timeout=5)
+        while len(changes) + len(errors) < 3:
+            changes.update(watcher.check(timeout=5))
+        self.assertEqual(changes['new'].py_value(), {'workers': 5})
+        self.assertIsNone(changes['other'])
+        self.assertEqual(errors, ['broken'])
+        self.assertEqual(set(changes), {'new', 'other'})
+
+    def test_inotify(self):
+        watcher = ConfigWatcher(self.repo, debounce=0.05)
+        if not watcher.uses_inotify:
+            self.skipTest('inotify is not available.')
+        try:
+            self.check_changes(watcher)
+        finally:
+            watcher.close()
+
+    def test_inotify_overflow(self):
+        watcher = ConfigWatcher(self.repo, debounce=0.05)
+        if not watcher.uses_inotify:
+            self.skipTest('inotify is not available.')
+        try:
+            self.repo.save('app', '{"workers": 20}')
+            self.assertEqual(list(watcher.check(timeout=5)), ['app'])
+            inotify = watcher._ConfigWatcher__inotify
+            read = inotify.read
+            inotify.read = lambda: (read()[0], True)  # events got lost, configs get rescanned.
+            with open(os.path.join(self.TEST_DIR, 'ignored.txt'), 'w') as output:
+                output.write('{}')
+            self.assertEqual(watcher.check(timeout=5), {})
+            self.repo.save('other', '{"workers": 20}')
+            self.assertEqual(list(watcher.check(timeout=5)), ['other'])
+        finally:
+            watcher.close()
+
+    def test_inotify_directory_replaced(self):
+        watcher = ConfigWatcher(self.repo, debounce=0.05)
+        if not watcher.uses_inotify:
+            self.skipTest('inotify is not available.')
+        try:
+            os.rename(self.TEST_DIR, self.TEST_DIR + '.old')
+            os.mkdir(self.TEST_DIR)
+            self.repo.save('app', '{"workers": 20}')
+            changes = watcher.check(timeout=5)
+            self.assertEqual(changes['app'].py_value(), {'workers': 20})
+            self.assertIsNone(changes['other'])
+            self.assertTrue(watcher.uses_inotify)  # the new directory is watched.
+            self.repo.save('other', '{"workers": 20}')
+            self.assertEqual(list(watcher.check(timeout=5)), ['other'])
+        finally:
+            watcher.close()
+            shutil.rmtree(self.TEST_DIR + '.old')
+
+    def test_inotify_unavailable(self):
+        load_inotify = watch._load_inotify
+        watch._load_inotify = lambda: None
+        try:
+            with self.assertRaises(OSError):
+                ConfigWatcher(self.repo, use_inotify=True)
+            self.assertFalse(ConfigWatcher(self.repo).uses_inotify)
+        finally:
+            watch._load_inotify = load_inotify
+
+    def test_polling(self):
+        watcher = ConfigWatcher(self.repo, debounce=0.05, poll_interval=0.01, use_inotify=False)
+        self.assertFalse(watcher.uses_inotify)
+        time.sleep(0.05)  # make sure modification times differ.
+        self.check_changes(watcher)
+
+    def test_follow(self):
+        manager = FlatConfigManager(self.repo, default_config_name='app')
+        watcher = manager.follow(ConfigWatcher(self.repo, debounce=0.05, poll_interval=0.01, use_inotify=False))
+        self.assertIsNotNone(manager.cache)
+        self.assertEqual(manager.resolve('workers'), 1)
+        time.sleep(0.05)
+        self.repo.save('app', '{"workers": 2}')
+        watcher.check(timeout=5)
+        self.assertEqual(manager.cache.misses, 1)
+        self.assertEqual(manager.resolve('workers'), 2)
+        self.assertEqual(manager.cache.misses, 1)  # the watcher's value got used, nothing was decoded again.
+
+        with ConfigWatcher(self.repo, debounce=0.01, poll_interval=0.01) as background:
+            manager.follow(background)
+            self.repo.save('app', '{"workers": 3}')
+            deadline = time.time() + 5
+            while manager.resolve('workers') != 3 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(manager.resolve('workers'), 3)
+
+    def test_follow_versions(self):
+        manager = FlatConfigManager(self.repo, default_config_name='app', cache=LayerCache(track_changes=True))
+        watcher = ConfigWatcher(self.repo, debounce=0, poll_interval=0.01, use_inotify=False)
+
+        @watcher.subscribe
+        def rewrite(name, value):
+            if value.resolve('workers') == 2:
+                self.repo.save('app', '{"workers": 30}')  # changes after being decoded, before the manager updates.
+
+        manager.follow(watcher)
+        time.sleep(0.05)
+        self.repo.save('app', '{"workers": 2}')
+        self.assertEqual(list(watcher.check(timeout=5)), ['app'])
+        self.assertEqual(manager.resolve('workers'), 30)
+
+
+class TestLayerRetriever(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = MemoryConfigRepository()
+        for index in range(50):
+            self.repo.save('config{index}'.format(index=index), json.dumps({'index': index}))
+
+    def test_retrieve_many(self):
+        retriever = LayerRetriever(self.repo)
+        names = ['config{index}'.format(index=index) for index in range(50)]
+        values = retriever.retrieve_many(names, workers=4)
+        self.assertEqual(list(values), names)
+        self.assertEqual([values[name].resolve('index') for name in names], list(range(50)))
+        self.assertEqual(retriever.retrieve_many([]), {})
+
+        with self.assertRaises(ConfigNotFound):
+            retriever.retrieve_many(names + ['missing'], workers=4)
+
+        self.repo.save('broken', '{"index": ')
+        with self.assertRaises(RuntimeError):
+            retriever.retrieve_many(['config1', 'broken'])
+
+    def test_retrieve_many_cached(self):
+        cache = LayerCache()
+        retriever = LayerRetriever(self.repo, cache=cache)
+        first = retriever.retrieve('config1')
+        values = retriever.retrieve_many(['config1', 'config2'], workers=2)
+        self.assertIs(values['config1'], first)
+        self.assertIs(retriever.retrieve('config2'), values['config2'])
+
+    def test_parallel_iterconfigs(self):
+        manager = FlatConfigManager(self.repo)
+        serial = {name: value.py_value() for name, value in manager.iterconfigs()}
+        parallel = {name: value.py_value() for name, value in manager.iterconfigs(parallel=True)}
+        self.assertEqual(serial, parallel)
+        self.assertEqual(dict((name, value.py_value()) for name, value in manager.iterconfigs(parallel=3)), serial)
+
+
+class TestLayeredConfigManager(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = MemoryConfigRepository()
+        self.repo.save('base', json.dumps({'db': {'host': 'localhost', 'port': 5432}, 'debug': True}))
+        self.repo.save('env.prod', json.dumps({'db': {'host': 'db.prod'}, 'debug': False}))
+        self.repo.save('tenant.acme', json.dumps({'db': {'port': 6432}}))
+        self.manager = LayeredConfigManager(self.repo, ['base', 'env.{env}', 'tenant.{tenant}'])
+
+    def test_resolve(self):
+        self.assertEqual(self.manager.resolve('db'), {'host': 'localhost', 'port': 5432})
+        self.assertEqual(self.manager.resolve('db', env='prod'), {'host': 'db.prod', 'port': 5432})
+        self.assertEqual(self.manager.resolve('db', env='prod', tenant='acme'), {'host': 'db.prod', 'port': 6432})
+        self.assertEqual(self.manager.resolve('db', env='dev', tenant='acme'), {'host': 'localhost', 'port': 6432})
+        self.assertEqual(self.manager.layer_names(env='prod'), ('base', 'env.prod'))
+
+        manager = LayeredConfigManager(self.repo, ['env.{env}', lambda filters: filters.get('extra')])
+        with self.assertRaises(ConfigNotFound):
+            manager.snapshot(env='dev')
+        self.assertTrue(manager.resolve('debug', env='dev', extra='base'))
+
+    def test_snapshots(self):
+        snapshot = self.manager.snapshot(env='prod')
+        self.assertIs(self.manager.snapshot(env='prod'), snapshot)
+        self.assertIsNot(self.manager.snapshot(env='prod', tenant='acme'), snapshot)
+
+        self.repo.save('env.prod', json.dumps({'db': {'host': 'db2.prod'}}))
+        self.assertIsNot(self.manager.snapshot(env='prod'), snapshot)
+        self.assertEqual(self.manager.resolve('db.host', env='prod'), 'db2.prod')
+        self.assertTrue(self.manager.resolve('debug', env='prod'))
+
+        self.assertEqual(self.manager.resolve('db.host', env='stage'), 'localhost')
+        self.repo.save('env.stage', json.dumps({'db': {'host': 'db.stage'}}))
+        self.assertEqual(self.manager.resolve('db.host', env='stage'), 'db.stage')
+
+        frozen = LayeredConfigManager(self.repo, ['base'], freeze=True)
+        self.assertTrue(frozen.snapshot().frozen)
+
+        for layer in ('env.{}', 'env.{0}', 'env.{env:>5}', 'env.{env!r}', 'env.{env.name}', 'env.{env[0]}', 'env.{env'):
+            with self.assertRaises(ValueError):
+                LayeredConfigManager(self.repo, ['base', layer])
+
+    def test_cache_and_check_interval(self):
+        cache = LayerCache()
+        manager = LayeredConfigManager(self.repo, ['base', 'env.{env}'], cache=cache)
+        self.assertEqual(manager.resolve('db.host', env='prod'), 'db.prod')
+        self.assertEqual(cache.misses, 2)
+        self.repo.save('env.prod', json.dumps({'db': {'host': 'db2.prod'}}))
+        self.assertEqual(manager.resolve('db.host', env='prod'), 'db2.prod')
+        self.assertEqual((cache.hits, cache.misses), (1, 3))  # only the changed layer got decoded again.
+
+        manager = LayeredConfigManager(self.repo, ['base', 'env.{env}'], check_interval=60)
+        snapshot = manager.snapshot(env='prod')
+        self.repo.save('env.prod', json.dumps({'db': {'host': 'db3.prod'}}))
+        self.assertIs(manager.snapshot(env='prod'), snapshot)
+        manager.clear()
+        self.assertEqual(manager.resolve('db.host', env='prod'), 'db3.prod')
+
+
+class TestIndexedConfigManager(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = MemoryConfigRepository()
+        for name in ['app', 'app.prod', 'app.prod.en', 'app.prod.fr', 'app.dev.en', 'other']:
+            self.repo.save(name, json.dumps({'name': name}))
+        self.manager = IndexedConfigManager(self.repo, ['app.{env}.{locale}', 'app.{env}', 'app'], check_interval=0)
+
+    def test_resolve(self):
+        self.assertEqual(self.manager.resolve('name', env='prod', locale='fr'), 'app.prod.fr')
+        self.assertEqual(self.manager.resolve('name', env='prod', locale='de'), 'app.prod')
+        self.assertEqual(self.manager.resolve('name', env='prod'), 'app.prod')
+        self.assertEqual(self.manager.resolve('name', env='dev', locale='en'), 'app.dev.en')
+        self.assertEqual(self.manager.resolve('name', env='dev', tenant='acme'), 'app')
+        self.assertEqual(self.manager.config_name(locale='en'), 'app')
+        self.assertEqual([name for name, _ in self.manager.iterconfigs()][:2], ['app', 'app.dev.en'])
+
+        with self.assertRaises(ConfigNotFound):
+            IndexedConfigManager(self.repo, ['app.{env}']).resolve('name', env='stage')
+        with self.assertRaises(ValueError):
+            IndexedConfigManager(self.repo, ['app.{env}.{env}'])
+
+    def test_refresh(self):
+        self.assertEqual(self.manager.config_name(env='stage', locale='en'), 'app')
+        self.repo.save('app.stage', '{}')
+        self.assertEqual(self.manager.config_name(env='stage', locale='en'), 'app.stage')
+        self.repo.save('app.stage.en', '{}')
+        self.assertEqual(self.manager.config_name(env='stage', locale='en'), 'app.stage.en')
+
+        manager = IndexedConfigManager(self.repo, ['app.{env}', 'app'], check_interval=60)
+        self.assertEqual(manager.config_name(env='test'), 'app')
+        self.repo.save('app.test', '{}')
+        self.assertEqual(manager.config_name(env='test'), 'app')
+        manager.refresh()
+        self.assertEqual(manager.config_name(env='test'), 'app.test')
+
+    def test_file_repository(self):
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexed_configs')
+        os.makedirs(root)
+        self.addCleanup(shutil.rmtree, root)
+        repo = FileConfigRepository(root)
+        repo.save('app', '{"version": 1}')
+        manager = IndexedConfigManager(repo, ['app.{version}', 'app'], check_interval=0)
+        self.assertEqual(manager.resolve('version', version=2), 1)
+
+        token = repo.catalog_version()
+        repo.save('app.2', '{"version": 2}')
+        self.assertNotEqual(repo.catalog_version(), token)
+        self.assertEqual(manager.resolve('version', version=2), 2)
+
+        # changes made within the same clock tick are seen as well.
+        os.remove(repo.config_path('app.2'))
+        self.assertEqual(repo.catalog_version(), token)
+        self.assertEqual(manager.resolve('version', version=2), 1)
+        repo.save('app.3', '{"version": 3}')
+        self.assertEqual(manager.resolve('version', version=3), 3)
+
+    def test_unversioned_catalog(self):
+        class UnversionedRepository(MemoryConfigRepository):
+
+            def catalog_version(self):
+                raise NotImplementedError
+
+        repo = UnversionedRepository()
+        repo.save('app', '{}')
+        manager = IndexedConfigManager(repo, ['app.{env}', 'app'], check_interval=0)
+        self.assertEqual(manager.config_name(env='test'), 'app')
+        repo.save('app.test', '{}')
+        self.assertEqual(manager.config_name(env='test'), 'app.test')
+
+
+class TestCli(unittest.TestCase):
+
+    TEST_DIR = 'clidata'
+
+    def setUp(self):
+        os.mkdir(self.TEST_DIR)
+        repo = FileConfigRepository(self.TEST_DIR)
+        for index in range(20):
+            repo.save('valid{index}'.format(index=index), json.dumps({'name': 'n', 'port': index + 1}))
+        repo.save('invalid', json.dumps({'name': None, 'port': 0}))
+        repo.save('broken', '{"name": ')
+        self.model = '{module}:CliConfig'.format(module=__name__)
+
     def tearDown(self):
         shutil.rmtree(self.TEST_DIR)
 
+    def run_cli(self, *args):
+        output = six.StringIO()
+        code = cli.main(['validate', self.TEST_DIR, '--model', self.model] + list(args), output)
+        return code, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_validate(self):
+        for jobs in ('1', '3'):
+            code, lines = self.run_cli('-j', jobs)
+            self.assertEqual(code, 1)
+            results = dict((line['config'], line) for line in lines[:-1])
+            self.assertEqual(len(results), 22)
+            self.assertTrue(all(results['valid{index}'.format(index=index)]['valid'] for index in range(20)))
+            self.assertEqual(results['invalid']['errors'], [
+                {'path': 'name', 'message': "Value for 'name' is not allowed to be null."},
+                {'path': 'port', 'message': "Value '0' for 'port' has to be in range (1, 65535)."},
+            ])
+            self.assertFalse(results['broken']['valid'])
+            self.assertIsInstance(results['broken']['duration_ms'], float)
+            self.assertEqual(lines[-1]['summary']['configs'], 22)
+            self.assertEqual(lines[-1]['summary']['invalid'], 2)
+
+        code, lines = self.run_cli('--config', 'valid1', '--config', 'valid2')
+        self.assertEqual(code, 0)
+        self.assertEqual(sorted(line['config'] for line in lines[:-1]), ['valid1', 'valid2'])
+
+    def test_compile(self):
+        output = six.StringIO()
+        path = os.path.join(self.TEST_DIR, 'configs.snapshot')
+        code = cli.main(['compile', self.TEST_DIR, path, '--config', 'valid1', '--config', 'invalid'], output)
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(output.getvalue())['summary']['configs'], 2)
+        snapshot = SnapshotValue.open(path)
+        self.assertEqual(snapshot.py_value(), {
+            'valid1': {'name': 'n', 'port': 2},
+            'invalid': {'name': None, 'port': 0},
+        })
+
+    def test_bad_model(self):
+        self.model = 'garlicconfig.models:ModelField'
+        with self.assertRaises(SystemExit):
+            self.run_cli()
+
+
+@unittest.skipIf(asyncio is None, 'asyncio API requires python 3.6 or later.')
+class TestAsyncAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.repo = MemoryConfigRepository()
+        for index in range(10):
+            self.repo.save('config{index}'.format(index=index), json.dumps({'index': index}))
+        self.async_repo = AsyncConfigRepository(self.repo, max_concurrency=2)
+        self.async_manager = AsyncConfigManager(FlatConfigManager(self.repo, default_config_name='config3'))
+        self.gather = lambda *coroutines: self.loop.run_until_complete(asyncio.gather(*coroutines))
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_repository(self):
+        names = ['config{index}'.format(index=index) for index in range(10)]
+        contents = self.gather(*[self.async_repo.aretrieve(name) for name in names])
+        self.assertEqual(contents, [self.repo.retrieve(name) for name in names])
+        self.assertEqual(self.gather(self.async_repo.alist_configs()), [set(names)])
+        with self.assertRaises(ConfigNotFound):
+            self.gather(self.async_repo.aretrieve('missing'))
+        with self.assertRaises(ValueError):
+            AsyncConfigRepository(self.repo, max_concurrency=0)
+
+    def test_loops_are_released(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            contents = loop.run_until_complete(asyncio.gather(*[
+                self.async_repo.aretrieve('config{index}'.format(index=index)) for index in range(5)
+            ]))
+        finally:
+            asyncio.set_event_loop(self.loop)
+            loop.close()
+        self.assertEqual(len(contents), 5)
+        released = weakref.ref(loop)
+        del loop
+        gc.collect()
+        self.assertIsNone(released())
+
+    def test_manager(self):
+        resolved = self.gather(
+            self.async_manager.aresolve('index'), self.async_manager.aresolve('index', name='config7'),
+        )
+        self.assertEqual(resolved, [3, 7])
+
+        configs = self.async_manager.aiterconfigs(parallel=True)
+        loaded = {}
+        while True:
+            try:
+                name, value = self.gather(configs.__anext__())[0]
+            except StopAsyncIteration:  # noqa: F821
+                break
+            loaded[name] = value.resolve('index')
+        self.assertEqual(loaded, dict(('config{index}'.format(index=index), index) for index in range(10)))
+
 
 if __name__ == '__main__':
     unittest.main()